@@ -0,0 +1,83 @@
+"""Accuracy vs latency report of CPU inference modes of `SpeechRecongition` on
+`data/sample_transcribe.mp3`.
+
+Accuracy is the character error rate (CER) against the transcript of the fp32 model.
+
+Usage:
+    python -m benchmarks.bench_cpu_inference --model_name base --num_threads 4
+"""
+
+import time
+from argparse import ArgumentParser
+from typing import Optional
+
+import numpy as np
+import whisper
+
+from vrchatbot.constants import RECOGNIZE_SAMPLE_RATE
+from vrchatbot.speech_recongnition import SpeechRecongition
+
+AUDIO_PATH = "data/sample_transcribe.mp3"
+
+
+def character_error_rate(reference: str, hypothesis: str) -> float:
+    """Levenshtein distance of characters divided by reference length."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, r in enumerate(reference, 1):
+        current = [i]
+        for j, h in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / max(len(reference), 1)
+
+
+def measure(recognizer: SpeechRecongition, audio: np.ndarray, repeat: int) -> tuple[float, str]:
+    """Returns median latency and text."""
+    recognizer.recongnize(audio)  # warm up
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _, text = recognizer.recongnize(audio)
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies)), text
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--model_name", type=str, default="base")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=str, default="data/test_results/cpu_inference_report.md")
+    args = parser.parse_args()
+
+    audio = whisper.load_audio(AUDIO_PATH)
+    inputs = {"full": audio, "3s": audio[: 3 * RECOGNIZE_SAMPLE_RATE]}
+    options = whisper.DecodingOptions(fp16=False, language="ja")
+    variants: dict[str, Optional[dict]] = {
+        "fp32": {"quantize": False, "num_threads": args.num_threads},
+        "int8": {"quantize": True, "num_threads": args.num_threads},
+        "int8+compile": {"quantize": True, "num_threads": args.num_threads, "compile_encoder": True},
+    }
+
+    references: dict[str, str] = {}
+    lines = [
+        f"model: {args.model_name}, threads: {args.num_threads}",
+        "",
+        "| variant | input | latency [s] | CER | text |",
+        "| --- | --- | --- | --- | --- |",
+    ]
+    for name, cpu_optimization in variants.items():
+        recognizer = SpeechRecongition(args.model_name, "cpu", options, cpu_optimization=cpu_optimization)
+        for input_name, wave in inputs.items():
+            latency, text = measure(recognizer, wave, args.repeat)
+            reference = references.setdefault(input_name, text)
+            cer = character_error_rate(reference, text)
+            lines.append(f"| {name} | {input_name} | {latency:.3f} | {cer:.3f} | {text} |")
+            print(lines[-1])
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    main()
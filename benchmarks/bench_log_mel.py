@@ -0,0 +1,39 @@
+"""Log mel spectrogram cost of short utterances: `whisper.pad_or_trim` +
+`whisper.log_mel_spectrogram` vs `LogMelSpectrogram`.
+
+Usage:
+    python -m benchmarks.bench_log_mel
+"""
+
+import timeit
+
+import numpy as np
+import torch
+import whisper
+
+from vrchatbot.constants import RECOGNIZE_SAMPLE_RATE
+from vrchatbot.speech_recongnition import LogMelSpectrogram
+
+DURATIONS = [0.5, 1.0, 2.0, 3.0, 5.0]  # seconds
+NUMBER = 50
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    log_mel_spectrogram = LogMelSpectrogram()
+
+    for duration in DURATIONS:
+        audio = (rng.standard_normal(int(duration * RECOGNIZE_SAMPLE_RATE)) * 0.1).astype(np.float32)
+        expected = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio))
+        assert torch.allclose(expected, log_mel_spectrogram(audio))
+
+        padded = timeit.timeit(lambda: whisper.log_mel_spectrogram(whisper.pad_or_trim(audio)), number=NUMBER) / NUMBER
+        trimmed = timeit.timeit(lambda: log_mel_spectrogram(audio), number=NUMBER) / NUMBER
+        print(
+            f"{duration:4.1f} s  padded: {padded * 1e3:7.2f} ms, trimmed: {trimmed * 1e3:7.2f} ms, "
+            f"speedup: {padded / trimmed:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
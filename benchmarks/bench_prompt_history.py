@@ -0,0 +1,92 @@
+"""Per-turn prompt assembly cost of `PromptHistory` vs joining a deque of prompts every turn.
+
+A long session is simulated with synthetic turns. Each turn trims the oldest prompts to make tail
+space, assembles the sending prompt and stores the user input and the responce. Token sizes are
+approximated by character counts so that only the assembly cost is measured.
+
+Usage:
+    python -m benchmarks.bench_prompt_history --turns 20000 --max_receptive_tokens 4000 100000
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+from collections import deque
+
+from vrchatbot.chatbot import PromptHistory
+
+BEHAVIOUR_PROMPT = "次の会話は人工知能と人間の会話です。" * 10
+
+
+class DequeHistory:
+    """Legacy storage of `ChatBot`."""
+
+    def __init__(self) -> None:
+        self.prompts = deque()
+        self.token_sizes = deque()
+        self.token_size = 0
+
+    def append(self, prompt: str, token_size: int) -> None:
+        self.prompts.append(prompt)
+        self.token_sizes.append(token_size)
+        self.token_size += token_size
+
+    def trim(self, max_token_size: int) -> None:
+        while self.token_size > max_token_size and len(self.prompts) > 0:
+            self.prompts.popleft()
+            self.token_size -= self.token_sizes.popleft()
+
+    def build(self, last: str, head: str) -> str:
+        return " ".join([head] + list(self.prompts) + [last])
+
+
+def make_turns(n: int, seed: int = 0) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    chars = "あいうえおかきくけこさしすせそたちつてと、。"
+    return [
+        (
+            "人間: " + "".join(rng.choices(chars, k=rng.randint(5, 40))) + "\n人工知能:",
+            "".join(rng.choices(chars, k=rng.randint(10, 120))),
+        )
+        for _ in range(n)
+    ]
+
+
+def run(history, turns: list[tuple[str, str]], max_receptive_tokens: int, tail_space: int) -> list[float]:
+    """Returns elapsed seconds of each turn."""
+    elapsed = []
+    limit = max_receptive_tokens - len(BEHAVIOUR_PROMPT) - tail_space
+    for user_input, text in turns:
+        start = time.perf_counter()
+        history.trim(limit)
+        history.build(user_input, BEHAVIOUR_PROMPT)
+        history.append(user_input, len(user_input))
+        history.append(text, len(text))
+        elapsed.append(time.perf_counter() - start)
+    return elapsed
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20000)
+    parser.add_argument("--max_receptive_tokens", type=int, nargs="+", default=[4000, 100000])
+    parser.add_argument("--tail_space", type=int, default=384)
+    parser.add_argument("--checkpoints", type=int, default=5)
+    args = parser.parse_args()
+
+    turns = make_turns(args.turns)
+    window = args.turns // args.checkpoints
+    for max_receptive_tokens in args.max_receptive_tokens:
+        print(f"--- max_receptive_tokens={max_receptive_tokens} ---")
+        results = {
+            name: run(factory(), turns, max_receptive_tokens, args.tail_space)
+            for name, factory in [("deque+join", DequeHistory), ("PromptHistory", PromptHistory)]
+        }
+        print(f"{'turns':>12} " + " ".join(f"{name:>16}" for name in results) + "  [us/turn]")
+        for i in range(args.checkpoints):
+            row = [sum(r[i * window : (i + 1) * window]) / window * 1e6 for r in results.values()]
+            print(f"{(i + 1) * window:>12} " + " ".join(f"{v:16.2f}" for v in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Throughput of sequential vs batched speech recognition.
+
+Utterances of 1 ~ 5 seconds are cut from `data/sample_transcribe.mp3`.
+
+Usage:
+    python -m benchmarks.bench_recognize_batch --model_name base --device cpu
+"""
+
+import time
+from argparse import ArgumentParser
+
+import whisper
+
+from vrchatbot.constants import RECOGNIZE_SAMPLE_RATE
+from vrchatbot.speech_recongnition import SpeechRecongition
+
+AUDIO_PATH = "data/sample_transcribe.mp3"
+
+
+def make_utterances(n: int) -> list:
+    audio = whisper.load_audio(AUDIO_PATH)
+    utterances = []
+    position = 0
+    for i in range(n):
+        length = (1 + i % 5) * RECOGNIZE_SAMPLE_RATE
+        if position + length > len(audio):
+            position = 0
+        utterances.append(audio[position : position + length])
+        position += length
+    return utterances
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--model_name", type=str, default="base")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--num_utterances", type=int, default=16)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[4, 8, 16])
+    args = parser.parse_args()
+
+    recognizer = SpeechRecongition(
+        args.model_name, args.device, whisper.DecodingOptions(fp16=args.device != "cpu", language="ja")
+    )
+    utterances = make_utterances(args.num_utterances)
+    recognizer.recognize_batch(utterances[:1])  # warm up
+
+    start = time.perf_counter()
+    sequential = [recognizer.recongnize(u)[1] for u in utterances]
+    elapsed = time.perf_counter() - start
+    print(f"sequential:    {len(utterances) / elapsed:6.2f} utterances/s")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        batched = []
+        for i in range(0, len(utterances), batch_size):
+            batched += [text for _, text in recognizer.recognize_batch(utterances[i : i + batch_size])]
+        elapsed = time.perf_counter() - start
+        same = sum(a == b for a, b in zip(sequential, batched))
+        print(
+            f"batch_size={batch_size:<3} {len(utterances) / elapsed:6.2f} utterances/s "
+            f"(same text: {same}/{len(utterances)})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Micro benchmark of silence detection for one `Recorder` block.
+
+Usage:
+    python -m benchmarks.bench_silence
+"""
+
+import timeit
+from typing import Optional
+
+import numpy as np
+
+from vrchatbot.recorder import check_silence_end_point, is_silent
+
+BUFFER_SIZE = 2048
+SILENCE_CHECK_CHUNK = 1024
+VOLUME_THRESHOLD = 0.02
+NUMBER = 10000
+
+
+def loop_check_silence_end_point(
+    wave: np.ndarray, threshold: float, chunk: int, stride: Optional[int] = None
+) -> Optional[int]:
+    """Previous implementation of `check_silence_end_point`."""
+    if stride is None:
+        stride = chunk
+
+    for i in range(0, len(wave), stride):
+        s = is_silent(wave[i : i + chunk], threshold)
+        if not s:
+            return i
+
+    return None
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    waves = {
+        "silent": (rng.standard_normal(BUFFER_SIZE) * 0.001).astype("float32"),
+        "voiced": (rng.standard_normal(BUFFER_SIZE) * 0.1).astype("float32"),
+        "onset": np.concatenate(
+            [rng.standard_normal(BUFFER_SIZE // 2) * 0.001, rng.standard_normal(BUFFER_SIZE // 2) * 0.1]
+        ).astype("float32"),
+    }
+    strides = {"stride=chunk": None, "stride=chunk/4": SILENCE_CHECK_CHUNK // 4}
+
+    print(f"buffer_size={BUFFER_SIZE}, silence_check_chunk={SILENCE_CHECK_CHUNK}, number={NUMBER}")
+    for wave_name, wave in waves.items():
+        for stride_name, stride in strides.items():
+            args = (wave, VOLUME_THRESHOLD, SILENCE_CHECK_CHUNK, stride)
+            assert loop_check_silence_end_point(*args) == check_silence_end_point(*args)
+
+            loop = timeit.timeit(lambda: loop_check_silence_end_point(*args), number=NUMBER) / NUMBER
+            vectorized = timeit.timeit(lambda: check_silence_end_point(*args), number=NUMBER) / NUMBER
+            print(
+                f"{wave_name:>6}, {stride_name:<15} loop: {loop * 1e6:8.2f} us, "
+                f"vectorized: {vectorized * 1e6:8.2f} us, speedup: {loop / vectorized:5.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
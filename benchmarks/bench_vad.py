@@ -0,0 +1,111 @@
+"""Compare voice activity detectors on the labelled scenes of `vad_dataset`.
+
+Each scene is split into recorded segments with the same endpointing as
+`Recorder.record_forever`. A segment is counted as non-speech when it overlaps labelled speech
+by less than `MIN_SPEECH_OVERLAP` seconds. Those segments would be sent to
+`SpeechRecongition.recongnize` for nothing.
+
+Usage:
+    python -m benchmarks.bench_vad
+"""
+
+from typing import Callable
+
+import numpy as np
+
+from benchmarks.vad_dataset import SR, Scene, make_scenes
+from vrchatbot.recorder import EnergyVAD
+from vrchatbot.vad import SpectralVAD, VoiceActivityDetector
+
+BUFFER_SIZE = 2048
+SILENCE_DURATION_FOR_STOP = 0.8
+MAX_RECORDING_DURATION = 30
+MIN_SPEECH_OVERLAP = 0.2  # seconds
+MIN_UTTERANCE_COVERAGE = 0.8
+
+ENGINES: dict[str, Callable[[], VoiceActivityDetector]] = {
+    "energy": lambda: EnergyVAD(0.02, 1024),
+    "spectral": lambda: SpectralVAD(SR),
+}
+
+
+def segment(vad: VoiceActivityDetector, wave: np.ndarray) -> list[tuple[int, int]]:
+    """Endpointing of `Recorder.record_forever`."""
+    vad.reset()
+    segments = []
+    record_start = False
+    silence_length = 0
+    start = end = 0
+    for position in range(0, len(wave) - BUFFER_SIZE + 1, BUFFER_SIZE):
+        start_idx = vad.detect(wave[position : position + BUFFER_SIZE])
+        if start_idx is None and not record_start:
+            continue
+        elif start_idx is not None and not record_start:
+            record_start = True
+            start = position + start_idx
+        elif start_idx is None:
+            silence_length += BUFFER_SIZE
+        else:
+            silence_length = 0
+
+        end = position + BUFFER_SIZE
+        if silence_length >= SILENCE_DURATION_FOR_STOP * SR or end - start >= MAX_RECORDING_DURATION * SR:
+            segments.append((start, end))
+            record_start = False
+            silence_length = 0
+
+    if record_start:
+        segments.append((start, end))
+    return segments
+
+
+def overlap(a: tuple[int, int], b: tuple[int, int]) -> int:
+    return max(0, min(a[1], b[1]) - max(a[0], b[0]))
+
+
+def evaluate(scene: Scene, segments: list[tuple[int, int]]) -> dict:
+    non_speech = [s for s in segments if sum(overlap(s, u) for u in scene.speech_ranges) < MIN_SPEECH_OVERLAP * SR]
+    missed = [
+        u for u in scene.speech_ranges if sum(overlap(s, u) for s in segments) < MIN_UTTERANCE_COVERAGE * (u[1] - u[0])
+    ]
+    return {
+        "segments": len(segments),
+        "non_speech_segments": len(non_speech),
+        "missed_utterances": len(missed),
+        "sent_seconds": sum(e - s for s, e in segments) / SR,
+        "non_speech_seconds": sum(e - s - sum(overlap((s, e), u) for u in scene.speech_ranges) for s, e in segments)
+        / SR,
+    }
+
+
+def main() -> None:
+    scenes = make_scenes()
+    n_utterances = sum(len(s.speech_ranges) for s in scenes)
+    print(f"{len(scenes)} scenes, {n_utterances} utterances")
+    for name, factory in ENGINES.items():
+        totals = {
+            "segments": 0,
+            "non_speech_segments": 0,
+            "missed_utterances": 0,
+            "sent_seconds": 0.0,
+            "non_speech_seconds": 0.0,
+        }
+        print(f"--- {name} ---")
+        for scene in scenes:
+            result = evaluate(scene, segment(factory(), scene.wave))
+            print(
+                f"{scene.name:<22} segments: {result['segments']:3d}, non-speech: {result['non_speech_segments']:3d}, "
+                f"missed: {result['missed_utterances']}, sent: {result['sent_seconds']:5.1f} s "
+                f"(non-speech: {result['non_speech_seconds']:5.1f} s)"
+            )
+            for key in totals:
+                totals[key] += result[key]
+        print(
+            f"{'total':<22} segments: {totals['segments']:3d}, non-speech: {totals['non_speech_segments']:3d}, "
+            f"missed: {totals['missed_utterances']}, sent: {totals['sent_seconds']:5.1f} s "
+            f"(non-speech: {totals['non_speech_seconds']:5.1f} s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""Benchmark suite of the hot paths with regression tracking.
+
+Every case runs headless on CPU. Cases which need a model or a dictionary that cannot be loaded,
+e.g. Whisper weights or the pyopenjtalk dictionary without network, are skipped.
+
+Each run is appended to a JSONL history. A case regresses when its median time exceeds the median
+of its last `--baseline_runs` runs on the same machine by more than its threshold, and then the
+command exits with status 1. Results of regressed cases are kept apart from the baseline, so that
+a regression does not become the new baseline, unless `--update_baseline` is given.
+
+Usage:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --filter recorder chatbot --threshold 0.3
+    python -m benchmarks.suite --no_save  # compare without appending to the history
+    python -m benchmarks.suite --update_baseline  # accept an intended slowdown as the new baseline
+"""
+
+import json
+import os
+import platform
+import queue
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from vrchatbot.constants import RECOGNIZE_SAMPLE_RATE
+
+HISTORY_PATH = "data/benchmarks/history.jsonl"
+AUDIO_PATH = "data/sample_transcribe.mp3"
+DEFAULT_THRESHOLD = 0.2
+SENTENCE = "こんにちは、今日はとても良い天気ですね。"
+
+
+class Skip(Exception):
+    """Raised in setup when a case cannot run on this machine."""
+
+
+class Case:
+    """Benchmark case. `setup` returns the function to time, which is called `number` times per
+    repeat."""
+
+    def __init__(
+        self, name: str, setup: Callable[[], Callable[[], Any]], number: int, repeat: int, threshold: float
+    ) -> None:
+        self.name = name
+        self.setup = setup
+        self.number = number
+        self.repeat = repeat
+        self.threshold = threshold
+
+    def run(self) -> dict:
+        """Returns seconds per call: `median` and `min` of repeats."""
+        func = self.setup()
+        func()  # warm up
+        times = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            for _ in range(self.number):
+                func()
+            times.append((time.perf_counter() - start) / self.number)
+        return {"median": statistics.median(times), "min": min(times), "number": self.number, "repeat": self.repeat}
+
+
+CASES: dict[str, Case] = {}
+
+
+def case(name: str, number: int = 1, repeat: int = 5, threshold: float = DEFAULT_THRESHOLD) -> Callable:
+    """Register setup function as a benchmark case."""
+
+    def decorator(setup: Callable[[], Callable[[], Any]]) -> Callable[[], Callable[[], Any]]:
+        CASES[name] = Case(name, setup, number, repeat, threshold)
+        return setup
+
+    return decorator
+
+
+def speech_like_wave(seconds: float, sample_rate: int = RECOGNIZE_SAMPLE_RATE, seed: int = 0) -> np.ndarray:
+    """Noise floor with 1 ~ 3 second voiced bursts separated by 1 second pauses."""
+    rng = np.random.default_rng(seed)
+    wave = (rng.standard_normal(int(seconds * sample_rate)) * 0.001).astype(np.float32)
+    position = sample_rate
+    while position < len(wave):
+        length = int(rng.uniform(1, 3) * sample_rate)
+        wave[position : position + length] += (
+            rng.standard_normal(len(wave[position : position + length])) * 0.1
+        ).astype(np.float32)
+        position += length + sample_rate
+    return wave
+
+
+@case("silence.check_silence_end_point", number=10000)
+def silence():
+    from vrchatbot.recorder import check_silence_end_point
+
+    wave = np.zeros(2048, dtype=np.float32)  # silent block is scanned to the end.
+    return lambda: check_silence_end_point(wave, 0.01, 1024, 256)
+
+
+@case("recorder.record_forever_60s")
+def recorder_loop():
+    from vrchatbot.audio_io import ArraySource
+    from vrchatbot.recorder import Recorder
+
+    wave = speech_like_wave(60)
+
+    def run():
+        recorder = Recorder(source=ArraySource(wave, RECOGNIZE_SAMPLE_RATE))
+        recorder.record_forever(queue.Queue())
+
+    return run
+
+
+@case("audio_buffer.resample_10s_48k_to_44k", number=10)
+def resample():
+    from vrchatbot.audio_buffer import resample
+
+    wave = (speech_like_wave(10, 48000) * 2**15).astype(np.int16)
+    return lambda: resample(wave, 48000, 44100, 1 / 2**15)
+
+
+@case("recognize.sample_transcribe_30s", repeat=3)
+def recognize():
+    try:
+        import whisper
+
+        from vrchatbot.speech_recongnition import SpeechRecongition
+
+        audio = whisper.load_audio(AUDIO_PATH)[: 30 * RECOGNIZE_SAMPLE_RATE]
+        recognizer = SpeechRecongition("base", "cpu", whisper.DecodingOptions(fp16=False, language="ja"))
+    except Exception as e:
+        raise Skip(f"{type(e).__name__}: {e}")
+    return lambda: recognizer.recongnize(audio)
+
+
+class StubCompletionHandler(BaseHTTPRequestHandler):
+    """Completion API which returns a fixed responce in 5 streamed chunks."""
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        chunks = [SENTENCE[i : i + 4] for i in range(0, len(SENTENCE), 4)]
+        if not request.get("stream", False):
+            body = json.dumps({"choices": [{"text": SENTENCE, "index": 0, "finish_reason": "stop"}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for chunk in chunks:
+            data = json.dumps({"choices": [{"text": chunk, "index": 0, "finish_reason": None}]})
+            self.wfile.write(f"data: {data}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def stub_chatbot(max_receptive_tokens: int = 4096):
+    """Returns :class:`ChatBot` which talks to a local stub completion server, with its history full."""
+    import openai
+
+    from vrchatbot.chatbot import ChatBot
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCompletionHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    openai.api_base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write("stub-key")
+    try:
+        chatbot = ChatBot(
+            f.name, max_receptive_tokens=max_receptive_tokens, behaviour_prompt="次の会話は人工知能と人間の会話です。"
+        )
+    finally:
+        os.remove(f.name)
+    while chatbot.current_token_size < max_receptive_tokens - chatbot.tail_space * 2:
+        user_input, user_input_token_size, _ = chatbot.make_sending_prompt(SENTENCE)
+        chatbot.store_turn(user_input, user_input_token_size, SENTENCE)
+    return chatbot
+
+
+@case("chatbot.make_sending_prompt", number=200)
+def chatbot_prompt():
+    chatbot = stub_chatbot()
+    return lambda: chatbot.make_sending_prompt(SENTENCE)
+
+
+@case("chatbot.responce_stream_stub", number=20, threshold=0.5)
+def chatbot_stream():
+    chatbot = stub_chatbot()
+    return lambda: "".join(chatbot.responce_stream(SENTENCE))
+
+
+@case("speaker.synthesize", number=5)
+def synthesize():
+    try:
+        import pyopenjtalk
+
+        pyopenjtalk.tts("あ")
+    except Exception as e:
+        raise Skip(f"{type(e).__name__}: {e}")
+    return lambda: pyopenjtalk.tts(SENTENCE)
+
+
+@case("cli.startup_import", repeat=5, threshold=0.5)
+def cli_startup():
+    # Interpreter startup and import of the CLI module, which every command pays.
+    command = [sys.executable, "-c", "import vrchatbot.__main__"]
+    return lambda: subprocess.run(command, check=True)
+
+
+def machine() -> dict:
+    """Fingerprint of the machine. Runs are compared only on the same machine."""
+    return {
+        "node": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path: str) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+
+def baseline(history: list[dict], name: str, runs: int) -> Optional[float]:
+    """Median of the median times of the last `runs` runs of case `name` on this machine."""
+    fingerprint = machine()
+    medians = [r["results"][name]["median"] for r in history if r["machine"] == fingerprint and name in r["results"]]
+    if len(medians) == 0:
+        return None
+    return statistics.median(medians[-runs:])
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.3f} s"
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--filter", type=str, nargs="*", default=None, help="Run cases whose name contains any of them."
+    )
+    parser.add_argument("--history", type=str, default=HISTORY_PATH)
+    parser.add_argument("--threshold", type=float, default=None, help="Allowed slowdown ratio of all cases.")
+    parser.add_argument("--baseline_runs", type=int, default=5)
+    parser.add_argument("--no_save", action="store_true", help="Do not append this run to the history.")
+    parser.add_argument(
+        "--update_baseline", action="store_true", help="Use results of regressed cases for the baseline too."
+    )
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    cases = [c for c in CASES.values() if not args.filter or any(f in c.name for f in args.filter)]
+    results: dict[str, dict] = {}
+    skipped: dict[str, str] = {}
+    regressions = []
+
+    print(f"{'case':<40} {'median':>12} {'min':>12} {'baseline':>12} {'change':>8}")
+    for c in cases:
+        try:
+            result = c.run()
+        except Skip as e:
+            skipped[c.name] = str(e)
+            print(f"{c.name:<40} skipped: {e}")
+            continue
+        results[c.name] = result
+
+        base = baseline(history, c.name, args.baseline_runs)
+        threshold = c.threshold if args.threshold is None else args.threshold
+        row = f"{c.name:<40} {format_seconds(result['median']):>12} {format_seconds(result['min']):>12}"
+        if base is None:
+            print(f"{row} {'-':>12} {'-':>8}")
+            continue
+        change = result["median"] / base - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(c.name)
+        print(f"{row} {format_seconds(base):>12} {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+
+    if not args.no_save and len(results) > 0:
+        regressed = {} if args.update_baseline else {name: results.pop(name) for name in regressions}
+        record = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "machine": machine(),
+            "results": results,  # baseline of next runs
+            "regressed": regressed,
+            "skipped": skipped,
+        }
+        os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    if len(regressions) > 0:
+        print(f"Regressed: {', '.join(regressions)}")
+        if args.update_baseline:
+            return
+        print("They are not used for the baseline. Run with --update_baseline if the slowdown is intended.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Labelled test set for voice activity detection.
+
+Scenes imitate VRChat worlds: speakers talking over background music, fan noise, clicks or a
+quiet room. Waves are synthesized deterministically so the labels are exact.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from vrchatbot.constants import RECOGNIZE_SAMPLE_RATE
+
+SR = RECOGNIZE_SAMPLE_RATE
+
+
+@dataclass
+class Scene:
+    name: str
+    wave: np.ndarray
+    speech_ranges: list[tuple[int, int]]  # [start, end) sample indices of utterances.
+
+
+def _rms_normalize(wave: np.ndarray, rms: float) -> np.ndarray:
+    return wave * (rms / (np.sqrt(np.mean(wave**2)) + 1e-12))
+
+
+def synth_speech(duration: float, rms: float, rng: np.random.Generator) -> np.ndarray:
+    """Speech like wave: glottal harmonics shaped by moving formants with syllabic envelopes."""
+    f0_base = rng.uniform(100, 240)
+    pieces = []
+    length = int(duration * SR)
+    total = 0
+    while total < length:
+        syllable = int(rng.uniform(0.12, 0.25) * SR)
+        t = np.arange(syllable) / SR
+        f0 = f0_base * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t + rng.uniform(0, 6)))
+        phase = 2 * np.pi * np.cumsum(f0) / SR
+        formants = [rng.uniform(300, 800), rng.uniform(900, 2300), rng.uniform(2500, 3200)]
+        wave = np.zeros(syllable)
+        for k in range(1, int(4000 / f0_base)):
+            freq = k * f0_base
+            gain = sum(np.exp(-(((freq - f) / 120) ** 2)) for f in formants) / k**0.5
+            wave += gain * np.sin(k * phase)
+        if rng.random() < 0.2:  # unvoiced consonant
+            wave[: syllable // 4] += rng.standard_normal(syllable // 4) * 0.05
+        wave *= np.hanning(syllable)
+        pieces.append(wave)
+        total += syllable
+        if rng.random() < 0.2:
+            gap = int(rng.uniform(0.03, 0.12) * SR)
+            pieces.append(np.zeros(gap))
+            total += gap
+    return _rms_normalize(np.concatenate(pieces)[:length], rms)
+
+
+def synth_music(duration: float, rms: float, rng: np.random.Generator) -> np.ndarray:
+    """Sustained chords with a bass line."""
+    length = int(duration * SR)
+    wave = np.zeros(length)
+    note = int(rng.uniform(0.4, 0.8) * SR)
+    for start in range(0, length, note):
+        n = min(note, length - start)
+        t = np.arange(n) / SR
+        root = 110 * 2 ** (rng.integers(0, 12) / 12)
+        env = np.minimum(1.0, np.minimum(t / 0.02, (n / SR - t) / 0.02))
+        for ratio in (1, 1.26, 1.5, 2, 3):
+            for k in range(1, 5):
+                wave[start : start + n] += env * np.sin(2 * np.pi * root * ratio * k * t) / k
+        wave[start : start + n] += 2 * env * np.sin(2 * np.pi * root / 2 * t)
+    return _rms_normalize(wave, rms)
+
+
+def synth_fan(duration: float, rms: float, rng: np.random.Generator) -> np.ndarray:
+    """Low passed noise with a hum."""
+    length = int(duration * SR)
+    noise = np.cumsum(rng.standard_normal(length))
+    noise -= np.convolve(noise, np.ones(64) / 64, mode="same")
+    t = np.arange(length) / SR
+    return _rms_normalize(noise + 0.5 * np.std(noise) * np.sin(2 * np.pi * 60 * t), rms)
+
+
+def synth_clicks(duration: float, rms: float, rng: np.random.Generator) -> np.ndarray:
+    """Keyboard like short impulses."""
+    length = int(duration * SR)
+    wave = np.zeros(length)
+    for start in rng.integers(0, length - 400, int(duration * 6)):
+        wave[start : start + 400] += rng.standard_normal(400) * np.exp(-np.arange(400) / 60)
+    return _rms_normalize(wave, rms)
+
+
+def _scene(name: str, background: np.ndarray, utterances: list[tuple[float, float, float]], rng) -> Scene:
+    wave = background
+    ranges = []
+    for start, length, rms in utterances:
+        s, e = int(start * SR), int((start + length) * SR)
+        wave[s:e] += synth_speech(length, rms, rng)
+        ranges.append((s, e))
+    return Scene(name, np.clip(wave, -1, 1).astype(np.float32), ranges)
+
+
+def make_scenes(seed: int = 0) -> list[Scene]:
+    """Returns labelled scenes."""
+    rng = np.random.default_rng(seed)
+    utterances = [(2.0, 2.5, 0.12), (8.0, 1.5, 0.08), (13.0, 3.0, 0.15)]
+    quiet = [(2.0, 2.5, 0.03), (8.0, 1.5, 0.02), (13.0, 3.0, 0.04)]
+    return [
+        _scene("quiet_room", rng.standard_normal(18 * SR) * 0.001, utterances, rng),
+        _scene("music_bgm", synth_music(18, 0.05, rng), utterances, rng),
+        _scene("fan_noise", synth_fan(18, 0.03, rng), utterances, rng),
+        _scene("clicks_quiet_speaker", synth_clicks(18, 0.03, rng), quiet, rng),
+        _scene("music_only", synth_music(18, 0.08, rng), [], rng),
+        _scene("fan_only", synth_fan(18, 0.05, rng), [], rng),
+        _scene("music_starts", np.concatenate([np.zeros(3 * SR), synth_music(15, 0.05, rng)]), [], rng),
+    ]
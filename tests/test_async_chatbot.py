@@ -0,0 +1,184 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from vrchatbot import async_chatbot as mod
+
+
+class StubServer(ThreadingHTTPServer):
+    """Completion API stub. Each request consumes one `(delay, status, text)` of `script`."""
+
+    def __init__(self, script: list[tuple[float, int, str]]) -> None:
+        self.script = list(script)
+        self.requests = []
+        self.client_ports = []
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), StubHandler)
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests.append((self.path, body))
+            self.server.client_ports.append(self.client_address[1])
+            delay, status, text = self.server.script.pop(0)
+
+        time.sleep(delay)
+        if status == 200:
+            data = json.dumps({"choices": [{"text": text, "index": 0}]}).encode()
+        else:
+            data = json.dumps({"error": {"message": text}}).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):  # client timed out.
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(script):
+        server = StubServer(script)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def key_file(tmp_path):
+    path = tmp_path / "API_KEY.txt"
+    path.write_text("dummy", encoding="utf-8")
+    return path
+
+
+def make_bot(key_file, server, **kwds):
+    return mod.AsyncChatBot(key_file, api_base=server.api_base, backoff_base=0.01, **kwds)
+
+
+def test_AsyncChatBot__init__(key_file):
+    bot = mod.AsyncChatBot(key_file, api_base="http://localhost/v1")
+    assert bot.request_timeout == 30.0
+    assert bot.max_retries == 4
+    assert bot.url == "http://localhost/v1/engines/text-davinci-003/completions"
+    assert bot.completion_kwds == {}
+
+
+def test_AsyncChatBot_backoff(key_file):
+    bot = mod.AsyncChatBot(key_file, backoff_base=1.0, backoff_max=4.0)
+    for attempt in range(6):
+        assert 0 <= bot.backoff(attempt) <= min(4.0, 2**attempt)
+    assert bot.backoff(0, retry_after=3.0) == 3.0
+
+
+def test_AsyncChatBot_retry(key_file, stub_server):
+    server = stub_server([(0, 500, "error"), (0, 429, "rate limit"), (0, 200, " こんにちは")])
+    bot = make_bot(key_file, server, stop=["\n"])
+
+    async def run():
+        async with bot:
+            return await bot.responce("やあ")
+
+    assert asyncio.run(run()) == " こんにちは"
+    assert bot.retry_count == 2
+    assert len(set(server.client_ports)) == 1  # connection is reused.
+    path, body = server.requests[0]
+    assert path == "/v1/engines/text-davinci-003/completions"
+    assert body["stop"] == ["\n"]
+    assert body["prompt"].endswith(f"{bot.human_name} やあ\n{bot.ai_name}")
+    assert list(bot.stored_prompts) == [f"{bot.human_name} やあ\n{bot.ai_name}", " こんにちは"]
+
+
+def test_AsyncChatBot_timeout(key_file, stub_server):
+    server = stub_server([(0.5, 200, "late"), (0, 200, "ok")])
+    bot = make_bot(key_file, server, request_timeout=0.2)
+
+    async def run():
+        async with bot:
+            return await bot.responce("やあ")
+
+    assert asyncio.run(run()) == "ok"
+    assert bot.retry_count == 1
+
+
+def test_AsyncChatBot_errors(key_file, stub_server):
+    server = stub_server([(0, 400, "bad request"), (0, 503, "busy"), (0, 503, "busy")])
+    bot = make_bot(key_file, server, max_retries=1)
+
+    async def run():
+        async with bot:
+            with pytest.raises(mod.ChatBotAPIError) as e:
+                await bot.responce("やあ")
+            assert e.value.status == 400
+            with pytest.raises(mod.ChatBotAPIError) as e:
+                await bot.responce("やあ")
+            assert e.value.status == 503
+
+    asyncio.run(run())
+    assert bot.retry_count == 1
+    assert len(bot.stored_prompts) == 0
+    assert bot.current_token_size == 0
+
+
+def test_AsyncChatBot_failed_request_history(key_file, stub_server):
+    server = stub_server([(0, 400, "bad request")])
+    bot = make_bot(key_file, server, max_tokens=16, free_tokens_for_user=16, max_receptive_tokens=300)
+    for i in range(30):
+        user_input = f"{bot.human_name} 質問{i}\n{bot.ai_name}"
+        bot.store_turn(user_input, bot.count_prompt_tokens(user_input), f" 答え{i}")
+    before = list(bot.stored_prompts)
+
+    async def run():
+        async with bot:
+            with pytest.raises(mod.ChatBotAPIError):
+                await bot.responce("やあ")
+
+    asyncio.run(run())
+    after = list(bot.stored_prompts)
+    assert 0 < len(after) < len(before)  # the oldest prompts were removed before the request.
+    assert after == before[-len(after) :]  # the failed turn is not stored.
+    assert bot.current_token_size <= bot.max_receptive_tokens - bot.max_tokens
+
+
+def test_AsyncChatBot_submit(key_file, stub_server):
+    server = stub_server([(1.0, 200, "old"), (0, 200, "new")])
+    bot = make_bot(key_file, server)
+
+    async def run():
+        async with bot:
+            old = bot.submit("一つ目")
+            await asyncio.sleep(0.2)
+            new = bot.submit("二つ目")  # pre-empts the first completion.
+            assert await new == "new"
+            await asyncio.sleep(0)
+            assert old.cancelled()
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    assert time.perf_counter() - start < 1.0
+    assert list(bot.stored_prompts) == [f"{bot.human_name} 二つ目\n{bot.ai_name}", "new"]
@@ -0,0 +1,90 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from vrchatbot import audio_buffer as mod
+
+
+def measure_peak(func, *args, **kwds):
+    """Returns result of func and peak bytes allocated while calling it."""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        result = func(*args, **kwds)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def test_to_float32():
+    f = mod.to_float32
+
+    wave = np.zeros((1024, 1), dtype=np.float32)
+    out = f(wave)
+    assert out.shape == (1024,)
+    assert np.shares_memory(out, wave)  # zero-copy
+
+    wave = np.full(1024, 2**14, dtype=np.float64)
+    out = f(wave, mod.INT16_SCALE)
+    assert out.dtype == np.float32
+    np.testing.assert_array_equal(out, 0.5)
+    assert f(np.arange(4, dtype=np.int16)).dtype == np.float32
+
+
+def test_resample():
+    f = mod.resample
+
+    ramp = np.arange(10, dtype=np.float64)
+    np.testing.assert_allclose(
+        f(ramp, 1, 2), [0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7, 7.5, 8, 8.5, 9, 9]
+    )
+    np.testing.assert_allclose(f(ramp, 3, 2), [0, 1.5, 3, 4.5, 6, 7.5])
+    np.testing.assert_allclose(f(ramp, 2, 1, scale=0.5), [0, 1, 2, 3, 4])
+    assert len(f(np.zeros(0), 48000, 44100)) == 0
+
+    sr, target = 48000, 44100
+    wave = np.sin(2 * np.pi * 440 * np.arange(sr) / sr)
+    out = f(wave, sr, target, block_size=1000)
+    assert out.dtype == np.float32
+    assert len(out) == mod.resampled_length(sr, sr, target) == target
+    np.testing.assert_allclose(out, np.sin(2 * np.pi * 440 * np.arange(target) / target), atol=1e-3)
+
+    buffer = np.empty(target, dtype=np.float32)
+    assert f(wave, sr, target, out=buffer) is buffer
+    with pytest.raises(ValueError):
+        f(wave, sr, target, out=np.empty(10, dtype=np.float32))
+
+    # Near full scale int16. Differences of neighbouring samples exceed the int16 range.
+    square = np.tile(np.array([32767, -32767], dtype=np.int16), sr // 2)
+    out = f(square, sr, target, mod.INT16_SCALE)
+    expected = np.interp(np.arange(target) * sr / target, np.arange(sr), square.astype(np.float64)) / 2**15
+    np.testing.assert_allclose(out, expected, atol=1e-4)
+
+
+def test_convert():
+    f = mod.convert
+
+    wave = np.zeros(480, dtype=np.float32)
+    out, sr = f(wave, 48000)
+    assert np.shares_memory(out, wave) and sr == 48000
+    out, sr = f(wave, 48000, 24000)
+    assert len(out) == 240 and sr == 24000
+
+
+@pytest.mark.parametrize("target_rate", [None, 48000, 44100, 16000])
+def test_convert_allocation(target_rate):
+    """float64 int16-range output of tts is converted with one allocation of the float32 output."""
+    wave = np.random.default_rng(0).uniform(-(2**15), 2**15, 48000 * 10)
+
+    (out, _), peak = measure_peak(mod.convert, wave, 48000, target_rate, mod.INT16_SCALE)
+    assert out.dtype == np.float32
+    assert out.nbytes <= peak < out.nbytes + 512 * 1024  # temporaries are bounded by block size.
+
+    _, legacy_peak = measure_peak(lambda: (wave / 2**15).astype(np.float32))
+    assert peak < legacy_peak
+
+    _, peak = measure_peak(mod.convert, out.reshape(-1, 1), 48000)
+    assert peak < 1024  # zero-copy
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+import pytest
+
+from vrchatbot import audio_io as mod
+
+
+def test_load_and_save_wave(tmp_path):
+    path = str(tmp_path / "a.wav")
+    wave = np.sin(np.linspace(0, 100, 16000)).astype(np.float32) * 0.5
+    mod.save_wave(path, wave, 16000)
+
+    loaded, sr = mod.load_wave(path)
+    assert sr == 16000
+    assert loaded.dtype == np.float32
+    np.testing.assert_allclose(loaded, wave, atol=2**-15)
+
+    loaded, sr = mod.load_wave(path, 8000)
+    assert (len(loaded), sr) == (8000, 8000)
+
+
+def test_ArraySource():
+    wave = np.arange(10, dtype=np.float32)
+    source = mod.ArraySource(wave, 16000)
+
+    with source.recorder(16000, 1) as mic:
+        block = mic.record(4)
+        assert block.shape == (4, 1)
+        assert np.shares_memory(block, source.wave)  # zero-copy
+    with source.recorder(16000, 1) as mic:  # continues across streams.
+        np.testing.assert_array_equal(mic.record(4)[:, 0], [4, 5, 6, 7])
+        assert not source.ended.is_set()
+        np.testing.assert_array_equal(mic.record(4)[:, 0], [8, 9, 0, 0])
+        assert source.ended.is_set()
+        assert mic.record(2).shape == (2, 1)
+
+    source = mod.ArraySource(wave, 16000, loop=True)
+    with source.recorder(16000, 2) as mic:
+        block = mic.record(12)
+        assert block.shape == (12, 2)
+        np.testing.assert_array_equal(block[:, 1], [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 1])
+    assert not source.ended.is_set()
+
+    source = mod.ArraySource(np.zeros(16000), 16000)
+    with source.recorder(8000, 1) as mic:  # resampled
+        assert sum(len(mic.record(1000)) for _ in range(8)) == 8000
+    assert not source.ended.is_set()
+    with source.recorder(8000, 1) as mic:
+        mic.record(1)
+    assert source.ended.is_set()
+
+
+def test_ArraySource_realtime():
+    source = mod.ArraySource(np.zeros(16000), 16000, realtime=True)
+    start = time.perf_counter()
+    with source.recorder(16000, 1) as mic:
+        for _ in range(5):
+            mic.record(1600)
+    assert time.perf_counter() - start == pytest.approx(0.5, abs=0.1)
+
+    source = mod.ArraySource(np.zeros(16000), 16000)
+    start = time.perf_counter()
+    with source.recorder(16000, 1) as mic:
+        for _ in range(10):
+            mic.record(1600)
+    assert time.perf_counter() - start < 0.1
+
+
+def test_sinks(tmp_path):
+    sink = mod.open_sink("null", realtime=True)
+    start = time.perf_counter()
+    sink.play(np.zeros(4800), 48000)
+    assert time.perf_counter() - start == pytest.approx(0.1, abs=0.05)
+    assert sink.played_duration == 0.1
+    assert sink.opened == sink.closed == 1
+
+    path = str(tmp_path / "capture.wav")
+    sink = mod.open_sink("capture", path=path)
+    with sink.player(48000) as player:
+        player.play(np.full(4800, 0.5))
+        player.play(np.full((4800, 1), 0.25, dtype=np.float32))
+    sink.play(np.zeros(800), 16000)
+    wave, sr = sink.wave()
+    assert (len(wave), sr) == (4800 * 2 + 2400, 48000)
+    np.testing.assert_allclose(wave[:4800], 0.5)
+    sink.close()
+    assert len(mod.load_wave(path)[0]) == len(wave)
+
+    with pytest.raises(ValueError):
+        mod.open_sink("unknown")
+    with pytest.raises(ValueError):
+        mod.open_source("unknown")
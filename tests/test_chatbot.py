@@ -1,8 +1,13 @@
+import json
+import threading
+import time
 from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 
 from vrchatbot import chatbot as mod
+from vrchatbot.text_utils import split_sentences
 
 api_key_file_path = "data/API_KEY.txt"
 
@@ -23,27 +28,245 @@ def test_ChatBot__init__():
     assert bot.human_name == "人間:"
     assert bot.ai_name == "人工知能:"
     assert bot.current_token_size == 0
-    assert bot.stored_prompts == deque()
+    assert list(bot.stored_prompts) == []
     assert bot.stored_prompts_token_sizes == deque()
+    assert len(bot.sessions) == 0  # reading the history does not create the session.
 
     bot = cls(api_key_file_path, behaviour_prompt=first_prompt)
     assert bot.behaivour_prompt == first_prompt
     assert bot.current_token_size > 0
 
 
+def test_PromptHistory():
+    cls = mod.PromptHistory
+    history = cls()
+
+    assert len(history) == 0
+    assert history.build("u") == "u"
+    assert history.build("u", "head") == "head u"
+
+    for prompt, size in [("a", 1), ("bb", 2), ("", 0), ("c d", 3)]:
+        history.append(prompt, size)
+    assert list(history) == ["a", "bb", "", "c d"]
+    assert history[-1] == "c d"
+    assert history.token_size == 6
+    assert history.build("u") == "a bb  c d u"
+    assert history.build("u", "head") == "head a bb  c d u"
+
+    history.trim(3)
+    assert list(history) == ["", "c d"]
+    assert list(history.token_sizes) == [0, 3]
+    assert history.text == "  c d"
+    history.append("e", 1)
+    assert list(history) == ["", "c d", "e"]
+    assert history.build("u", "head") == "head  c d e u"
+
+    history.trim(0)
+    assert len(history) == 0
+    assert history.text == ""
+    assert history.build("u") == "u"
+    with pytest.raises(IndexError):
+        history[0]
+
+    history = cls(separator="\n")
+    history.append("a", 1)
+    history.append("b", 1)
+    assert history.build("u", "head") == "head\na\nb\nu"
+    assert history[1] == "b"
+
+
+def test_SessionManager(tmp_path):
+    cls = mod.SessionManager
+    now = [0.0]
+    manager = cls(max_sessions=3, max_total_tokens=10, idle_timeout=60.0, clock=lambda: now[0])
+
+    manager.get("alice").append("a", 4)
+    manager.get("bob").append("b", 4)
+    assert manager.session_ids() == ["alice", "bob"]
+    assert manager.total_token_size == 8
+    manager.get("alice")
+    assert manager.session_ids() == ["bob", "alice"]
+
+    manager.get("carol").append("c", 4)  # over token budget
+    manager.evict()
+    assert manager.session_ids() == ["alice", "carol"]
+    assert manager.evicted_count == 1
+
+    for name in ["d", "e"]:
+        manager.get(name)
+    assert manager.session_ids() == ["carol", "d", "e"]  # max_sessions
+
+    manager.get("huge").append("h", 100)
+    manager.evict()
+    assert manager.session_ids() == ["huge"]  # most recently used one is kept.
+
+    manager.get("alice").append("a", 1)
+    manager.get("bob").append("b", 1)
+    path = tmp_path / "sessions.json"
+    manager.snapshot(path)
+
+    now[0] = 30.0
+    manager.get("bob")
+    now[0] = 70.0
+    manager.get("carol")
+    assert manager.session_ids() == ["bob", "carol"]  # idle sessions are removed.
+
+    restored = cls(clock=lambda: now[0])
+    restored.restore(path)
+    assert restored.session_ids() == ["alice", "bob"]
+    assert list(restored.get("alice")) == ["a"]
+    assert restored.total_token_size == 2
+    assert "huge" not in restored
+
+    restored.remove("alice")
+    assert len(restored) == 1
+    restored.clear()
+    assert len(restored) == 0
+
+
+def test_SessionManager_lookup():
+    cls = mod.SessionManager
+    now = [0.0]
+    manager = cls(max_sessions=2, idle_timeout=60.0, evict_interval=10.0, clock=lambda: now[0])
+    evict = manager.evict
+    calls = []
+    manager.evict = lambda: (calls.append(now[0]), evict())
+
+    manager.get("alice")
+    assert calls == [0.0]  # on insert
+    for t in [1.0, 2.0, 3.0]:
+        now[0] = t
+        manager.get("alice")
+    assert calls == [0.0]  # lookups do not evict within `evict_interval`.
+    now[0] = 10.0
+    manager.get("alice")
+    assert calls == [0.0, 10.0]
+
+    assert manager.peek("bob") is None
+    assert "bob" not in manager
+    manager.get("bob")
+    manager.peek("alice")  # does not update recency.
+    manager.get("carol")
+    assert manager.session_ids() == ["bob", "carol"]
+
+
+def join_summarizer(summary, prompts):
+    """Deterministic summarizer for tests."""
+    return summary + "".join(p.strip()[0] for p in prompts)
+
+
+def test_HistoryCompactor():
+    cls = mod.HistoryCompactor
+    counter = mod.TokenCounter()
+
+    def make_history():
+        history = mod.PromptHistory()
+        for prompt in ["a1", "b1", "a2", "b2", "a3", "b3"]:
+            history.append(prompt, 2)
+        return history
+
+    compactor = cls(join_summarizer, counter, trigger_tokens=8, keep_tokens=4, background=False)
+    history = make_history()
+    assert compactor.submit(history) is not None
+    assert list(history) == ["a3", "b3"]
+    assert history.summary == "abab"
+    assert history.summary_token_size == counter("abab")
+    assert history.build("u", "head") == "head abab a3 b3 u"
+    assert compactor.submit(history) is None  # under trigger_tokens
+    assert compactor.compacted_count == 1
+
+    compactor = cls(join_summarizer, counter, trigger_tokens=8, keep_tokens=6, max_summary_tokens=1, background=False)
+    history = make_history()
+    compactor.submit(history)
+    assert list(history) == ["a3", "b3"]  # keeps pairs.
+    assert counter(history.summary) <= 1
+
+    # background
+    release = threading.Event()
+
+    def slow_summarizer(summary, prompts):
+        release.wait(1.0)
+        return join_summarizer(summary, prompts)
+
+    compactor = cls(slow_summarizer, counter, trigger_tokens=8, keep_tokens=4)
+    history = make_history()
+    future = compactor.submit(history)
+    assert compactor.submit(history) is None  # already pending
+    history.append("a4", 2)
+    history.trim(12)  # hard trim while summarizing.
+    assert not compactor.apply(history)
+    release.set()
+    future.result(timeout=1.0)
+    assert compactor.apply(history)
+    assert list(history) == ["a3", "b3", "a4"]
+    assert history.summary == "abab"
+    compactor.shutdown()
+
+    # error
+    def broken_summarizer(summary, prompts):
+        raise RuntimeError("broken")
+
+    compactor = cls(broken_summarizer, counter, trigger_tokens=8, keep_tokens=4)
+    history = make_history()
+    compactor.submit(history)
+    assert not compactor.apply(history, wait=True)
+    assert compactor.error_count == 1
+    assert len(history) == 6
+    assert history.summary == ""
+
+
+def test_ResponseCache(tmp_path):
+    cls = mod.ResponseCache
+    now = [0.0]
+    path = str(tmp_path / "cache.jsonl")
+    cache = cls(max_entries=2, ttl=10.0, context_turns=1, path=path, clock=lambda: now[0])
+
+    assert cls.normalize("名前は？ ") == cls.normalize("名前は?") == "名前は"
+    assert cls.normalize("ｺﾝﾆﾁﾊ！") == "コンニチハ"
+
+    history = mod.PromptHistory()
+    assert cache.make_key("こんにちは！", history) == "こんにちは"
+    history.append("やあ", 1)
+    key = cache.make_key("こんにちは", history)
+    assert key.startswith("こんにちは#")
+    history.append("元気?", 1)
+    assert cache.make_key("こんにちは", history) != key  # context changed
+
+    assert cache.get("a") is None
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")  # "b" is least recently used.
+    assert cache.get("b") is None
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.hit_rate == 1 / 3
+
+    now[0] = 5.0
+    cache.put("d", "D")
+    now[0] = 12.0
+    assert cache.get("a") is None  # expired
+    assert cache.get("d") == "D"
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "torn"')  # interrupted write
+    restored = cls(ttl=10.0, path=path, clock=lambda: now[0])
+    assert len(restored) == 1
+    assert restored.get("d") == "D"
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 1  # compacted
+
+
 def test_ChatBot_make_tail_space():
     cls = mod.ChatBot
     bot = cls(api_key_file_path, max_tokens=5, max_receptive_tokens=20, free_tokens_for_user=5)
 
     bot.make_tail_space()  # nothing do
 
-    bot.current_token_size = 15
-    bot.stored_prompts.append("a")
-    bot.stored_prompts.append("b")
-    bot.stored_prompts.append("c")
-    bot.stored_prompts_token_sizes.append(3)
-    bot.stored_prompts_token_sizes.append(5)
-    bot.stored_prompts_token_sizes.append(7)
+    bot.history.append("a", 3)
+    bot.history.append("b", 5)
+    bot.history.append("c", 7)
+    assert bot.current_token_size == 15
     bot.make_tail_space()
     assert bot.current_token_size == 7
     assert list(bot.stored_prompts) == ["c"]
@@ -60,3 +283,232 @@ def test_ChatBot_responce():
         print("User:", i)
         resp_text = bot.responce(i)
         print("AI:", resp_text)
+
+
+def test_TokenCounter():
+    cls = mod.TokenCounter
+    counter = cls()
+
+    assert counter("") == 0
+    assert counter("hello world") == 2
+    assert counter(first_prompt) > 0
+    assert counter(first_prompt) == counter.count(first_prompt)
+    assert counter.count.cache_info().hits == 2
+    assert counter("<|endoftext|>") > 1  # special tokens are counted as normal text.
+
+    counter = cls(cache_size=1)
+    counter("a")
+    counter("b")
+    assert counter.count.cache_info().currsize == 1
+
+
+def test_TokenCounter_offline(monkeypatch, capsys):
+    cls = mod.TokenCounter
+    blocked = threading.Event()
+    monkeypatch.setattr(mod.tiktoken, "encoding_for_model", lambda engine: blocked.wait())  # black-holed network
+
+    start = time.perf_counter()
+    counter = cls(timeout=0.1)
+    assert time.perf_counter() - start < 5.0
+    assert counter.encoding.name == "gpt2"  # bundled with whisper
+    assert counter("hello world") == 2
+    assert counter.approximate  # text-davinci-003 uses p50k_base.
+    assert counter.budget(4096) < 4096
+    assert "approximately" in capsys.readouterr().out
+
+    monkeypatch.setattr(mod, "bundled_gpt2_encoding", lambda: None)
+    counter = cls(timeout=0.1)
+    assert counter.encoding is None
+    assert counter("hello") == 5
+    assert counter("こんにちは") == 15  # UTF-8 bytes
+    assert counter.truncate("こんにちは", 7) == "こん"
+    assert counter.budget(4096) == 4096  # byte counts are an upper bound.
+    blocked.set()
+
+
+def test_TokenCounter_exact(monkeypatch):
+    gpt2 = mod.bundled_gpt2_encoding()
+    monkeypatch.setattr(mod.tiktoken, "encoding_for_model", lambda engine: gpt2)
+    counter = mod.TokenCounter("gpt2")
+    assert not counter.approximate
+    assert counter.budget(4096) == 4096
+
+
+def test_ChatBot_local_token_accounting(tmp_path, monkeypatch):
+    key_file = tmp_path / "API_KEY.txt"
+    key_file.write_text("dummy", encoding="utf-8")
+
+    def create(**kwds):
+        return {"choices": [{"text": " こんにちは"}]}
+
+    monkeypatch.setattr(mod.openai.Completion, "create", create)
+
+    bot = mod.ChatBot(key_file, behaviour_prompt=first_prompt, max_tokens=16, max_receptive_tokens=200)
+    behaviour_size = bot.token_counter(first_prompt)
+    assert bot.current_token_size == behaviour_size
+    assert len(bot.sessions) == 0  # reading the history does not create the session.
+
+    bot.responce("やあ")
+    sizes = list(bot.stored_prompts_token_sizes)
+    assert sizes == [bot.count_prompt_tokens(p) for p in bot.stored_prompts]
+    assert bot.current_token_size == behaviour_size + sum(sizes)
+
+    for _ in range(10):
+        bot.responce("やあ")
+        assert bot.current_token_size == behaviour_size + sum(bot.stored_prompts_token_sizes)
+        assert bot.current_token_size <= bot.max_receptive_tokens
+
+
+def test_ChatBot_history(tmp_path, monkeypatch):
+    key_file = tmp_path / "API_KEY.txt"
+    key_file.write_text("dummy", encoding="utf-8")
+    monkeypatch.setattr(mod.openai.Completion, "create", lambda **kwds: {"choices": [{"text": " こんにちは"}]})
+
+    now = [0.0]
+    bot = mod.ChatBot(key_file, session_options={"evict_interval": 10.0, "clock": lambda: now[0]})
+    assert list(bot.stored_prompts) == []
+    assert len(bot.sessions) == 0  # reading does not create the session.
+
+    bot.history.append("a", 3)  # writing creates it.
+    assert list(bot.stored_prompts) == ["a"]
+    assert bot.current_token_size == bot.behaivour_prompt_token_size + 3
+
+    evict = bot.sessions.evict
+    calls = []
+    bot.sessions.evict = lambda: (calls.append(now[0]), evict())
+    for t in [1.0, 2.0]:
+        now[0] = t
+        bot.responce("やあ")
+    assert calls == []  # stored turns do not evict within `evict_interval`.
+    now[0] = 10.0
+    bot.responce("やあ")
+    assert calls == [10.0]
+
+
+class MockCompletionServer(ThreadingHTTPServer):
+    """Local server which streams `deltas` like the OpenAI completion API."""
+
+    def __init__(self, deltas: list[str]) -> None:
+        self.deltas = deltas
+        self.requests = []
+        super().__init__(("127.0.0.1", 0), MockCompletionHandler)
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class MockCompletionHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for delta in self.server.deltas:
+            chunk = {"object": "text_completion", "choices": [{"text": delta, "index": 0, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def completion_server(monkeypatch):
+    server = MockCompletionServer([" こんにちは", "。元気", "？", "また", "ね"])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(mod.openai, "api_base", server.api_base)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_ChatBot_responce_stream(tmp_path, completion_server):
+    key_file = tmp_path / "API_KEY.txt"
+    key_file.write_text("dummy", encoding="utf-8")
+    bot = mod.ChatBot(key_file, behaviour_prompt=first_prompt)
+
+    stream = bot.responce_stream("やあ")
+    assert next(stream) == " こんにちは"
+    assert len(bot.stored_prompts) == 0  # recorded when the stream ends.
+    assert list(split_sentences(stream)) == ["元気？", "またね"]
+
+    assert completion_server.requests[0]["stream"] is True
+    assert completion_server.requests[0]["prompt"].endswith(f"{bot.human_name} やあ\n{bot.ai_name}")
+    assert list(bot.stored_prompts) == [f"{bot.human_name} やあ\n{bot.ai_name}", " こんにちは。元気？またね"]
+    assert bot.current_token_size == bot.behaivour_prompt_token_size + sum(bot.stored_prompts_token_sizes)
+
+    assert list(split_sentences(bot.responce_stream("元気"))) == [" こんにちは。", "元気？", "またね"]
+    assert completion_server.requests[1]["prompt"].endswith(
+        f"{bot.human_name} やあ\n{bot.ai_name}  こんにちは。元気？またね {bot.human_name} 元気\n{bot.ai_name}"
+    )
+
+    stream = bot.responce_stream("じゃあね")  # closed early
+    next(stream)
+    stream.close()
+    assert bot.stored_prompts[-1] == " こんにちは"
+
+
+def test_ChatBot_sessions(tmp_path, completion_server):
+    key_file = tmp_path / "API_KEY.txt"
+    key_file.write_text("dummy", encoding="utf-8")
+    bot = mod.ChatBot(key_file, session_options={"max_sessions": 2})
+
+    list(bot.responce_stream("やあ", session_id="alice"))
+    assert list(bot.sessions.get("alice"))[0] == f"{bot.human_name} やあ\n{bot.ai_name}"
+    list(bot.responce_stream("こんにちは", session_id="bob"))
+    assert bot.sessions.session_ids() == ["alice", "bob"]
+    assert "やあ" not in completion_server.requests[1]["prompt"]  # histories are separated.
+
+    list(bot.responce_stream("また", session_id="carol"))
+    assert bot.sessions.session_ids() == ["bob", "carol"]
+    assert len(bot.stored_prompts) == 0  # default session
+
+    bot.reset()
+    assert len(bot.sessions) == 0
+
+
+def test_ChatBot_compaction(tmp_path, completion_server):
+    key_file = tmp_path / "API_KEY.txt"
+    key_file.write_text("dummy", encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        mod.ChatBot(key_file, summarizer="unknown")
+
+    bot = mod.ChatBot(
+        key_file,
+        summarizer=join_summarizer,
+        compaction_options={"trigger_tokens": 40, "keep_tokens": 0, "background": False},
+    )
+    for text in ["一", "二", "三"]:
+        list(bot.responce_stream(text))
+
+    assert bot.compactor.compacted_count > 0
+    assert bot.history.summary.startswith("人こ")
+    assert completion_server.requests[-1]["prompt"].startswith(bot.history.summary)
+    assert bot.current_token_size == bot.history.summary_token_size + bot.history.token_size
+
+
+def test_ChatBot_response_cache(tmp_path, completion_server):
+    key_file = tmp_path / "API_KEY.txt"
+    key_file.write_text("dummy", encoding="utf-8")
+    bot = mod.ChatBot(key_file, response_cache={"context_turns": 2})
+
+    text = "".join(bot.responce_stream("こんにちは", session_id="alice"))
+    assert len(completion_server.requests) == 1
+    assert "".join(bot.responce_stream("こんにちは！", session_id="bob")) == text
+    assert len(completion_server.requests) == 1  # answered from the cache.
+    assert bot.sessions.get("bob")[-1] == bot.sessions.get("alice")[-1]  # recorded to history.
+
+    list(bot.responce_stream("こんにちは", session_id="alice"))  # different context
+    assert len(completion_server.requests) == 2
+    assert bot.response_cache.hits == 1
+    assert bot.response_cache.misses == 2
+
+    stream = bot.responce_stream("また", session_id="carol")
+    next(stream)
+    stream.close()
+    assert len(bot.response_cache) == 2  # incomplete responce is not cached.
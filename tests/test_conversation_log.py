@@ -0,0 +1,81 @@
+import glob
+import gzip
+import json
+import os
+import time
+
+from vrchatbot import conversation_log as mod
+from vrchatbot.tracing import SPEECH_END, Turn
+
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_ConversationLogger(tmp_path):
+    cls = mod.ConversationLogger
+
+    logger = cls(str(tmp_path), "log.jsonl", batch_size=4, flush_interval=0.05)
+    assert logger.log("chat", user="こんにちは", responce="やあ")
+    turn = Turn(3)
+    turn.add_span("recognize.decode", 0.0, 0.25)
+    turn.add_span("speaker.play", 1.0, 1.5)
+    turn.add_span("speaker.play", 2.0, 2.5)
+    turn.mark(SPEECH_END, 10.0)
+    turn.mark("first_audio", 10.5)
+    logger.log_turn(turn, recognized="テスト", usage={"prompt_tokens": 10})
+    logger.log_turn(None, recognized="トレースなし")
+    for i in range(10):
+        logger.log("event", index=i)
+    logger.close()
+    assert logger.written == 13
+    assert logger.dropped == 0
+
+    records = read_records(tmp_path / "log.jsonl")
+    assert records[0]["event"] == "chat"
+    assert records[0]["user"] == "こんにちは"
+    assert "time" in records[0]
+    assert records[1]["turn"] == 3
+    assert records[1]["recognized"] == "テスト"
+    assert records[1]["latency"] == {"recognize.decode": 0.25, "speaker.play": 1.0, "turn.first_audio": 0.5}
+    assert records[2] == {"time": records[2]["time"], "event": "turn", "recognized": "トレースなし"}
+    assert [r["index"] for r in records[3:]] == list(range(10))
+
+
+def test_ConversationLogger_rotation(tmp_path):
+    logger = mod.ConversationLogger(
+        str(tmp_path), "log.jsonl", max_bytes=200, backup_count=2, compress=True, batch_size=1, flush_interval=0.01
+    )
+    for i in range(20):
+        logger.log("event", text="a" * 50, index=i)
+    logger.close()
+
+    assert logger.rotated >= 5
+    rotated = sorted(glob.glob(str(tmp_path / "log.*.jsonl.gz")))
+    assert len(rotated) == 2
+    assert os.path.getsize(tmp_path / "log.jsonl") < 300
+    with gzip.open(rotated[-1], "rt", encoding="utf-8") as f:
+        assert json.loads(f.readline())["event"] == "event"
+    assert read_records(tmp_path / "log.jsonl")[-1]["index"] == 19
+
+    logger = mod.ConversationLogger(str(tmp_path / "time"), "log.jsonl", rotate_interval=0.1, flush_interval=0.05)
+    logger.log("event")
+    time.sleep(0.3)
+    logger.log("event")
+    logger.close()
+    assert logger.rotated == 1
+    assert len(glob.glob(str(tmp_path / "time" / "log.*.jsonl"))) == 1
+
+
+def test_ConversationLogger_nonblocking(tmp_path):
+    logger = mod.ConversationLogger(str(tmp_path), "log.jsonl", queue_size=2, flush_interval=0.05)
+    logger._queue.put(mod._CLOSE)  # stop the writer
+    logger._thread.join()
+
+    start = time.perf_counter()
+    assert logger.log("event")
+    assert logger.log("event")
+    assert not logger.log("event")
+    assert time.perf_counter() - start < 0.05
+    assert logger.dropped == 1
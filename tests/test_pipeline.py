@@ -0,0 +1,161 @@
+import threading
+import time
+
+import pytest
+import toml
+
+from vrchatbot import pipeline as mod
+
+
+def test_StageQueue():
+    cls = mod.StageQueue
+
+    q = cls(2, mod.DROP_NEWEST)
+    for i in range(4):
+        q.put(i)
+    assert q.qsize() == 2
+    assert [q.get(), q.get()] == [0, 1]
+    assert q.metrics() == {"depth": 0, "max_depth": 2, "put": 2, "dropped": 2}
+
+    q = cls(2, mod.DROP_OLDEST)
+    for i in range(4):
+        q.put(i)
+    assert [q.get(), q.get()] == [2, 3]
+    assert q.metrics()["dropped"] == 2
+
+    q = cls(1, mod.BLOCK)
+    q.put(0)
+    threading.Timer(0.1, q.get).start()
+    start = time.time()
+    q.put(1)  # blocks until consumer gets.
+    assert time.time() - start >= 0.05
+    assert q.get() == 1
+
+    q = cls(4)
+    for i in range(3):
+        q.put(i)
+    assert q.clear() == 3
+    assert q.empty()
+    assert q.metrics()["dropped"] == 3
+
+    for i in range(4):
+        q.put(i)
+    assert q.clear(keep=lambda item: item % 2 == 1) == 2
+    assert [q.get(), q.get()] == [1, 3]
+
+    with pytest.raises(ValueError):
+        cls(1, "unknown")
+
+
+def test_Pipeline():
+    cls = mod.Pipeline
+
+    pipeline = cls(queue_size=4, stages={"double": {"queue_size": 1, "drop_policy": mod.DROP_NEWEST}})
+    results = []
+    pipeline.add_stage("double", lambda x: x * 2)
+    pipeline.add_stage("filter", lambda x: x if x > 2 else None)
+    pipeline.add_stage("store", results.append)
+
+    assert pipeline.input_queue.maxsize == 1
+    assert pipeline.input_queue.drop_policy == mod.DROP_NEWEST
+    assert pipeline.stages[1].input_queue.maxsize == 4
+    assert pipeline.stages[1].input_queue.drop_policy == mod.BLOCK
+
+    q = pipeline.start()
+    assert q is pipeline.input_queue
+    for i in range(4):
+        q.put(i)
+        time.sleep(0.05)
+
+    time.sleep(0.3)
+    assert pipeline.is_idle()
+    pipeline.shutdown()
+    assert results == [4, 6]
+
+    metrics = pipeline.metrics()
+    assert list(metrics.keys()) == ["double", "filter", "store"]
+    assert metrics["double"]["processed"] == 4
+    assert metrics["filter"]["processed"] == 4
+    assert metrics["store"]["processed"] == 2
+    assert "double: depth=0" in pipeline.format_metrics()
+
+    pipeline = cls()
+    pipeline.add_stage("a", lambda x: x)
+    pipeline.add_stage("b", lambda x: x)
+    for stage in pipeline.stages:
+        stage.input_queue.put(0)
+    assert pipeline.clear(["b"]) == 1
+    assert pipeline.clear() == 1
+
+
+def test_Stage_error():
+    def func(x):
+        raise RuntimeError("error")
+
+    q = mod.StageQueue()
+    stage = mod.Stage("error", func, q, poll_interval=0.01)
+    stage.start()
+    q.put(0)
+    time.sleep(0.1)
+    stage.shutdown()
+    assert stage.error_count == 1
+    assert stage.processed_count == 0
+
+
+def test_Stage_generator():
+    received = []
+    release = threading.Event()
+
+    def func(x):
+        yield x
+        release.wait(1.0)
+        yield None  # skipped
+        yield x + 1
+
+    q, out = mod.StageQueue(), mod.StageQueue()
+    stage = mod.Stage("generator", func, q, out, poll_interval=0.01)
+    stage.start()
+    q.put(0)
+    received.append(out.get(timeout=1.0))  # first item arrives before func finishes.
+    assert stage.processed_count == 0
+    release.set()
+    received.append(out.get(timeout=1.0))
+    time.sleep(0.05)
+    stage.shutdown()
+    assert received == [0, 1]
+    assert out.empty()
+    assert stage.processed_count == 1
+
+
+def test_Pipeline_default_config_keeps_sentences():
+    # Synthesis is faster than playback, and one turn has more sentences than the play queue.
+    config = toml.load("botconfig.toml")["Pipeline"]
+    pipeline = mod.Pipeline(**config)
+    played = []
+
+    def respond(turn):
+        for i in range(num_sentences):
+            yield turn, i
+        yield turn, {"end": True}
+
+    def play(item):
+        time.sleep(0.01)
+        played.append(item)
+
+    pipeline.add_stage("respond", respond)
+    pipeline.add_stage("synthesize", lambda item: item)
+    pipeline.add_stage("play", play)
+    num_sentences = pipeline.stages[-1].input_queue.maxsize * 3
+
+    q = pipeline.start()
+    q.put(1)
+    q.put(2)
+    time.sleep(0.1)
+    while not pipeline.is_idle():
+        time.sleep(0.1)
+    pipeline.shutdown()
+
+    expected = [(turn, i) for turn in (1, 2) for i in range(num_sentences)]
+    assert [item for item in played if not isinstance(item[1], dict)] == expected
+    assert [item[0] for item in played if isinstance(item[1], dict)] == [1, 2]
+    assert pipeline.metrics()["play"]["dropped"] == 0
@@ -6,11 +6,20 @@ import time
 import matplotlib.pyplot as plt
 import numpy as np
 import pytest
-import soundcard as sc
 
+from vrchatbot import audio_io
 from vrchatbot import recorder as mod
 
+try:
+    import soundcard as sc
 
+    NUM_MICROPHONES = len(sc.all_microphones(True))
+except OSError:  # No audio server.
+    sc = None
+    NUM_MICROPHONES = 0
+
+
+@pytest.mark.skipif(sc is None, reason="No audio server")
 def test_display_audio_devices():
     # To display message, please use pytest option `-s`.
     mod.display_audio_devices()
@@ -40,9 +49,42 @@ def test_check_silence_end_point():
     assert f(wave, 0.01, chunk) == 100
     assert f(wave, 0.01, chunk, 50) == 50
     assert f(np.zeros(chunk), 0.01, chunk) is None
+    assert f(np.ones(chunk + 10), -1.0, chunk) == 0
+
+
+def test_windowed_rms():
+    f = mod.windowed_rms
+
+    wave = np.concatenate([np.zeros(100), np.full(100, 2.0)]).astype("float32")
+    np.testing.assert_allclose(f(wave, 100), [0.0, 2.0])
+    np.testing.assert_allclose(f(wave, 100, 50), [0.0, np.sqrt(2.0), 2.0, 2.0])  # last window is shorter.
+    np.testing.assert_allclose(f(wave, 30, 20)[:4], [0.0] * 4)
+
+    rng = np.random.default_rng(0)
+    wave = rng.standard_normal(1000)
+    for chunk, stride in [(64, 64), (64, 16), (100, 30), (7, 3)]:
+        expected = [np.sqrt(np.mean(wave[i : i + chunk] ** 2)) for i in range(0, len(wave), stride)]
+        np.testing.assert_allclose(f(wave, chunk, stride), expected)
+
+
+def test_check_voiced_range():
+    f = mod.check_voiced_range
+
+    chunk = 100
+    wave = np.concatenate([np.zeros(chunk), np.ones(chunk), np.zeros(chunk * 2)])
+    assert f(wave, 0.01, chunk) == (100, 200)
+    assert f(wave, 0.01, chunk, 50) == (50, 250)
+    assert f(np.zeros(chunk), 0.01, chunk) is None
+
 
+def test_EnergyVAD():
+    vad = mod.EnergyVAD(0.01, 100)
 
-@pytest.mark.skipif(len(sc.all_microphones(True)) == 0, reason="No audio devices")
+    assert vad.detect(np.concatenate([np.zeros(100), np.ones(100)])) == 100
+    assert vad.detect(np.zeros(200)) is None
+
+
+@pytest.mark.skipif(NUM_MICROPHONES == 0, reason="No audio devices")
 def test_Recorder__init__():
     cls = mod.Recorder
 
@@ -54,6 +96,24 @@ def test_Recorder__init__():
     assert recoder.volume_threshold == 0.0001
     assert recoder.silence_check_chunk == 512
     assert recoder.max_recording_duration == 15
+    assert recoder.pre_roll_duration == 0.0
+    assert recoder.ring_buffer.capacity == 16000 * 15 + 4096
+
+    recoder = cls(0, 4096, 16000, max_recording_duration=15, pre_roll_duration=0.5)
+    assert recoder.ring_buffer.capacity == 16000 * 15 + 8000 + 4096
+
+    assert isinstance(recoder.vad, mod.EnergyVAD)
+    assert recoder.vad.volume_threshold == 0.0001
+
+    recoder = cls(vad="spectral", vad_options={"frame_length": 256})
+    assert isinstance(recoder.vad, mod.SpectralVAD)
+    assert recoder.vad.frame_length == 256
+
+    vad = mod.EnergyVAD(0.1, 256)
+    assert cls(vad=vad).vad is vad
+
+    with pytest.raises(ValueError):
+        cls(vad="unknown")
 
     recorder = cls()
     assert recorder.mic.name == sc.default_microphone().name
@@ -69,7 +129,7 @@ def test_Recorder__init__():
 
 
 @pytest.mark.slow
-@pytest.mark.skipif(len(sc.all_microphones(True)) == 0, reason="No audio devices")
+@pytest.mark.skipif(NUM_MICROPHONES == 0, reason="No audio devices")
 def test_Recorder_record_audio_until_silence():
     cls = mod.Recorder
 
@@ -99,7 +159,32 @@ def test_Recorder_record_audio_until_silence():
 
 
 @pytest.mark.slow
-@pytest.mark.skipif(len(sc.all_microphones(True)) == 0, reason="No audio devices")
+@pytest.mark.skipif(NUM_MICROPHONES == 0, reason="No audio devices")
+def test_Recorder_stream_audio_until_silence():
+    cls = mod.Recorder
+
+    recorder = cls(sc.default_microphone().name, buffer_size=4096, volume_threshold=1.0)
+    assert list(recorder.stream_audio_until_silence(waiting_timeout=1)) == []
+
+    sample_rate = 16000
+    recorder = cls(
+        sc.default_microphone().name,
+        1024,
+        sample_rate=sample_rate,
+        silence_duration_for_stop=10,
+        max_recording_duration=1,
+        volume_threshold=-1.0,
+    )
+    onsets = []
+    recorder.add_onset_callback(lambda: onsets.append(time.time()))
+    blocks = list(recorder.stream_audio_until_silence(5))
+    assert all(len(b) == 1024 for b in blocks)
+    assert len(blocks) == math.ceil(sample_rate / 1024)
+    assert len(onsets) == 1
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(NUM_MICROPHONES == 0, reason="No audio devices")
 def test_Recoder_record_forever():
     cls = mod.Recorder
 
@@ -146,7 +231,7 @@ def test_Recoder_record_forever():
 
 
 @pytest.mark.slow
-@pytest.mark.skipif(len(sc.all_microphones(True)) == 0, reason="No audio devices")
+@pytest.mark.skipif(NUM_MICROPHONES == 0, reason="No audio devices")
 def test_Recoder_record_forever_background_and_shutdown():
     cls = mod.Recorder
 
@@ -192,3 +277,62 @@ def test_Recoder_record_forever_background_and_shutdown():
     time.sleep(duration * 2 + 1)
     recorder.shutdown_record_forever()
     assert q.qsize() > 0
+
+
+def make_utterances(sample_rate: int, voiced: list[tuple[float, float]], duration: float) -> np.ndarray:
+    wave = np.zeros(int(sample_rate * duration), dtype=np.float32)
+    for start, end in voiced:
+        wave[int(start * sample_rate) : int(end * sample_rate)] = 0.5
+    return wave
+
+
+def test_Recorder_source():
+    cls = mod.Recorder
+    sample_rate = 16000
+    wave = make_utterances(sample_rate, [(1.0, 2.0), (4.0, 5.0)], 6.0)
+
+    recorder = cls(buffer_size=1024, silence_duration_for_stop=0.5, source=audio_io.ArraySource(wave, sample_rate))
+    assert recorder.mic.name == "array"
+    onsets = []
+    recorder.add_onset_callback(lambda: onsets.append(recorder.mic.position))
+    first = recorder.record_audio_until_silence(5)
+    second = recorder.record_audio_until_silence(5)
+    assert len(onsets) == 2
+    assert 1.0 <= len(first) / sample_rate < 1.7
+    assert 1.0 <= len(second) / sample_rate < 1.7
+    assert not recorder.source_ended
+    assert recorder.record_audio_until_silence(5) is None
+    assert recorder.source_ended
+
+    recorder = cls(buffer_size=1024, silence_duration_for_stop=0.5, source=audio_io.ArraySource(wave, sample_rate))
+    q = queue.Queue()
+    start = time.perf_counter()
+    recorder.record_forever(q)  # returns at the end of the source.
+    assert time.perf_counter() - start < 1.0
+    assert q.qsize() == 2
+
+    with pytest.raises(ValueError):
+        cls(source={"type": "unknown"})
+
+
+@pytest.mark.parametrize("finish_utterance", [False, True])
+def test_Recorder_shutdown_record_forever_finish_utterance(finish_utterance):
+    cls = mod.Recorder
+    sample_rate = 16000
+    wave = make_utterances(sample_rate, [(0.2, 1.2)], 2.0)
+    source = audio_io.ArraySource(wave, sample_rate, realtime=True)
+    recorder = cls(buffer_size=1024, silence_duration_for_stop=0.3, source=source)
+    onset = threading.Event()
+    recorder.add_onset_callback(onset.set)
+
+    q = recorder.record_forever_background(is_daemon=True)
+    assert onset.wait(5.0)
+    time.sleep(0.3)  # in the middle of the utterance
+    recorder.shutdown_record_forever(finish_utterance=finish_utterance)
+    assert q.qsize() == 1
+    duration = len(q.get()) / sample_rate
+    if finish_utterance:
+        assert duration >= 1.0
+        assert recorder.record_audio_until_silence(1) is None  # the rest is not recorded as another utterance.
+    else:
+        assert duration < 0.8
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from vrchatbot import ring_buffer as mod
+
+
+def test_RingBuffer():
+    cls = mod.RingBuffer
+
+    ring = cls(10)
+    assert ring.buffer.dtype == np.float32
+    assert ring.oldest_position == 0
+
+    assert ring.write(np.arange(4, dtype=np.float64)) == 0
+    assert ring.write(np.arange(4, 8)) == 4
+    np.testing.assert_array_equal(ring.view(2, 6), [2, 3, 4, 5])
+    assert np.shares_memory(ring.view(2, 6), ring.buffer)
+
+    assert ring.write(np.arange(8, 14)) == 8  # wrap around
+    assert ring.write_position == 14
+    assert ring.oldest_position == 4
+    wave = ring.read(4, 14)
+    np.testing.assert_array_equal(wave, np.arange(4, 14))
+    assert not np.shares_memory(wave, ring.buffer)
+
+    with pytest.raises(ValueError):
+        ring.view(8, 12)  # wraps around
+    with pytest.raises(IndexError):
+        ring.read(3, 10)
+    with pytest.raises(IndexError):
+        ring.read(10, 15)
+    with pytest.raises(ValueError):
+        ring.write(np.zeros(11))
+    with pytest.raises(ValueError):
+        cls(0)
+
+    ring.reset()
+    assert ring.write_position == 0
+    assert ring.write(np.ones(3)) == 0
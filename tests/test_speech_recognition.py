@@ -1,3 +1,7 @@
+import queue
+import threading
+
+import numpy as np
 import pytest
 import torch
 import whisper
@@ -26,3 +30,247 @@ def test_SpeechRecongition_recognize():
     probs, text = instance.recongnize(audio)
     with open("data/test_results/recongnized_text.txt", "w", encoding="utf-8") as f:
         f.write(f"{max(probs, key=probs.get)}: {text}")
+
+
+def tiny_whisper() -> whisper.Whisper:
+    torch.manual_seed(0)
+    dims = whisper.ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=1500,
+        n_audio_state=64,
+        n_audio_head=2,
+        n_audio_layer=1,
+        n_vocab=51865,
+        n_text_ctx=448,
+        n_text_state=64,
+        n_text_head=2,
+        n_text_layer=1,
+    )
+    model = whisper.Whisper(dims)
+    # `TextDecoder.positional_embedding` is created with `torch.empty` and loaded from checkpoints.
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.02)
+    return model
+
+
+def test_optimize_for_cpu():
+    f = mod.optimize_for_cpu
+
+    num_threads = torch.get_num_threads()
+    model = f(tiny_whisper(), quantize=True, num_threads=1)
+    assert torch.get_num_threads() == 1
+    torch.set_num_threads(num_threads)
+    assert isinstance(model.encoder.blocks[0].mlp[0], torch.ao.nn.quantized.dynamic.Linear)
+    assert isinstance(model.decoder.blocks[0].attn.query, torch.ao.nn.quantized.dynamic.Linear)
+
+    mel = whisper.log_mel_spectrogram(np.zeros(16000, dtype=np.float32))
+    result = whisper.decode(model, whisper.pad_or_trim(mel, 3000), whisper.DecodingOptions(fp16=False, sample_len=4))
+    assert isinstance(result.text, str)
+
+    model = f(tiny_whisper(), quantize=False)
+    assert type(model.encoder.blocks[0].mlp[0]) is whisper.model.Linear
+
+
+def test_LanguageCache():
+    cls = mod.LanguageCache
+
+    cache = cls(stable_count=2, recheck_interval=2)
+    ja = {"ja": 0.9, "en": 0.1}
+    en = {"ja": 0.2, "en": 0.8}
+
+    assert cache.get() is None
+    cache.update(ja)
+    assert cache.get() is None
+    cache.update(ja)
+    assert cache.get() is ja
+    assert cache.get() is ja
+    assert cache.get() is None  # recheck
+    cache.update(en)
+    assert cache.get() is None  # language changed
+
+    cache.update(ja, "alice")
+    cache.update(ja, "alice")
+    assert cache.get("alice") is ja
+    assert cache.get("bob") is None
+    cache.clear("alice")
+    assert cache.get("alice") is None
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="No cuda device available.")
+def test_SpeechRecongition_language_cache():
+    cls = mod.SpeechRecongition
+
+    audio = whisper.load_audio("data/sample_transcribe.mp3")
+    instance = cls(language_stable_count=2)
+    features = instance.encode(whisper.log_mel_spectrogram(whisper.pad_or_trim(audio)))
+    assert features.shape == (instance.model.dims.n_audio_ctx, instance.model.dims.n_audio_state)
+
+    results = [instance.recongnize(audio) for _ in range(3)]
+    assert results[2][0] is results[1][0]  # cached
+    assert results[2][1] == results[0][1]
+
+
+def test_common_prefix():
+    f = mod.common_prefix
+
+    assert f([]) == ""
+    assert f(["こんにちは世界", "こんにちは世"]) == "こんにちは世"
+    assert f(["こんにちは", "こんばんは"]) == "こん"
+    assert f(["hello world", "hello word"]) == "hello "
+    assert f(["hello world", "hello world!"]) == "hello "  # "world" may continue.
+    assert f(["hello world", "hello world"]) == "hello world"
+
+
+class ScriptedRecognizer:
+    """Returns scripted segments for each call."""
+
+    def __init__(self, hypotheses):
+        self.options = whisper.DecodingOptions()
+        self.hypotheses = list(hypotheses)
+        self.calls = []
+
+    def recongnize_segments(self, audio, options=None):
+        self.calls.append((len(audio), options.prompt))
+        return {"ja": 1.0}, self.hypotheses.pop(0)
+
+
+def test_SpeechRecongition_warm_up(monkeypatch):
+    monkeypatch.setattr(mod.whisper, "load_model", lambda *args: tiny_whisper())
+    instance = mod.SpeechRecongition(device="cpu", options=whisper.DecodingOptions(fp16=False), language_stable_count=1)
+    instance.warm_up()
+    assert instance.language_cache.get(None) is None  # not changed.
+
+
+def test_split_segments():
+    f = mod.split_segments
+    tokenizer = whisper.tokenizer.get_tokenizer(True, language="ja", task="transcribe")
+
+    def timestamp(seconds):
+        return tokenizer.timestamp_begin + round(seconds / mod.TIME_PRECISION)
+
+    hello, world = tokenizer.encode("こんにちは"), tokenizer.encode("世界")
+    tokens = [timestamp(0.0), *hello, timestamp(1.2), timestamp(1.2), *world, timestamp(2.0)]
+    assert f(tokens, tokenizer) == [(0.0, 1.2, "こんにちは"), (1.2, 2.0, "世界")]
+    assert f([timestamp(0.0), *hello, timestamp(1.2), timestamp(1.2), *world], tokenizer) == [
+        (0.0, 1.2, "こんにちは"),
+        (1.2, None, "世界"),
+    ]
+    assert f(hello, tokenizer) == [(0.0, None, "こんにちは")]
+    assert f([], tokenizer) == []
+
+
+def test_StreamingRecognizer():
+    recognizer = ScriptedRecognizer(
+        [
+            [(0.0, None, "こん")],
+            [(0.0, 0.5, "こんにちは"), (0.5, None, "元")],
+            [(0.0, 0.5, "こんにちは"), (0.5, None, "元気")],
+            [(0.0, None, "元気？")],
+            [(0.0, 1.0, "元気？")],
+        ]
+    )
+    stream = mod.StreamingRecognizer(recognizer, decode_interval=0.5, sample_rate=16000)
+
+    block = np.zeros(4000, dtype=np.float32)
+    assert stream.push(block) is None  # not enough audio
+    assert stream.push(block) is None  # first hypothesis
+    assert stream.push(block) is None
+    assert stream.push(block) == "こん"  # "こんにちは" is not agreed yet.
+    assert stream.committed_text == ""
+    assert stream.push(block) is None
+    assert stream.push(block) == "こんにちは元"
+    assert stream.committed_text == "こんにちは"  # committed up to 0.5 seconds.
+    assert stream.push(block) is None
+    assert stream.push(block) == "こんにちは元気"
+
+    assert stream.finalize() == "こんにちは元気？"
+    # Only the uncommitted audio is decoded, with the committed text as the prompt.
+    assert recognizer.calls == [
+        (8000, None),
+        (16000, None),
+        (24000, None),
+        (24000, "こんにちは"),
+        (24000, "こんにちは"),
+    ]
+    assert stream.ring_buffer.write_position == 0
+    assert stream.finalize() == ""
+
+    # Decoding is skipped when there is no new audio and the hypotheses agree.
+    recognizer = ScriptedRecognizer([[(0.0, None, "また")], [(0.0, None, "また")]])
+    stream = mod.StreamingRecognizer(recognizer, decode_interval=0.5, sample_rate=16000)
+    stream.push(np.zeros(8000))
+    assert stream.push(np.zeros(8000)) == "また"
+    assert stream.finalize() == "また"
+    assert len(recognizer.calls) == 2
+
+    recognizer = ScriptedRecognizer([[(0.0, None, "おは")], [(0.0, None, "おはよう")]])
+    stream = mod.StreamingRecognizer(recognizer, decode_interval=0.5, sample_rate=16000)
+    stream.push(np.zeros(8000))
+    stream.push(np.zeros(100))
+    assert stream.finalize() == "おはよう"
+
+    assert mod.StreamingRecognizer(recognizer, window_duration=60.0).window_duration == 30.0
+
+
+def test_SpeechRecongition_recongnize_segments(monkeypatch):
+    monkeypatch.setattr(mod.whisper, "load_model", lambda *args: tiny_whisper())
+    options = whisper.DecodingOptions(fp16=False, language="ja", sample_len=8, without_timestamps=True)
+    instance = mod.SpeechRecongition(device="cpu", options=options)
+    probs, segments = instance.recongnize_segments(np.zeros(16000, dtype=np.float32))
+    assert isinstance(probs, dict)
+    for start, end, text in segments:
+        assert isinstance(text, str)
+        assert end is None or start <= end
+
+
+def test_collect_batch():
+    f = mod.collect_batch
+
+    q = queue.Queue()
+    for i in range(5):
+        q.put(i)
+    assert f(q, 3, 0.01) == [0, 1, 2]
+    assert f(q, 3, 0.01) == [3, 4]
+
+    threading.Timer(0.05, q.put, args=(6,)).start()
+    q.put(5)
+    assert f(q, 3, 0.5) == [5, 6]
+
+    with pytest.raises(queue.Empty):
+        f(q, 3, 0.01, timeout=0.01)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="No cuda device available.")
+def test_SpeechRecongition_recognize_batch():
+    cls = mod.SpeechRecongition
+
+    audio = whisper.load_audio("data/sample_transcribe.mp3")
+    instance = cls()
+    audios = [audio[: 16000 * 3], audio[16000 * 3 : 16000 * 8]]
+    results = instance.recognize_batch(audios)
+    assert len(results) == 2
+    for (probs, text), a in zip(results, audios):
+        assert text == instance.recongnize(a)[1]
+        assert isinstance(probs, dict)
+    assert instance.recognize_batch([]) == []
+
+    wave_queue = queue.Queue()
+    result_queue = instance.recognize_forever_background(wave_queue, max_batch_size=2)
+    for a in audios:
+        wave_queue.put(a)
+    assert [result_queue.get(timeout=30)[1] for _ in audios] == [text for _, text in results]
+    instance.shutdown_recognize_forever()
+
+
+def test_LogMelSpectrogram():
+    cls = mod.LogMelSpectrogram
+
+    f = cls()
+    rng = np.random.default_rng(0)
+    for length in [0, 100, 16000, 16000 * 5 + 37, 16000 * 30 - 100, 16000 * 30, 16000 * 31]:
+        audio = (rng.standard_normal(length) * 0.1).astype(np.float32)
+        expected = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio))
+        mel = f(audio)
+        assert mel.shape == (80, 3000)
+        torch.testing.assert_close(mel, expected)
+
+    assert f(np.zeros(100)) is f(np.ones(100))  # buffer is reused.
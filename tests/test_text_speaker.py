@@ -1,10 +1,24 @@
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
 import pytest
-import soundcard as sc
 
+from vrchatbot import audio_io
 from vrchatbot import text_speaker as mod
 
+try:
+    import soundcard as sc
+
+    NUM_SPEAKERS = len(sc.all_speakers())
+except OSError:  # No audio server.
+    sc = None
+    NUM_SPEAKERS = 0
 
-@pytest.mark.skipif(len(sc.all_speakers()) == 0, reason="No audio devices")
+
+@pytest.mark.skipif(NUM_SPEAKERS == 0, reason="No audio devices")
 def test_TextSpeaker():
     cls = mod.TextSpeaker
 
@@ -22,3 +36,240 @@ def test_TextSpeaker():
         assert False, "ValueError must be occured!"
     except ValueError:
         pass
+
+
+@pytest.mark.skipif(NUM_SPEAKERS == 0, reason="No audio devices")
+def test_TextSpeaker_cache(tmp_path):
+    cls = mod.TextSpeaker
+
+    speaker = cls(cache={"cache_dir": str(tmp_path)}, voice_options={"speed": 1.2})
+    assert speaker.prewarm(["こんにちは。よろしくね"]) == 2
+    assert speaker.prewarm(["こんにちは。"]) == 0
+    wave, sr = speaker.synthesize("よろしくね")
+    assert speaker.cache.memory_hits == 1
+
+    speaker = cls(cache={"cache_dir": str(tmp_path)}, voice_options={"speed": 1.2})
+    cached, cached_sr = speaker.synthesize("よろしくね")
+    assert speaker.cache.disk_hits == 1
+    assert cached_sr == sr
+    np.testing.assert_array_equal(cached, wave)
+
+    try:
+        cls().prewarm(["こんにちは"])
+        assert False, "RuntimeError must be occured!"
+    except RuntimeError:
+        pass
+
+
+@pytest.fixture
+def fake_speaker(monkeypatch):
+    device = audio_io.CaptureSink()
+    monkeypatch.setattr(mod.audio_io, "get_speaker", lambda *args: device)
+
+    def tts(text, **kwds):
+        time.sleep(0.05 * len(text))
+        return np.full(len(text) * 100, 2**14, dtype=np.float64), 48000
+
+    monkeypatch.setattr(mod.pyopenjtalk, "tts", tts)
+    return device
+
+
+def test_TextSpeaker_speak_stream(fake_speaker):
+    speaker = mod.TextSpeaker()
+
+    def texts():
+        yield "あい。"
+        yield " "
+        yield "うえお、"
+        yield "か"
+
+    start = time.perf_counter()
+    stats = speaker.speak_stream(texts())
+    assert fake_speaker.opened == fake_speaker.closed == 1  # one stream for all chunks
+    assert [len(w) for _, _, w in fake_speaker.played] == [300, 400, 100]
+    np.testing.assert_allclose(fake_speaker.played[0][2], 0.5)
+    assert stats["chunks"] == 3
+    assert stats["audio_duration"] == 800 / 48000
+    assert stats["time_to_first_audio"] == pytest.approx(0.15, abs=0.1)
+    assert fake_speaker.played[0][0] - start < stats["synthesis_time"]  # played before all synthesis is done.
+
+    stats = speaker.speak_text("こんにちは。元気？")
+    assert stats["chunks"] == 2
+    assert fake_speaker.opened == 2
+
+    assert speaker.speak_stream([])["time_to_first_audio"] is None
+
+
+def test_TextSpeaker_sample_rate(fake_speaker, tmp_path):
+    speaker = mod.TextSpeaker(sample_rate=24000)
+    wave, sr = speaker.synthesize("あい")
+    assert wave.dtype == np.float32
+    assert (len(wave), sr) == (100, 24000)
+    np.testing.assert_allclose(wave, 0.5)
+
+    speaker = mod.TextSpeaker(cache={"cache_dir": str(tmp_path)})
+    assert speaker.synthesize("あい")[1] == 48000
+    speaker = mod.TextSpeaker(cache={"cache_dir": str(tmp_path)}, sample_rate=16000)
+    wave, sr = speaker.synthesize("あい")  # cached wave is resampled.
+    assert (len(wave), sr) == (66, 16000)
+    assert speaker.cache.disk_hits == 1
+
+
+def test_TextSpeaker_warm_up(fake_speaker, tmp_path):
+    speaker = mod.TextSpeaker(cache={"cache_dir": str(tmp_path)})
+    speaker.warm_up()
+    assert len(speaker.cache) == 0
+
+
+def test_TextSpeaker_sink(fake_speaker, tmp_path):
+    path = tmp_path / "capture.wav"
+    speaker = mod.TextSpeaker(sink={"type": "capture", "path": str(path)})
+    assert speaker.speaker is not fake_speaker
+    speaker.speak_text("あい。うえお")
+    speaker.close()
+    assert len(audio_io.load_wave(str(path))[0]) == 600
+
+
+def test_TextSpeaker_speak_stream_error(fake_speaker):
+    speaker = mod.TextSpeaker()
+
+    def texts():
+        yield "あ"
+        raise RuntimeError("broken stream")
+
+    with pytest.raises(RuntimeError):
+        speaker.speak_stream(texts())
+    assert fake_speaker.opened == fake_speaker.closed == 1
+
+
+def test_TextSpeaker_play_stop(fake_speaker):
+    speaker = mod.TextSpeaker(block_duration=0.01)
+    fake_speaker.realtime = True
+    progress = []
+    speaker.add_progress_callback(lambda *args: progress.append(args))
+
+    assert speaker.play(np.zeros(480), 48000, "あ") == 0.01
+    assert progress == [("あ", 0.01, 0.01)]
+
+    threading.Timer(0.1, speaker.stop).start()
+    start = time.perf_counter()
+    played = speaker.play(np.zeros(48000), 48000)
+    assert time.perf_counter() - start < 0.3
+    assert 0.05 < played < 0.3
+    assert speaker.generation == 1
+    assert speaker.play(np.zeros(480), 48000) == 0.01  # playable after stop.
+
+
+def test_TextSpeaker_speak_async(fake_speaker):
+    speaker = mod.TextSpeaker(block_duration=0.01)
+    speaker.synthesize = lambda text: (np.zeros(48000 * len(text)), 48000)
+    progress = []
+    speaker.add_progress_callback(lambda text, played, duration: progress.append(text))
+
+    f1 = speaker.speak_async(["a", "b"])
+    f2 = speaker.speak_async(["c"])
+    assert speaker.flush(1.0)
+    assert not speaker.is_speaking
+    assert f1.result()["chunks"] == 2
+    assert f2.result()["audio_duration"] == 1.0
+    assert list(dict.fromkeys(progress)) == ["a", "b", "c"]  # queued order
+    assert fake_speaker.opened == fake_speaker.closed == 2
+
+    fake_speaker.realtime = True
+    f1 = speaker.speak_async(["a", "b"])
+    f2 = speaker.speak_async(["c"])
+    time.sleep(0.1)
+    assert speaker.is_speaking
+    start = time.perf_counter()
+    speaker.stop()
+    assert speaker.flush(1.0)
+    assert time.perf_counter() - start < 0.3
+    assert f1.result()["interrupted"]
+    assert f1.result()["chunks"] == 1
+    assert f1.result()["audio_duration"] < 0.3
+    assert f2.result()["interrupted"]
+    assert f2.result()["chunks"] == 0
+
+    fake_speaker.realtime = False
+    assert speaker.speak_async(["d"]).result(1.0)["chunks"] == 1
+    speaker.close()
+
+
+def test_TextSpeaker_speak_async_stopped_while_queued(fake_speaker):
+    speaker = mod.TextSpeaker(block_duration=0.01)
+    speaker.synthesize = lambda text: (np.zeros(4800), 48000)
+    fake_speaker.realtime = True
+    started = []
+
+    def texts(name):
+        started.append(name)
+        yield f"{name}1。"
+        yield f"{name}2。"
+
+    f1 = speaker.speak_async(texts("a"))
+    f2 = speaker.speak_async(texts("b"))
+    time.sleep(0.05)
+    speaker.stop()  # while "a" is playing and "b" is queued.
+    f3 = speaker.speak_async(texts("c"))
+    assert speaker.flush(1.0)
+
+    assert f1.result()["interrupted"]
+    assert f1.result()["text"].startswith("a1。")
+    assert f2.result()["interrupted"]
+    assert f2.result()["text"] == ""  # the stream is closed without being started.
+    assert f3.result()["text"] == "c1。c2。"
+    assert started == ["a", "c"]
+    speaker.close()
+
+
+def test_TextSpeaker_stop_stalled_stream(fake_speaker):
+    speaker = mod.TextSpeaker(block_duration=0.01)
+    speaker.synthesize = lambda text: (np.zeros(480), 48000)
+    fake_speaker.realtime = True
+    release = threading.Event()
+    closed = threading.Event()
+
+    def texts():
+        try:
+            yield "あ。"
+            release.wait(10.0)  # stalled responce stream
+            yield "い。"
+        finally:
+            closed.set()
+
+    future = speaker.speak_async(texts())
+    time.sleep(0.1)
+    speaker.stop()
+    start = time.perf_counter()
+    assert speaker.flush(5.0)
+    assert time.perf_counter() - start < mod.STREAM_CLOSE_TIMEOUT + 0.5
+    assert future.result()["interrupted"]
+    assert future.result()["text"] == "あ。"
+    assert speaker.speak_async(["う。"]).result(1.0)["chunks"] == 1  # following texts are not blocked.
+
+    release.set()
+    assert closed.wait(1.0)  # closed by the worker when the next text arrives.
+    speaker.close()
+
+
+def test_TextSpeaker_play_keep_open(fake_speaker):
+    speaker = mod.TextSpeaker(block_duration=0.01)
+    speaker.play(np.zeros(480), 48000, keep_open=True)
+    speaker.play(np.zeros(480), 48000, keep_open=True)
+    assert (fake_speaker.opened, fake_speaker.closed) == (1, 0)
+    speaker.play(np.zeros(240), 24000, keep_open=True)  # another sample rate
+    assert (fake_speaker.opened, fake_speaker.closed) == (2, 1)
+    speaker.stop()
+    speaker.play(np.zeros(240), 24000, keep_open=True)  # reopened after stop
+    assert (fake_speaker.opened, fake_speaker.closed) == (3, 2)
+    speaker.release_player()
+    assert fake_speaker.opened == fake_speaker.closed == 3
+    speaker.play(np.zeros(480), 48000)
+    assert fake_speaker.opened == fake_speaker.closed == 4
+
+
+def test_imports():
+    # The speaker is loaded concurrently with the chatbot, so it does not import the chatbot's dependencies.
+    code = "import sys, vrchatbot.text_speaker; print(sorted({'openai', 'tiktoken'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
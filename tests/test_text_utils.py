@@ -0,0 +1,10 @@
+from vrchatbot import text_utils as mod
+
+
+def test_split_sentences():
+    f = mod.split_sentences
+
+    assert list(f(["こんに", "ちは。元気", "？ ", "そう、だ", "ね"])) == ["こんにちは。", "元気？", " そう、", "だね"]
+    assert list(f(["。", "「よろしく」！！ ", " "])) == ["「よろしく」！"]
+    assert list(f([])) == []
+    assert list(f(["a.b", "c"], delimiters=".")) == ["a.", "bc"]
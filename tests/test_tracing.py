@@ -0,0 +1,159 @@
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from vrchatbot import tracing as mod
+
+
+def test_span():
+    assert mod.current_turn() is None
+    with mod.span("a"):  # no-op without turn.
+        pass
+    mod.mark("a")
+
+    turn = mod.Turn(1)
+    with mod.activate(turn):
+        assert mod.current_turn() is turn
+        with mod.span("a"):
+            time.sleep(0.01)
+        mod.add_span("b", turn.start, turn.start + 1.0)
+        mod.mark("m")
+        mod.mark("m", 0.0)  # only the first time is kept.
+    assert mod.current_turn() is None
+
+    assert [name for name, _, _ in turn.spans] == ["a", "b"]
+    _, start, end = turn.spans[0]
+    assert end - start >= 0.01
+    d = turn.to_dict()
+    assert d["turn"] == 1
+    assert d["spans"][1] == ["b", 0.0, 1.0]
+    assert d["marks"]["m"] >= 0.01
+
+
+def test_bind():
+    turn = mod.Turn(1)
+    results = []
+
+    def target():
+        results.append(mod.current_turn())
+        with mod.span("thread"):
+            pass
+
+    with mod.activate(turn):
+        threads = [threading.Thread(target=target), threading.Thread(target=mod.bind(target))]
+    for t in threads:
+        t.start()
+        t.join()
+
+    assert results == [None, turn]
+    assert [name for name, _, _ in turn.spans] == ["thread"]
+
+
+def test_TracedQueue():
+    q = queue.Queue()
+    traced = mod.TracedQueue(q)
+    traced.put(0)
+    turn = mod.Turn(1)
+    with mod.activate(turn):
+        traced.put(1)
+    assert q.get() == (None, 0)
+    assert q.get() == (turn, 1)
+
+
+def test_Tracer(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracer = mod.Tracer(window=100, jsonl_path=str(path))
+    for i in range(200):
+        turn = tracer.start_turn()
+        turn.add_span("a", 0.0, i / 1000)
+        turn.mark(mod.SPEECH_END, 1.0)
+        turn.mark("first_audio", 1.0 + i / 1000)
+        tracer.end_turn(turn)
+    tracer.end_turn(None)
+    tracer.observe("b", 1.0)
+    tracer.close()
+
+    assert tracer.turn_count == 200
+    summary = tracer.summary()
+    assert set(summary) == {"a", "b", "turn.first_audio"}
+    assert summary["a"]["count"] == 200
+    assert summary["a"]["sum"] == pytest.approx(sum(range(200)) / 1000)
+    # percentiles of the recent window, 0.100 ~ 0.199
+    assert summary["a"]["p50"] == pytest.approx(0.1495)
+    assert summary["a"]["p99"] == pytest.approx(0.19801)
+    assert summary["turn.first_audio"]["p95"] == pytest.approx(summary["a"]["p95"])
+    assert "a: p50=150ms p95=194ms p99=198ms n=200" in tracer.format_summary()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 200
+    record = json.loads(lines[-1])
+    assert record["turn"] == 200
+    assert record["spans"][0][0] == "a"
+
+    disabled = mod.Tracer(enabled=False, jsonl_path=str(tmp_path / "disabled.jsonl"))
+    assert disabled.start_turn() is None
+    assert not (tmp_path / "disabled.jsonl").exists()
+
+
+def test_Tracer_prometheus():
+    tracer = mod.Tracer(prometheus_port=0)
+    try:
+        turn = tracer.start_turn()
+        turn.add_span("recognize.decode", 0.0, 0.25)
+        tracer.end_turn(turn)
+
+        url = f"http://127.0.0.1:{tracer.server_port}"
+        with urllib.request.urlopen(f"{url}/metrics", timeout=5) as resp:
+            body = resp.read().decode("utf-8")
+        assert "vrchatbot_turns_total 1" in body
+        assert 'vrchatbot_span_seconds{span="recognize.decode",quantile="0.5"} 0.250000' in body
+        assert 'vrchatbot_span_seconds_count{span="recognize.decode"} 1' in body
+
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other", timeout=5)
+    finally:
+        tracer.close()
+    assert tracer.server_port is None
+
+
+class NoopSpan:
+    """Context manager which does nothing, as the baseline of :func:`mod.span` overhead."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def time_per_span(span, n=10000, repeat=5):
+    """Best seconds per `with span("a")` of `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(n):
+            with span("a"):
+                pass
+        best = min(best, (time.perf_counter() - start) / n)
+    return best
+
+
+def test_span_overhead():
+    # Relative to a no-op context manager measured here, so that the machine speed does not matter.
+    baseline = time_per_span(NoopSpan)
+    assert time_per_span(mod.span) < baseline * 3
+
+    turn = mod.Turn(1)
+    with mod.activate(turn):
+        assert time_per_span(mod.span) < baseline * 6
+    assert len(turn.spans) == 10000 * 5
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from vrchatbot import vad as mod
+
+SR = 16000
+
+
+def speech_like(duration: float, rms: float) -> np.ndarray:
+    """Harmonics with formant like gains and syllabic envelopes."""
+    t = np.arange(int(duration * SR)) / SR
+    wave = sum(np.sin(2 * np.pi * 150 * k * t) * np.exp(-(((150 * k - 600) / 300) ** 2)) for k in range(1, 20))
+    wave *= 0.5 - 0.5 * np.cos(2 * np.pi * 4 * t)
+    return (wave * rms / np.sqrt(np.mean(wave**2))).astype(np.float32)
+
+
+def test_VoiceActivityDetector():
+    with pytest.raises(NotImplementedError):
+        mod.VoiceActivityDetector().detect(np.zeros(10))
+
+
+def test_SpectralVAD_frame_features():
+    vad = mod.SpectralVAD(SR, frame_length=512)
+
+    t = np.arange(1000) / SR
+    energy_db, band_ratio, zcr = vad.frame_features(np.sin(2 * np.pi * 1000 * t).astype(np.float32))
+    assert len(energy_db) == 2  # zero padded
+    assert energy_db[0] == pytest.approx(10 * np.log10(0.5), abs=0.1)
+    assert band_ratio[0] > 0.9
+    assert zcr[0] == pytest.approx(2 * 1000 / SR, abs=0.01)
+
+    _, band_ratio, _ = vad.frame_features(np.sin(2 * np.pi * 60 * t[:512]))  # hum
+    assert band_ratio[0] < 0.1
+
+    rng = np.random.default_rng(0)
+    _, _, zcr = vad.frame_features(rng.standard_normal(512))
+    assert zcr[0] > 0.4
+
+
+def test_SpectralVAD_detect():
+    block = 2048
+    rng = np.random.default_rng(0)
+    vad = mod.SpectralVAD(SR)
+
+    silence = rng.standard_normal(SR).astype(np.float32) * 0.001
+    assert all(vad.detect(silence[i : i + block]) is None for i in range(0, SR - block + 1, block))
+
+    speech = speech_like(1.0, 0.1)
+    results = [vad.detect(speech[i : i + block]) for i in range(0, SR - block + 1, block)]
+    assert results[0] is not None
+    assert sum(r is not None for r in results) >= len(results) - 1
+
+    # Hangover keeps voice just after speech.
+    assert vad.detect(silence[:block]) == 0
+    results = [vad.detect(silence[i : i + block]) for i in range(0, SR - block + 1, block)]
+    assert results[-1] is None
+
+    # Stationary noise is absorbed into noise floor.
+    vad.reset()
+    noise = rng.standard_normal(SR * 10).astype(np.float32) * 0.1
+    results = [vad.detect(noise[i : i + block]) for i in range(0, len(noise) - block + 1, block)]
+    assert all(r is None for r in results)
@@ -1,5 +1,120 @@
-from vrchatbot import __version__
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from vrchatbot import __version__, audio_io, text_speaker
+from vrchatbot.__main__ import ConversationStages
+from vrchatbot.conversation_log import ConversationLogger
+from vrchatbot.pipeline import Pipeline
+from vrchatbot.tracing import Tracer
 
 
 def test_version():
     assert __version__ == "0.2.1"
+
+
+def test_lazy_imports():
+    # Heavy modules are imported by the commands which use them, not by the CLI module.
+    code = "import sys, vrchatbot.__main__; print(sorted({'torch', 'whisper', 'openai', 'pyopenjtalk'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+class StubChatBot:
+    """Streams fixed sentences. `on_sentence` is called before each sentence is sent."""
+
+    def __init__(self, sentences, on_sentence=lambda i: None):
+        self.sentences = sentences
+        self.on_sentence = on_sentence
+        self.last_usage = None
+
+    def responce_stream(self, text):
+        for i, sentence in enumerate(self.sentences):
+            self.on_sentence(i)
+            yield sentence
+
+
+class StubSpeaker:
+    def __init__(self):
+        self.generation = 0
+        self.played = []
+
+    def synthesize(self, text):
+        return text, 16000
+
+    def play(self, wave, sr, keep_open=False):
+        self.played.append(wave)
+
+    def release_player(self):
+        pass
+
+
+class StubRecognizer:
+    def recongnize(self, wave):
+        return {"ja": 1.0}, wave  # The wave is the recognized text.
+
+
+def run_turn(stages, text):
+    """Runs a turn through the stages after recognition. Returns the logged record."""
+    for item in stages.respond((None, (text, {"ja": 1.0}))):
+        stages.play(stages.synthesize(item))
+    stages.logger.close()
+    with open(stages.logger.path, encoding="utf-8") as f:
+        return json.loads(f.readlines()[-1])
+
+
+def test_ConversationStages(tmp_path):
+    stages = ConversationStages(Tracer(), ConversationLogger(str(tmp_path), file_name="log.jsonl"))
+    stages.chatbot = StubChatBot(["こんにちは。", "元気？"])
+    stages.speaker = StubSpeaker()
+
+    record = run_turn(stages, "やあ")
+    assert stages.speaker.played == ["こんにちは。", "元気？"]
+    assert record["recognized"] == "やあ"
+    assert record["responce"] == "こんにちは。元気？"
+    assert not record["interrupted"]
+
+
+def test_ConversationStages_barge_in(tmp_path):
+    stages = ConversationStages(Tracer(), ConversationLogger(str(tmp_path), file_name="log.jsonl"))
+    stages.speaker = StubSpeaker()
+
+    def barge_in(i):
+        if i == 1:
+            stages.speaker.generation += 1
+
+    stages.chatbot = StubChatBot(["こんにちは。", "元気？", "私は元気。"], barge_in)
+
+    record = run_turn(stages, "やあ")
+    assert stages.speaker.played == ["こんにちは。"]
+    assert record["responce"] == "こんにちは。"  # only the spoken text.
+    assert record["interrupted"]
+
+
+def test_ConversationStages_pipeline(tmp_path, monkeypatch):
+    def tts(text, **kwds):
+        return np.full(len(text) * 100, 2**14, dtype=np.float64), 48000
+
+    monkeypatch.setattr(text_speaker.pyopenjtalk, "tts", tts)
+    sink = audio_io.CaptureSink()
+    stages = ConversationStages(Tracer(), ConversationLogger(str(tmp_path), file_name="log.jsonl"))
+    stages.speech_recognizer = StubRecognizer()
+    stages.chatbot = StubChatBot(["こんにちは。", "元気？"])
+    stages.speaker = text_speaker.TextSpeaker(sink=sink)
+
+    pipeline = Pipeline()
+    for name in ["recognize", "respond", "synthesize", "play"]:
+        pipeline.add_stage(name, getattr(stages, name))
+    pipeline.start()
+    for i, text in enumerate(["やあ", "元気"]):
+        pipeline.input_queue.put((None, text))
+        idle_count = 0
+        while idle_count < 2:  # Twice in a row, not to miss an item moving between stages.
+            time.sleep(0.05)
+            idle_count = idle_count + 1 if pipeline.is_idle() else 0
+        assert sink.opened == sink.closed == i + 1  # one player stream per turn
+    assert [len(w) for _, _, w in sink.played] == [600, 300] * 2
+    pipeline.shutdown()
@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+import pytest
+
+from vrchatbot import wave_cache as mod
+
+
+def make_wave(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).uniform(-1, 1, n)
+
+
+def test_WaveCache_make_key():
+    f = mod.WaveCache.make_key
+    assert f("こんにちは") == f("こんにちは")
+    assert f("こんにちは") != f("こんばんは")
+    assert f("こんにちは", speed=1.0, half_tone=0.0) == f("こんにちは", half_tone=0.0, speed=1.0)
+    assert f("こんにちは", speed=1.0) != f("こんにちは", speed=1.2)
+
+
+def test_WaveCache_memory():
+    cls = mod.WaveCache
+    cache = cls(max_bytes=4 * 250)  # 250 float32 samples
+
+    assert cache.get("a") is None
+    wave = cache.put("a", make_wave(100), 48000)
+    assert wave.dtype == np.float32
+    assert not wave.flags.writeable
+    cache.put("b", make_wave(100), 48000)
+    assert cache.get("a")[0] is wave
+    cache.put("c", make_wave(100), 48000)  # "b" is least recently used.
+    assert "b" not in cache
+    assert len(cache) == 2
+    assert cache.memory_bytes == 800
+    cache.put("huge", make_wave(1000), 48000)  # larger than budget.
+    assert "huge" not in cache
+    assert (cache.memory_hits, cache.disk_hits, cache.misses) == (1, 0, 1)
+
+    with pytest.raises(ValueError):
+        cls(dtype="float64")
+
+
+@pytest.mark.parametrize("dtype, atol", [("float32", 0), ("int16", 2**-15)])
+def test_WaveCache_disk(tmp_path, dtype, atol):
+    cls = mod.WaveCache
+    wave = make_wave(1000)
+
+    cache = cls(cache_dir=str(tmp_path), dtype=dtype)
+    cache.put("0123abcd", wave, 48000)
+
+    cache = cls(cache_dir=str(tmp_path), dtype=dtype)  # restart
+    assert "0123abcd" in cache
+    cached, sr = cache.get("0123abcd")
+    assert sr == 48000
+    assert cached.dtype == np.float32
+    np.testing.assert_allclose(cached, wave, atol=atol + 1e-7)
+    if dtype == "float32":
+        assert isinstance(cached, np.memmap)
+    assert cache.disk_hits == 1
+    assert cache.get("0123abcd")[0] is cached  # promoted to memory.
+    assert cache.memory_hits == 1
+    assert list(tmp_path.glob("01/*")) != []
+
+
+def test_WaveCache_broken_file(tmp_path):
+    cls = mod.WaveCache
+    cache = cls(cache_dir=str(tmp_path))
+    for key, data in [("00empty", b""), ("01truncated", b"\x00" * 7)]:  # left by a crash while writing.
+        path = tmp_path / key[:2] / f"{key}_48000.f32"
+        path.parent.mkdir()
+        path.write_bytes(data)
+        assert cache.get(key) is None
+        assert not path.exists()  # removed to be stored again.
+        cache.put(key, make_wave(100), 48000)
+        cache.clear_memory()
+        assert cache.get(key)[0].shape == (100,)
+    assert (cache.disk_hits, cache.misses) == (2, 2)
+
+
+def test_WaveCache_threads(tmp_path):
+    cache = mod.WaveCache(max_bytes=4 * 1000, cache_dir=str(tmp_path))
+
+    def worker(i):
+        for j in range(20):
+            key = f"{(i + j) % 8:02d}key"
+            if cache.get(key) is None:
+                cache.put(key, make_wave(100, j), 16000)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.memory_bytes == sum(w.nbytes for w, _ in cache._entries.values())
+    assert cache.memory_bytes <= cache.max_bytes
@@ -1 +1,4 @@
+import time
+
 __version__ = "0.2.1"
+STARTED = time.perf_counter()  # Startup time of commands is measured from the import of this package.
@@ -1,107 +1,416 @@
-import os
 import queue
 import time
 from argparse import ArgumentParser
-from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
 
 import toml
-from whisper import DecodingOptions
 
-from .chatbot import ChatBot
+# Heavy modules (torch, whisper, openai and pyopenjtalk) are imported by the commands which use them.
+from . import STARTED, tracing
+from .conversation_log import ConversationLogger
+from .pipeline import Pipeline
 from .recorder import Recorder, display_audio_devices
-from .speech_recongnition import SpeechRecongition
-from .text_speaker import TextSpeaker
+from .text_utils import split_sentences
+from .tracing import TracedQueue, Tracer
 
 DISPLAY_AUDIO_DEVICES = "audio-devices"
 RUN = "run"
 CHAT = "chat"
 RECOGNIZE = "recognize"
+PREWARM = "prewarm"
+
+LANGUAGE_TOP_K = 5
 
 
 def get_parser() -> ArgumentParser:
     """Making argument parser."""
     parser = ArgumentParser()
 
-    parser.add_argument("command", type=str, choices=[DISPLAY_AUDIO_DEVICES, RUN, CHAT, RECOGNIZE])
+    parser.add_argument("command", type=str, choices=[DISPLAY_AUDIO_DEVICES, RUN, CHAT, RECOGNIZE, PREWARM])
     parser.add_argument("-c", "--config_file_path", type=str, default="botconfig.toml")
     parser.add_argument("--log_dir", type=str, default="data/logs/")
+    parser.add_argument("--phrases_file", type=str, default=None, help="Phrases for prewarm. One phrase per line.")
 
     return parser
 
 
+def startup_time() -> float:
+    """Seconds since `vrchatbot` was imported."""
+    return time.perf_counter() - STARTED
+
+
+def top_language_probs(probs: dict, k: int = LANGUAGE_TOP_K) -> dict:
+    """Returns `k` most probable languages for logging."""
+    return {lang: round(probs[lang], 4) for lang in sorted(probs, key=probs.get, reverse=True)[:k]}
+
+
+def load_recognizer(config: dict, warm_up: bool = False) -> Any:
+    from whisper import DecodingOptions
+
+    from .speech_recongnition import SpeechRecongition
+
+    recognizer = SpeechRecongition(options=DecodingOptions(**config["DecodingOption"]), **config["SpeechRecognition"])
+    if warm_up:
+        recognizer.warm_up()
+    return recognizer
+
+
+def load_chatbot(config: dict) -> Any:
+    from .chatbot import ChatBot
+
+    return ChatBot(**config["ChatBot"])
+
+
+def load_speaker(config: dict, warm_up: bool = False) -> Any:
+    from .text_speaker import TextSpeaker
+
+    speaker = TextSpeaker(**config["Speaker"])
+    if warm_up:
+        speaker.warm_up()
+    return speaker
+
+
+def start_loading(config: dict) -> dict[str, Future]:
+    """Load and warm up the speech recognizer, the chatbot and the speaker concurrently on
+    background threads.
+
+    Returns:
+        futures (dict[str, Future]): Futures of `(component, seconds)` by name.
+    """
+    loaders: dict[str, Callable[[], Any]] = {
+        "recognizer": lambda: load_recognizer(config, warm_up=True),
+        "chatbot": lambda: load_chatbot(config),
+        "speaker": lambda: load_speaker(config, warm_up=True),
+    }
+
+    def timed(load: Callable[[], Any]) -> tuple[Any, float]:
+        start = time.perf_counter()
+        component = load()
+        return component, time.perf_counter() - start
+
+    executor = ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix="Loading")
+    futures = {name: executor.submit(timed, load) for name, load in loaders.items()}
+    executor.shutdown(wait=False)
+    return futures
+
+
+def wait_loading(futures: dict[str, Future], tracer: Tracer) -> list:
+    """Wait for :func:`start_loading`. Loading errors are raised here.
+
+    Returns:
+        components (list): Components in the order of `futures`.
+    """
+    components = []
+    for name, future in futures.items():
+        component, seconds = future.result()
+        tracer.observe(f"startup.{name}", seconds)
+        print(f"Loaded {name} in {seconds:.2f} seconds.")
+        components.append(component)
+    tracer.observe("startup.ready", startup_time())
+    return components
+
+
 def main(args, config: dict) -> None:
+    if "Pipeline" in config:
+        run_pipeline(args, config)
+        return
+
     print("Setting up...")
+    futures = start_loading(config)
+    # Turns are traced for the latencies of the log, even without the Tracing section.
+    tracer = Tracer(**config.get("Tracing", {}))
+    show_latency = "Tracing" in config
+
+    # Listen while loading. Utterances during loading are answered when loading is finished.
     recorder = Recorder(**config["Recorder"])
-    speech_recognizer = SpeechRecongition(
-        options=DecodingOptions(**config["DecodingOption"]), **config["SpeechRecognition"]
-    )
-    chatbot = ChatBot(**config["ChatBot"])
-    speaker = TextSpeaker(**config["Speaker"])
-    print("Ready.")
+    # Each utterance is traced as one turn from its onset.
+    recorder.add_onset_callback(lambda: tracing.set_current_turn(tracer.start_turn()))
+    loading_queue: queue.Queue = queue.Queue()
+    recorder.record_forever_background(TracedQueue(loading_queue), is_daemon=True)
+    print(f"Listening. ({startup_time():.2f} seconds)")
 
-    log_file_name = datetime.now().strftime("%Y-%m-%d %H-%M-%S.log")
+    speech_recognizer, chatbot, speaker = wait_loading(futures, tracer)
+    # An utterance spoken during the handover is recorded to its end, not split into two turns.
+    recorder.shutdown_record_forever(finish_utterance=True)
 
-    with open(os.path.join(args.log_dir, log_file_name), "a", encoding="utf-8") as logf:
-        while True:
-            wave = recorder.record_audio_until_silence(5)
-            if wave is None:
-                continue
-            _, text = speech_recognizer.recongnize(wave)
+    if "StreamingRecognition" in config:
+        from .speech_recongnition import StreamingRecognizer
+
+        streaming_recognizer = StreamingRecognizer(speech_recognizer, **config["StreamingRecognition"])
+    else:
+        streaming_recognizer = None
+    barge_in = "BargeIn" in config
+    if barge_in:
+        recorder.add_onset_callback(speaker.stop)
+    print(f"Ready. ({startup_time():.2f} seconds)")
+
+    def utterances():
+        """Yields `(turn, probs, text)` of recognized utterances."""
+        while not loading_queue.empty():
+            turn, wave = loading_queue.get()
+            with tracing.activate(turn):
+                probs, text = speech_recognizer.recongnize(wave)
+            yield turn, probs, text
+
+        while not recorder.source_ended:
+            if streaming_recognizer is None:
+                wave = recorder.record_audio_until_silence(5)
+                if wave is None:
+                    continue
+                probs, text = speech_recognizer.recongnize(wave)
+            else:
+                for block in recorder.stream_audio_until_silence(5):
+                    partial = streaming_recognizer.push(block)
+                    if partial is not None:
+                        print(f"Partial: {partial}")
+                probs, text = None, streaming_recognizer.finalize()
+
+            turn = tracing.current_turn()
+            tracing.set_current_turn(None)
+            yield turn, probs, text
+
+    with ConversationLogger(args.log_dir, **config.get("Logging", {})) as logger:
+
+        def log_responce(stats: dict, turn: Optional[tracing.Turn], text: str, probs: Optional[dict]) -> None:
+            tracer.end_turn(turn)
+            # The responce stream is not started if it has been stopped while queued.
+            responce = stats["text"]
+            interrupted = " (interrupted)" if stats["interrupted"] else ""
+            print(f"Responce: {responce}{interrupted}\n")
+            if stats["time_to_first_audio"] is not None:
+                print(f"Time to first audio: {stats['time_to_first_audio']:.2f} seconds\n")
+            logger.log_turn(
+                turn,
+                recognized=text,
+                language_probs=top_language_probs(probs) if probs else None,
+                responce=responce,
+                interrupted=stats["interrupted"],
+                usage=chatbot.last_usage if responce != "" else None,
+            )
+
+        for turn, probs, text in utterances():
             if text == "":
                 continue
 
-            rec_txt = f"Recongnized: {text}\n"
-            logf.write(rec_txt)
-            print(rec_txt)
-            responce = chatbot.responce(text)
-            rsp_txt = f"Responce: {responce}\n"
-            logf.write(rsp_txt)
-            print(rsp_txt)
+            print(f"Recongnized: {text}\n")
+            # Each sentence is synthesized as soon as it is generated, while the previous one is playing.
+            with tracing.activate(turn):
+                if barge_in:
+                    # Keep listening while speaking. The previous responce has been stopped by the onset of this
+                    # utterance, so wait for it to finish recording its history, unless its stream is stalled.
+                    speaker.flush()
+                    future = speaker.speak_async(split_sentences(chatbot.responce_stream(text)))
+                    future.add_done_callback(
+                        lambda f, turn=turn, text=text, probs=probs: log_responce(f.result(), turn, text, probs)
+                    )
+                else:
+                    stats = speaker.speak_stream(split_sentences(chatbot.responce_stream(text)))
+                    log_responce(stats, turn, text, probs)
+
+        # Offline audio source has been replayed to the end.
+        speaker.flush()
+        speaker.close()
+        if show_latency and tracer.turn_count > 0:
+            print(f"Latency:\n{tracer.format_summary()}")
+        tracer.close()
+        print("Audio source ended.")
+
+
+class ConversationStages:
+    """Stages of :func:`run_pipeline`.
+
+    Items between stages are `(turn, item)`. The respond stage sends `(turn, record)` after the last
+    sentence, and the play stage ends the turn, closes its player stream and logs the record with it. Components are set after
+    they are loaded, before the stages are started.
+    """
+
+    def __init__(self, tracer: Tracer, logger: ConversationLogger) -> None:
+        """
+        Args:
+            tracer (Tracer): Tracer ending turns.
+            logger (ConversationLogger): Logger of turns.
+        """
+        self.tracer = tracer
+        self.logger = logger
+        self.speech_recognizer: Any = None
+        self.chatbot: Any = None
+        self.speaker: Any = None
+
+    def recognize(self, turn_and_wave):
+        turn, wave = turn_and_wave
+        with tracing.activate(turn):
+            probs, text = self.speech_recognizer.recongnize(wave)
+        if text == "":
+            return None
+        print(f"Recongnized: {text}\n")
+        return turn, (text, probs)
+
+    def respond(self, turn_and_text):
+        turn, (text, probs) = turn_and_text
+        generation = self.speaker.generation
+        interrupted = False
+        responce = ""
+        with tracing.activate(turn):
+            for sentence in split_sentences(self.chatbot.responce_stream(text)):
+                if self.speaker.generation != generation:  # barge-in. The sentence is not spoken.
+                    interrupted = True
+                    break
+                responce += sentence
+                yield turn, sentence
+        print(f"Responce: {responce}\n")
+        yield turn, {
+            "recognized": text,
+            "language_probs": top_language_probs(probs),
+            "responce": responce,
+            "interrupted": interrupted,
+            "usage": self.chatbot.last_usage,
+        }
+
+    def synthesize(self, turn_and_text):
+        turn, text = turn_and_text
+        if isinstance(text, dict):
+            return turn, text
+        with tracing.activate(turn):
+            return turn, self.speaker.synthesize(text)
+
+    def play(self, turn_and_wave):
+        turn, wave_and_sr = turn_and_wave
+        if isinstance(wave_and_sr, dict):
+            self.speaker.release_player()
+            self.tracer.end_turn(turn)
+            self.logger.log_turn(turn, **wave_and_sr)
+            return
+        with tracing.activate(turn):
+            # Sentences of a turn are played on one player stream, which is closed at the end of the turn.
+            self.speaker.play(*wave_and_sr, keep_open=True)
+
+
+def run_pipeline(args, config: dict) -> None:
+    """Run bot with concurrent stages. Recording continues while recognizing, responding and
+    speaking."""
+    print("Setting up...")
+    futures = start_loading(config)
+    tracer = Tracer(**config.get("Tracing", {}))
+    show_latency = "Tracing" in config
+
+    pipeline_config = config["Pipeline"]
+    metrics_interval = pipeline_config.get("metrics_interval", 0)
 
-            speaker.speak_text(responce)
+    with ConversationLogger(args.log_dir, **config.get("Logging", {})) as logger:
+
+        # Components used by stages are loaded in background. Stages are started after loading.
+        stages = ConversationStages(tracer, logger)
+        pipeline = Pipeline(**pipeline_config)
+        pipeline.add_stage("recognize", stages.recognize)
+        pipeline.add_stage("respond", stages.respond)
+        pipeline.add_stage("synthesize", stages.synthesize)
+        pipeline.add_stage("play", stages.play)
+
+        # Listen while loading. Utterances are queued until the stages are started.
+        recorder = Recorder(**config["Recorder"])
+        # Onset callbacks run on the recording thread, where `TracedQueue` attaches the turn to the wave.
+        recorder.add_onset_callback(lambda: tracing.set_current_turn(tracer.start_turn()))
+        recorder.record_forever_background(TracedQueue(pipeline.input_queue), is_daemon=True)
+        print(f"Listening. ({startup_time():.2f} seconds)")
+
+        stages.speech_recognizer, stages.chatbot, stages.speaker = wait_loading(futures, tracer)
+        speaker = stages.speaker
+
+        if "BargeIn" in config:
+
+            def barge_in() -> None:
+                speaker.stop()
+                pipeline.clear(["synthesize", "play"], keep=lambda item: isinstance(item[1], dict))  # end of turns
+
+            recorder.add_onset_callback(barge_in)
+
+        pipeline.start(is_daemon=True)
+        print(f"Ready. ({startup_time():.2f} seconds)")
+
+        last_metrics_time = time.monotonic()
+        while not recorder.source_ended:
+            time.sleep(0.1)
+            if metrics_interval > 0 and time.monotonic() - last_metrics_time >= metrics_interval:
+                last_metrics_time = time.monotonic()
+                print(f"Queue metrics: {pipeline.format_metrics()}")
+                if show_latency and tracer.turn_count > 0:
+                    print(f"Latency:\n{tracer.format_summary()}")
+
+        # Offline audio source has been replayed to the end. Wait for the remaining utterances.
+        recorder.shutdown_record_forever()
+        idle_count = 0
+        while idle_count < 2:  # Twice in a row, not to miss an item moving between stages.
+            time.sleep(0.1)
+            idle_count = idle_count + 1 if pipeline.is_idle() else 0
+        pipeline.shutdown()
+        speaker.close()
+        print(f"Queue metrics: {pipeline.format_metrics()}")
+        if show_latency and tracer.turn_count > 0:
+            print(f"Latency:\n{tracer.format_summary()}")
+        tracer.close()
+        print("Audio source ended.")
 
 
 def chat(args, config: dict) -> None:
     print("Setting up...")
-    chatbot = ChatBot(**config["ChatBot"])
-    print("Ready.")
+    chatbot = load_chatbot(config)
+    print(f"Ready. ({startup_time():.2f} seconds)")
 
-    log_file_name = datetime.now().strftime("%Y-%m-%d %H-%M-%S.log")
-    with open(os.path.join(args.log_dir, log_file_name), "a", encoding="utf-8") as logf:
+    with ConversationLogger(args.log_dir, **config.get("Logging", {})) as logger:
         while True:
             user_input = input(chatbot.human_name)
-            logf.write(f"{chatbot.human_name}{user_input}\n")
-            responce = chatbot.responce(user_input)
-            print(chatbot.ai_name, responce)
-            logf.write(f"{chatbot.ai_name}{responce}\n")
+            print(chatbot.ai_name, end="", flush=True)
+            for delta in chatbot.responce_stream(user_input):
+                print(delta, end="", flush=True)
+            print()
+            logger.log("chat", user=user_input, responce=chatbot.stored_prompts[-1], usage=chatbot.last_usage)
 
 
 def recoginize_forever(args, config: dict) -> None:
     """Demonstration for speech recoginition."""
     print("Setting up...")
     recorder = Recorder(**config["Recorder"])
-    speech_recognizer = SpeechRecongition(
-        options=DecodingOptions(**config["DecodingOption"]), **config["SpeechRecognition"]
-    )
+    speech_recognizer = load_recognizer(config)
     wave_queue = recorder.record_forever_background(is_daemon=True)
-    print("Ready.")
+    result_queue = speech_recognizer.recognize_forever_background(
+        wave_queue, is_daemon=True, **config.get("BatchRecognition", {})
+    )
+    print(f"Ready. ({startup_time():.2f} seconds)")
 
-    log_file_name = datetime.now().strftime("%Y-%m-%d %H-%M-%S.log")
-    with open(os.path.join(args.log_dir, log_file_name), "a", encoding="utf-8") as logf:
+    with ConversationLogger(args.log_dir, **config.get("Logging", {})) as logger:
         while True:
             try:
-                wave = wave_queue.get(timeout=5)
-                probs, text = speech_recognizer.recongnize(wave)
-                msg = f"{max(probs, key=probs.get)}: {text}\n"
-                print(msg, end="")
-                logf.write(msg)
+                probs, text = result_queue.get(timeout=5)
+                print(f"{max(probs, key=probs.get)}: {text}")
+                logger.log("recognized", recognized=text, language_probs=top_language_probs(probs))
 
             except queue.Empty:
-                pass
+                if recorder.source_ended and wave_queue.empty():
+                    print("Audio source ended.")
+                    break
 
             time.sleep(0.01)
 
 
+def prewarm(args, config: dict) -> None:
+    """Synthesize `prewarm_phrases` of Speaker config and phrases of `--phrases_file` into the
+    wave cache."""
+    from .text_speaker import TextSpeaker
+
+    speaker_config = dict(config["Speaker"])
+    phrases = list(speaker_config.pop("prewarm_phrases", None) or [])
+    if args.phrases_file is not None:
+        with open(args.phrases_file, "r", encoding="utf-8") as f:
+            phrases += [line.strip() for line in f if line.strip() != ""]
+
+    speaker = TextSpeaker(**speaker_config)
+    print(f"Ready. ({startup_time():.2f} seconds)")
+    start = time.perf_counter()
+    count = speaker.prewarm(phrases)
+    print(f"Synthesized {count} sentences of {len(phrases)} phrases in {time.perf_counter() - start:.1f} seconds.")
+
+
 if __name__ == "__main__":
 
     parser = get_parser()
@@ -109,6 +418,7 @@ if __name__ == "__main__":
 
     if args.command == DISPLAY_AUDIO_DEVICES:
         display_audio_devices()
+        print(f"({startup_time():.2f} seconds)")
     elif args.command == RUN:
         cfg = toml.load(args.config_file_path)
         main(args, cfg)
@@ -118,3 +428,6 @@ if __name__ == "__main__":
     elif args.command == RECOGNIZE:
         cfg = toml.load(args.config_file_path)
         recoginize_forever(args, cfg)
+    elif args.command == PREWARM:
+        cfg = toml.load(args.config_file_path)
+        prewarm(args, cfg)
@@ -0,0 +1,192 @@
+import asyncio
+import random
+from typing import Any, Optional
+from urllib.parse import quote_plus
+
+import aiohttp
+import openai
+
+from . import tracing
+from .chatbot import ChatBot
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ChatBotAPIError(RuntimeError):
+    """Error response of the completion API which is not retried."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class AsyncChatBot(ChatBot):
+    """Asyncio version of :class:`ChatBot`.
+
+    Requests go through one pooled keep-alive session with per-request deadlines. 429 and 5xx
+    responses, timeouts and connection errors are retried with jittered exponential backoff.
+    :meth:`submit` cancels the in-flight completion of the same session so a newer utterance can
+    pre-empt it.
+
+    Use it as an async context manager, or call :meth:`close` when finished.
+    """
+
+    def __init__(
+        self,
+        api_key_file_path: Any,
+        request_timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        pool_size: int = 4,
+        api_base: Optional[str] = None,
+        **kwds: Any,
+    ) -> None:
+        """
+        Args:
+            api_key_file_path (str | Pathlike): Path to the api key file.
+            request_timeout (float): Deadline of one request in seconds.
+            connect_timeout (float): Deadline of connecting in seconds.
+            max_retries (int): Max number of retries of one completion.
+            backoff_base (float): Backoff before the first retry in seconds. It doubles every retry.
+            backoff_max (float): Upper limit of backoff in seconds.
+            pool_size (int): Max number of pooled connections.
+            api_base (Optional[str]): Base url of the API. If None, `openai.api_base` is used.
+            kwds: Other key word arguments for :class:`ChatBot`.
+        """
+        super().__init__(api_key_file_path, **kwds)
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.api_base = api_base
+
+        self.retry_count = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tasks: dict[Any, asyncio.Task] = {}
+
+    @property
+    def url(self) -> str:
+        api_base = self.api_base if self.api_base is not None else openai.api_base
+        return f"{api_base}/engines/{quote_plus(self.engine)}/completions"
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Pooled session. It is created in the running event loop on first use."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout, connect=self.connect_timeout),
+                headers={"Authorization": f"Bearer {openai.api_key}"},
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """Cancel all in-flight completions and close the http session."""
+        for session_id in list(self._tasks):
+            await self.cancel(session_id)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "AsyncChatBot":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full jitter backoff before `attempt`-th retry. `retry_after` of the server is the lower limit."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def create_completion(self, prompt: str) -> dict:
+        """Request a completion with retries.
+
+        Raises:
+            ChatBotAPIError: Error response which is not retried, or retries are exhausted.
+            asyncio.TimeoutError: The last attempt timed out.
+            aiohttp.ClientConnectionError: The last attempt could not connect.
+        """
+        payload = {
+            "prompt": prompt,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            **self.completion_kwds,
+        }
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self.session.post(self.url, json=payload) as resp:
+                    if resp.status == 200:
+                        return await resp.json()
+                    error = ChatBotAPIError(resp.status, await resp.text())
+                    if resp.status not in RETRY_STATUSES:
+                        raise error
+                    if "Retry-After" in resp.headers:
+                        try:
+                            retry_after = float(resp.headers["Retry-After"])
+                        except ValueError:
+                            pass
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+                error = e
+
+            if attempt >= self.max_retries:
+                raise error
+            await asyncio.sleep(self.backoff(attempt, retry_after))
+            attempt += 1
+            self.retry_count += 1
+
+    async def responce(self, user_input: str, session_id: Any = None) -> str:
+        """Communicate to OpenAI api.
+
+        If the completion fails or is cancelled, the turn is not stored. The history has been
+        prepared for the request before it is sent, so the oldest prompts may have been removed to
+        make space, and a finished background summary may have been applied.
+
+        Args:
+            user_input (str): User input text.
+            session_id (Any): Session id, e.g. speaker name.
+
+        Returns:
+            responce (str): Responce text.
+        """
+        with tracing.span("chatbot.prompt"):
+            cache_key, text = self.lookup_cache(user_input, session_id)
+            user_input, user_input_token_size, sending_prompt = self.make_sending_prompt(user_input, session_id)
+        if text is None:
+            with tracing.span("chatbot.completion"):
+                resp = await self.create_completion(sending_prompt)
+            text = resp["choices"][0]["text"]
+            self.store_cache(cache_key, text)
+        tracing.mark("first_token")
+        self.store_turn(user_input, user_input_token_size, text, session_id)
+        return text
+
+    def submit(self, user_input: str, session_id: Any = None) -> asyncio.Task:
+        """Start :meth:`responce` as a task. The in-flight task of the same session is cancelled.
+
+        Returns:
+            task (asyncio.Task): Task of :meth:`responce`.
+        """
+        task = self._tasks.get(session_id)
+        if task is not None and not task.done():
+            task.cancel()
+        self._tasks[session_id] = asyncio.create_task(self.responce(user_input, session_id))
+        return self._tasks[session_id]
+
+    async def cancel(self, session_id: Any = None) -> None:
+        """Cancel the in-flight task of :meth:`submit` and wait for it."""
+        task = self._tasks.pop(session_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
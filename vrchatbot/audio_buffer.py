@@ -0,0 +1,116 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+SAMPLE_DTYPE = np.float32
+INT16_SCALE = 1 / 2**15  # int16 range -> -1.0 ~ 1.0
+
+
+def to_float32(wave: np.ndarray, scale: Optional[float] = None) -> np.ndarray:
+    """Returns 1d float32 wave with at most one allocation.
+
+    If `wave` is already contiguous float32 and `scale` is None, `wave` itself (or its 1d view) is
+    returned without copy. Otherwise samples are cast and scaled in one pass into a new array, so
+    that no intermediate float64 array is made.
+
+    Args:
+        wave (np.ndarray): Wave of any float or int dtype. (N,) or (N, 1) shape.
+        scale (Optional[float]): Factor multiplied to samples, e.g. :data:`INT16_SCALE`.
+
+    Returns:
+        wave (np.ndarray): 1d float32 wave.
+    """
+    wave = wave.reshape(-1)
+    if scale is None:
+        return np.ascontiguousarray(wave, dtype=SAMPLE_DTYPE)
+    return np.multiply(wave, scale, dtype=SAMPLE_DTYPE)
+
+
+def resampled_length(length: int, sample_rate: int, target_rate: int) -> int:
+    """Number of samples of a wave of `length` samples resampled to `target_rate`."""
+    return length * target_rate // sample_rate
+
+
+def resample(
+    wave: np.ndarray,
+    sample_rate: int,
+    target_rate: int,
+    scale: Optional[float] = None,
+    out: Optional[np.ndarray] = None,
+    block_size: int = 4096,
+) -> np.ndarray:
+    """Resample wave by linear interpolation into float32 with at most one allocation.
+
+    The output is computed block by block, so that temporary arrays are bounded by `block_size`
+    regardless of the wave length. Source positions are computed with integers on the reduced
+    ratio of sample rates, so that there is no drift on long waves.
+
+    Args:
+        wave (np.ndarray): 1d wave of any float or int dtype.
+        sample_rate (int): Sample rate of `wave`.
+        target_rate (int): Sample rate of the output.
+        scale (Optional[float]): Factor multiplied to samples, e.g. :data:`INT16_SCALE`.
+        out (Optional[np.ndarray]): float32 output array of :func:`resampled_length` samples. If None,
+            a new array is allocated.
+        block_size (int): Number of output samples computed at once.
+
+    Returns:
+        out (np.ndarray): Resampled float32 wave.
+
+    Raises:
+        ValueError: if shape or dtype of `out` is wrong.
+    """
+    wave = wave.reshape(-1)
+    if sample_rate == target_rate:
+        if out is None:
+            return to_float32(wave, scale)
+        np.multiply(wave, 1.0 if scale is None else scale, out=out, casting="same_kind")
+        return out
+
+    length = resampled_length(len(wave), sample_rate, target_rate)
+    if out is None:
+        out = np.empty(length, dtype=SAMPLE_DTYPE)
+    elif out.shape != (length,) or out.dtype != SAMPLE_DTYPE:
+        raise ValueError(f"`out` must be float32 array of shape ({length},). Input: {out.dtype} {out.shape}")
+
+    g = math.gcd(sample_rate, target_rate)
+    up, down = target_rate // g, sample_rate // g
+    last = len(wave) - 1
+    for start in range(0, length, block_size):
+        stop = min(start + block_size, length)
+        numerator = np.arange(start * down, stop * down, down, dtype=np.int64)
+        index = numerator // up
+        frac = (numerator - index * up).astype(SAMPLE_DTYPE)
+        frac /= up
+        segment = out[start:stop]
+        # Interpolated in float32, since the difference of int samples can overflow.
+        left = wave[index].astype(SAMPLE_DTYPE, copy=False)
+        right = wave[np.minimum(index + 1, last)].astype(SAMPLE_DTYPE, copy=False)
+        np.subtract(right, left, out=segment)
+        segment *= frac
+        segment += left
+        if scale is not None:
+            segment *= scale
+    return out
+
+
+def convert(
+    wave: np.ndarray, sample_rate: int, target_rate: Optional[int] = None, scale: Optional[float] = None
+) -> tuple[np.ndarray, int]:
+    """Convert wave to 1d float32 at `target_rate` with at most one allocation. See :func:`to_float32`
+    and :func:`resample`.
+
+    Args:
+        wave (np.ndarray): Wave of any float or int dtype.
+        sample_rate (int): Sample rate of `wave`.
+        target_rate (Optional[int]): Sample rate of the output. If None, `sample_rate` is kept.
+        scale (Optional[float]): Factor multiplied to samples.
+
+    Returns:
+        wave (np.ndarray): Converted wave.
+        sample_rate (int): Sample rate of converted wave.
+    """
+    if target_rate is None or target_rate == sample_rate:
+        return to_float32(wave, scale), sample_rate
+    return resample(wave, sample_rate, target_rate, scale), target_rate
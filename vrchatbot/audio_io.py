@@ -0,0 +1,346 @@
+"""Audio devices of :class:`Recorder` and :class:`TextSpeaker`.
+
+Sound devices are provided by `soundcard`, which is imported on demand because it needs an audio
+server. Offline backends have the same interface as `soundcard` microphones and speakers
+(`recorder(samplerate, channels).record(numframes)` and `player(samplerate).play(data)`), so
+that the bot can be run and benchmarked without audio devices.
+"""
+
+import threading
+import time
+import wave as wavefile
+from typing import Any, Optional, Union
+
+import numpy as np
+
+from .audio_buffer import resample, to_float32
+
+
+def soundcard() -> Any:
+    """Import and return `soundcard` module."""
+    import soundcard as sc
+
+    return sc
+
+
+def get_microphone(mic_index_or_name: Optional[Union[str, int]] = None) -> Any:
+    """Returns `soundcard` microphone including loopback devices.
+
+    Args:
+        mic_index_or_name (Optional[str | int]): Mic index or name. If `None`, default microphone is used.
+
+    Raises:
+        ValueError: if mic_index_or_name is not str or int.
+    """
+    sc = soundcard()
+    if mic_index_or_name is None:
+        return sc.default_microphone()
+
+    if isinstance(mic_index_or_name, str):
+        id = mic_index_or_name
+    elif isinstance(mic_index_or_name, int):
+        id = sc.all_microphones(True)[mic_index_or_name].name
+    else:
+        raise ValueError("Type of `mic_index_or_name must be str or int. Input: {}".format(type(mic_index_or_name)))
+    return sc.get_microphone(id=id, include_loopback=True)
+
+
+def get_speaker(speaker_index_or_name: Optional[Union[str, int]] = None) -> Any:
+    """Returns `soundcard` speaker.
+
+    Args:
+        speaker_index_or_name (Optional[str | int]): Speaker index or name. If `None`, default speaker is used.
+
+    Raises:
+        ValueError: if speaker_index_or_name is not str or int.
+    """
+    sc = soundcard()
+    if speaker_index_or_name is None:
+        return sc.default_speaker()
+
+    if isinstance(speaker_index_or_name, str):
+        id = speaker_index_or_name
+    elif isinstance(speaker_index_or_name, int):
+        id = sc.all_speakers()[speaker_index_or_name].name
+    else:
+        raise ValueError(
+            "Type of `speaker_index_or_name must be str or int. Input: {}".format(type(speaker_index_or_name))
+        )
+    return sc.get_speaker(id)
+
+
+WAV_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def load_wave(path: str, sample_rate: Optional[int] = None) -> tuple[np.ndarray, int]:
+    """Load audio file as mono float32 wave.
+
+    WAV files are read with the standard library. Other formats such as MP3 are decoded by
+    `whisper.audio.load_audio`, which requires `ffmpeg`.
+
+    Args:
+        path (str): Audio file path.
+        sample_rate (Optional[int]): Sample rate of the output. If None, the rate of WAV file is kept
+            and other formats are decoded at 16kHz.
+
+    Returns:
+        wave (np.ndarray): float32 wave. Range is -1.0 ~ 1.0
+        sample_rate (int): Sample rate of wave.
+    """
+    if not path.lower().endswith(".wav"):
+        from whisper.audio import SAMPLE_RATE, load_audio
+
+        sample_rate = sample_rate or SAMPLE_RATE
+        return load_audio(path, sample_rate), sample_rate
+
+    with wavefile.open(path, "rb") as f:
+        width = f.getsampwidth()
+        if width not in WAV_DTYPES:
+            raise ValueError(f"Unsupported sample width of WAV file: {width} bytes")
+        channels = f.getnchannels()
+        sr = f.getframerate()
+        data = np.frombuffer(f.readframes(f.getnframes()), dtype=WAV_DTYPES[width])
+
+    if width == 1:
+        data = data.astype(np.int16) - 128
+        scale = 1 / 128
+    else:
+        scale = 1 / 2 ** (8 * width - 1)
+    if channels > 1:
+        data = data.reshape(-1, channels).mean(axis=1)
+    wave = to_float32(data, scale)
+    if sample_rate is not None and sample_rate != sr:
+        return resample(wave, sr, sample_rate), sample_rate
+    return wave, sr
+
+
+def save_wave(path: str, wave: np.ndarray, sample_rate: int) -> None:
+    """Save mono wave as 16bit WAV file. Range of wave must be -1.0 ~ 1.0."""
+    data = to_float32(wave) * np.float32(2**15)
+    np.clip(data, -(2**15), 2**15 - 1, out=data)
+    with wavefile.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(data.astype(np.int16).tobytes())
+
+
+class ArraySource:
+    """Microphone which replays a wave instead of recording.
+
+    Replay continues across recorder streams. After the end of the wave, silence is recorded
+    and :attr:`ended` is set, unless `loop` is True.
+    """
+
+    def __init__(
+        self, wave: np.ndarray, sample_rate: int, realtime: bool = False, loop: bool = False, name: str = "array"
+    ) -> None:
+        """
+        Args:
+            wave (np.ndarray): Mono wave. Range is -1.0 ~ 1.0
+            sample_rate (int): Sample rate of wave.
+            realtime (bool): If True, `record` blocks as long as the recorded duration like real
+                devices. Otherwise waves are replayed as fast as possible.
+            loop (bool): Replay the wave repeatedly.
+            name (str): Device name.
+        """
+        self.wave = to_float32(wave)
+        self.sample_rate = sample_rate
+        self.realtime = realtime
+        self.loop = loop
+        self.name = name
+
+        self.ended = threading.Event()
+        self.position = 0
+        self.position_rate = sample_rate  # sample rate of `position`
+        self._resampled: dict[int, np.ndarray] = {sample_rate: self.wave}
+
+    def recorder(self, samplerate: int, channels: int = 1, blocksize: Optional[int] = None) -> "SourceStream":
+        if samplerate not in self._resampled:
+            self._resampled[samplerate] = resample(self.wave, self.sample_rate, samplerate)
+        return SourceStream(self, samplerate, channels)
+
+
+class SourceStream:
+    """Recorder stream of :class:`ArraySource`."""
+
+    def __init__(self, source: ArraySource, samplerate: int, channels: int) -> None:
+        self.source = source
+        self.samplerate = samplerate
+        self.channels = channels
+        self.wave = source._resampled[samplerate]
+        self._start = 0.0
+        self._recorded = 0
+
+    def __enter__(self) -> "SourceStream":
+        self._start = time.perf_counter()
+        self._recorded = 0
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def record(self, numframes: int) -> np.ndarray:
+        """Returns `(numframes, channels)` float32 wave. Blocks in the wave are returned without copy."""
+        source = self.source
+        position = source.position
+        if source.position_rate != self.samplerate:
+            position = position * self.samplerate // source.position_rate
+        block = self.wave[position : position + numframes]
+        if len(block) == numframes and self.channels == 1:
+            data = block.reshape(-1, 1)
+            position += numframes
+        else:
+            data = np.zeros((numframes, self.channels), dtype=np.float32)
+            filled = 0
+            while filled < numframes:
+                block = self.wave[position : position + numframes - filled]
+                data[filled : filled + len(block)] = block[:, None]
+                filled += len(block)
+                position += len(block)
+                if position >= len(self.wave):
+                    if not source.loop or len(self.wave) == 0:
+                        source.ended.set()
+                        break
+                    position = 0
+        source.position, source.position_rate = position, self.samplerate
+
+        if source.realtime:
+            self._recorded += numframes
+            delay = self._start + self._recorded / self.samplerate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return data
+
+
+class FileSource(ArraySource):
+    """:class:`ArraySource` which replays an audio file. See :func:`load_wave`."""
+
+    def __init__(
+        self, path: str, realtime: bool = False, loop: bool = False, sample_rate: Optional[int] = None
+    ) -> None:
+        """
+        Args:
+            path (str): Audio file path, e.g. "data/sample_transcribe.mp3".
+            realtime (bool): If True, audio is replayed in real time. Otherwise as fast as possible.
+            loop (bool): Replay the file repeatedly.
+            sample_rate (Optional[int]): Sample rate for decoding. See :func:`load_wave`.
+        """
+        wave, sr = load_wave(path, sample_rate)
+        super().__init__(wave, sr, realtime, loop, name=path)
+
+
+class NullSink:
+    """Speaker which discards played waves."""
+
+    def __init__(self, realtime: bool = False, name: str = "null") -> None:
+        """
+        Args:
+            realtime (bool): If True, `play` blocks as long as the played duration like real devices.
+            name (str): Device name.
+        """
+        self.realtime = realtime
+        self.name = name
+        self.opened = 0
+        self.closed = 0
+        self.played_duration = 0.0
+
+    def player(self, samplerate: int, channels: Optional[int] = None, blocksize: Optional[int] = None) -> "SinkStream":
+        return SinkStream(self, samplerate)
+
+    def play(self, data: np.ndarray, samplerate: int, channels: Optional[int] = None, blocksize: Optional[int] = None):
+        with self.player(samplerate) as player:
+            player.play(data)
+
+    def write(self, data: np.ndarray, samplerate: int) -> None:
+        """Called with each played float32 wave."""
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SinkStream:
+    """Player stream of :class:`NullSink`."""
+
+    def __init__(self, sink: NullSink, samplerate: int) -> None:
+        self.sink = sink
+        self.samplerate = samplerate
+        self._start = 0.0
+        self._played = 0
+
+    def __enter__(self) -> "SinkStream":
+        self.sink.opened += 1
+        self._start = time.perf_counter()
+        self._played = 0
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.sink.closed += 1
+
+    def play(self, data: np.ndarray) -> None:
+        data = to_float32(data)
+        self.sink.write(data, self.samplerate)
+        self.sink.played_duration += len(data) / self.samplerate
+
+        if self.sink.realtime:
+            self._played += len(data)
+            delay = self._start + self._played / self.samplerate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+
+class CaptureSink(NullSink):
+    """Speaker which keeps played waves for tests and offline runs."""
+
+    def __init__(self, realtime: bool = False, path: Optional[str] = None, name: str = "capture") -> None:
+        """
+        Args:
+            realtime (bool): If True, `play` blocks as long as the played duration like real devices.
+            path (Optional[str]): WAV file path where captured waves are saved by :meth:`close`.
+            name (str): Device name.
+        """
+        super().__init__(realtime, name)
+        self.path = path
+        self.played: list[tuple[float, int, np.ndarray]] = []
+
+    def write(self, data: np.ndarray, samplerate: int) -> None:
+        self.played.append((time.perf_counter(), samplerate, data.copy()))
+
+    def wave(self, sample_rate: Optional[int] = None) -> tuple[np.ndarray, int]:
+        """Returns all played waves concatenated at `sample_rate`. If None, the rate of the first
+        played wave is used."""
+        if sample_rate is None:
+            sample_rate = self.played[0][1] if len(self.played) > 0 else 16000
+        waves = [resample(w, sr, sample_rate) if sr != sample_rate else w for _, sr, w in self.played]
+        return np.concatenate(waves) if len(waves) > 0 else np.zeros(0, dtype=np.float32), sample_rate
+
+    def close(self) -> None:
+        if self.path is not None:
+            save_wave(self.path, *self.wave())
+
+
+SOURCE_TYPES = {"file": FileSource}
+SINK_TYPES = {"null": NullSink, "capture": CaptureSink}
+
+
+def open_source(type: str = "file", **options: Any) -> ArraySource:
+    """Make offline audio source from config, e.g. `{"type": "file", "path": "data/sample_transcribe.mp3"}`.
+
+    Raises:
+        ValueError: if type is unknown.
+    """
+    if type not in SOURCE_TYPES:
+        raise ValueError(f"Unknown source type: {type}. Please use one of {list(SOURCE_TYPES)}.")
+    return SOURCE_TYPES[type](**options)
+
+
+def open_sink(type: str = "null", **options: Any) -> NullSink:
+    """Make offline audio sink from config, e.g. `{"type": "capture", "path": "data/capture.wav"}`.
+
+    Raises:
+        ValueError: if type is unknown.
+    """
+    if type not in SINK_TYPES:
+        raise ValueError(f"Unknown sink type: {type}. Please use one of {list(SINK_TYPES)}.")
+    return SINK_TYPES[type](**options)
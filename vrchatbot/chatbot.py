@@ -1,7 +1,610 @@
-from collections import deque
-from typing import Any, Optional
+import base64
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+import time
+import unicodedata
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Generator, Iterable, Iterator, Optional, Union
 
 import openai
+import tiktoken
+import tiktoken.model
+
+from . import tracing
+
+GPT2_PATTERN = r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+
+
+def bundled_gpt2_encoding() -> Optional[tiktoken.Encoding]:
+    """Returns GPT-2 encoding from the vocabulary file bundled with whisper, or None if whisper is
+    not installed. The file is read without importing whisper, which imports torch."""
+    spec = importlib.util.find_spec("whisper")
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    path = os.path.join(spec.submodule_search_locations[0], "assets", "gpt2.tiktoken")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        ranks = {base64.b64decode(token): int(rank) for token, rank in (line.split() for line in f if line.strip())}
+    return tiktoken.Encoding(
+        name="gpt2", pat_str=GPT2_PATTERN, mergeable_ranks=ranks, special_tokens={"<|endoftext|>": len(ranks)}
+    )
+
+
+def load_encoding(engine: str, timeout: float = 5.0) -> Optional[tiktoken.Encoding]:
+    """Returns tiktoken encoding of `engine` without waiting for network more than `timeout` seconds.
+
+    The encoding is loaded from the tiktoken cache if it is there, otherwise it is downloaded. If
+    the engine is unknown or the download does not finish in time, :func:`bundled_gpt2_encoding` is
+    returned. The download goes on in a daemon thread, so that the cache is filled for next time.
+    """
+    loaded: list[tiktoken.Encoding] = []
+
+    def load() -> None:
+        try:
+            loaded.append(tiktoken.encoding_for_model(engine))
+        except Exception:  # Unknown engine or offline.
+            pass
+
+    thread = threading.Thread(target=load, name="load_encoding", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if len(loaded) > 0:
+        return loaded[0]
+    return bundled_gpt2_encoding()
+
+
+class TokenCounter:
+    """Counting tokens locally with tiktoken. Counts are cached by text (LRU).
+
+    If no encoding can be loaded (see :func:`load_encoding`), UTF-8 bytes are counted instead. It
+    is an upper bound of the number of byte level BPE tokens, so prompts still fit in the model.
+
+    If the loaded encoding is not the one of the engine (e.g. the bundled GPT-2 encoding for
+    text-davinci-003, which uses p50k_base), counts are approximate. A warning is printed and
+    :meth:`budget` keeps `safety_margin` of the model's token limit free.
+    """
+
+    def __init__(
+        self,
+        engine: str = "text-davinci-003",
+        cache_size: int = 4096,
+        timeout: float = 5.0,
+        safety_margin: float = 0.1,
+    ) -> None:
+        """
+        Args:
+            engine (str): OpenAI model name for choosing the encoding.
+            cache_size (int): Max number of cached texts.
+            timeout (float): Max seconds waited for downloading the encoding.
+            safety_margin (float): Ratio of the token limit kept free when the encoding is not the
+                engine's one.
+        """
+        self.encoding = load_encoding(engine, timeout)
+        self.count = functools.lru_cache(maxsize=cache_size)(self._count)
+
+        expected = tiktoken.model.MODEL_TO_ENCODING.get(engine)
+        self.approximate = self.encoding is None or self.encoding.name != expected
+        # Byte counts are an upper bound, so they need no margin.
+        self.safety_margin = safety_margin if self.approximate and self.encoding is not None else 0.0
+        if self.approximate:
+            name = "UTF-8 bytes" if self.encoding is None else f"{self.encoding.name} encoding"
+            print(f"[TokenCounter] Encoding of {engine} is not available. Counting {name} approximately.")
+
+    def budget(self, max_tokens: int) -> int:
+        """Returns the number of counted tokens that surely fits in `max_tokens` tokens of the model."""
+        return int(max_tokens / (1.0 + self.safety_margin))
+
+    def _count(self, text: str) -> int:
+        if self.encoding is None:
+            return len(text.encode("utf-8"))
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def __call__(self, text: str) -> int:
+        """Returns number of tokens of text."""
+        return self.count(text)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Returns the head of text within `max_tokens` tokens."""
+        if self.encoding is None:
+            return text.encode("utf-8")[:max_tokens].decode("utf-8", errors="ignore")
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens]).rstrip("\ufffd")  # drop broken multibyte char
+
+
+class PromptHistory:
+    """Conversation history kept as one joined prompt string.
+
+    Each stored prompt is preceded by `separator` in :attr:`text`. Offsets of prompts are absolute
+    positions in the stream of all appended text, so trimming the oldest prompts does not rewrite
+    them. Appending costs O(prompt size) and :meth:`trim` slices :attr:`text` once.
+    """
+
+    def __init__(self, separator: str = " ") -> None:
+        """
+        Args:
+            separator (str): Joining string of prompts.
+        """
+        self.separator = separator
+        self.clear()
+
+    def clear(self) -> None:
+        """Remove all prompts and the summary."""
+        self.text = ""
+        self.base = 0  # absolute position of `text[0]`
+        self.offsets: deque[int] = deque()  # absolute start positions of prompts with separator
+        self.token_sizes: deque[int] = deque()
+        self.token_size = 0
+        self.summary = ""  # summary of removed prompts. It is placed before the prompts.
+        self.summary_token_size = 0
+
+    @property
+    def end(self) -> int:
+        """Absolute position of the end of :attr:`text`."""
+        return self.base + len(self.text)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> str:
+        n = len(self.offsets)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("PromptHistory index out of range")
+        start = self.offsets[index] - self.base + len(self.separator)
+        stop = self.offsets[index + 1] - self.base if index + 1 < n else len(self.text)
+        return self.text[start:stop]
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, prompt: str, token_size: int) -> None:
+        """Append a prompt with its token size."""
+        self.offsets.append(self.base + len(self.text))
+        self.token_sizes.append(token_size)
+        self.token_size += token_size
+        # Concatenating to a local with no other references lets CPython resize it in place.
+        text, self.text = self.text, ""
+        text += self.separator
+        text += prompt
+        self.text = text
+
+    def trim(self, max_token_size: int) -> None:
+        """Remove the oldest prompts until the total token size is not larger than `max_token_size`."""
+        removed = False
+        while self.token_size > max_token_size and len(self.offsets) > 0:
+            self.offsets.popleft()
+            self.token_size -= self.token_sizes.popleft()
+            removed = True
+
+        if removed:
+            self._cut_text()
+
+    def drop_before(self, position: int) -> None:
+        """Remove prompts starting before the absolute `position`, e.g. :attr:`end` at some time."""
+        removed = False
+        while len(self.offsets) > 0 and self.offsets[0] < position:
+            self.offsets.popleft()
+            self.token_size -= self.token_sizes.popleft()
+            removed = True
+
+        if removed:
+            self._cut_text()
+
+    def _cut_text(self) -> None:
+        cut = self.offsets[0] if len(self.offsets) > 0 else self.end
+        self.text = self.text[cut - self.base :]
+        self.base = cut
+
+    def build(self, last: str, head: Optional[str] = None) -> str:
+        """Returns `separator.join([head, summary, *prompts, last])`. `head` is omitted if it is None
+        and the summary is omitted if it is empty."""
+        head = self.separator.join(h for h in (head, self.summary) if h)
+        if head != "":
+            return "".join((head, self.text, self.separator, last))
+        if len(self.text) == 0:
+            return last
+        return "".join((self.text[len(self.separator) :], self.separator, last))
+
+
+class SessionManager:
+    """Conversation histories per session, e.g. per speaker.
+
+    Sessions are kept in least recently used order. Sessions idle for longer than `idle_timeout`
+    are removed, then the least recently used sessions are removed while there are more than
+    `max_sessions` sessions or the total token size is larger than `max_total_tokens`. The most
+    recently used session is never removed by the budgets. Eviction runs when a session is created
+    and at most every `evict_interval` seconds on lookup, and can be run with :meth:`evict`.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 64,
+        max_total_tokens: Optional[int] = 200000,
+        idle_timeout: Optional[float] = 1800.0,
+        evict_interval: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            max_sessions (int): Max number of sessions.
+            max_total_tokens (Optional[int]): Max total token size of all histories. If None, unlimited.
+            idle_timeout (Optional[float]): Seconds until an unused session is removed. If None, never.
+            evict_interval (float): Min seconds between evictions on lookup of existing sessions.
+            clock (Callable): Returns current time in seconds.
+        """
+        self.max_sessions = max_sessions
+        self.max_total_tokens = max_total_tokens
+        self.idle_timeout = idle_timeout
+        self.evict_interval = evict_interval
+        self.clock = clock
+
+        self.evicted_count = 0
+        self._last_evict_time = clock()
+        self._sessions: OrderedDict[Any, PromptHistory] = OrderedDict()
+        self._last_access: dict[Any, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: Any) -> bool:
+        return session_id in self._sessions
+
+    def session_ids(self) -> list:
+        """Session ids from least to most recently used."""
+        return list(self._sessions.keys())
+
+    def get(self, session_id: Any = None) -> PromptHistory:
+        """Returns history of the session. A new session is created if it does not exist."""
+        now = self.clock()
+        history = self._sessions.get(session_id)
+        created = history is None
+        if history is None:
+            history = PromptHistory()
+            self._sessions[session_id] = history
+        else:
+            self._sessions.move_to_end(session_id)
+        self._last_access[session_id] = now
+        if created or now - self._last_evict_time >= self.evict_interval:
+            self.evict()
+        return history
+
+    def peek(self, session_id: Any = None) -> Optional[PromptHistory]:
+        """Returns history of the session, or None if it does not exist. Neither the session is
+        created nor its recency is updated."""
+        return self._sessions.get(session_id)
+
+    def remove(self, session_id: Any = None) -> None:
+        self._sessions.pop(session_id, None)
+        self._last_access.pop(session_id, None)
+
+    def clear(self) -> None:
+        self._sessions.clear()
+        self._last_access.clear()
+
+    @property
+    def total_token_size(self) -> int:
+        return sum(history.token_size + history.summary_token_size for history in self._sessions.values())
+
+    def evict(self) -> None:
+        """Remove idle sessions and least recently used sessions over the budgets."""
+        now = self.clock()
+        self._last_evict_time = now
+        if self.idle_timeout is not None:
+            for session_id in [k for k, t in self._last_access.items() if now - t > self.idle_timeout]:
+                self.remove(session_id)
+                self.evicted_count += 1
+
+        total_token_size = self.total_token_size
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions
+            or (self.max_total_tokens is not None and total_token_size > self.max_total_tokens)
+        ):
+            session_id, history = self._sessions.popitem(last=False)
+            del self._last_access[session_id]
+            total_token_size -= history.token_size + history.summary_token_size
+            self.evicted_count += 1
+
+    def snapshot(self, path: Any) -> None:
+        """Save all sessions to a json file. Session ids must be json serializable."""
+        now = self.clock()
+        sessions = [
+            {
+                "session_id": session_id,
+                "idle": now - self._last_access[session_id],
+                "prompts": list(history),
+                "token_sizes": list(history.token_sizes),
+                "summary": history.summary,
+                "summary_token_size": history.summary_token_size,
+            }
+            for session_id, history in self._sessions.items()
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"sessions": sessions}, f, ensure_ascii=False)
+
+    def restore(self, path: Any) -> None:
+        """Load sessions saved by :meth:`snapshot`. Existing sessions with the same ids are replaced."""
+        with open(path, "r", encoding="utf-8") as f:
+            sessions = json.load(f)["sessions"]
+
+        now = self.clock()
+        for session in sessions:
+            history = PromptHistory()
+            for prompt, token_size in zip(session["prompts"], session["token_sizes"]):
+                history.append(prompt, token_size)
+            history.summary = session.get("summary", "")
+            history.summary_token_size = session.get("summary_token_size", 0)
+            self.remove(session["session_id"])
+            self._sessions[session["session_id"]] = history
+            self._last_access[session["session_id"]] = now - session["idle"]
+        self.evict()
+
+
+class OpenAISummarizer:
+    """Summarizer for :class:`HistoryCompactor` with OpenAI completion."""
+
+    def __init__(
+        self,
+        engine: str = "text-davinci-003",
+        max_tokens: int = 256,
+        temperature: float = 0.3,
+        label: str = "これまでの会話の要約:",
+        instruction: str = "次の会話の要約を、これまでの要約に書き足して日本語で簡潔に書いてください。",
+    ) -> None:
+        """
+        Args:
+            engine (str): OpenAI language model engine name.
+            max_tokens (int): The maximum number of tokens of the summary.
+            temperature (float): Temperature of output probability.
+            label (str): Head of the summary in the conversation prompt.
+            instruction (str): Instruction for summarizing.
+        """
+        self.engine = engine
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.label = label
+        self.instruction = instruction
+
+    def __call__(self, summary: str, prompts: list[str]) -> str:
+        """Returns new summary of the previous `summary` and conversation `prompts`."""
+        if summary.startswith(self.label):
+            summary = summary[len(self.label) :].strip()
+        conversation = "\n".join(p.strip() for p in prompts)
+        prompt = f"{self.instruction}\n\nこれまでの要約: {summary}\n\n会話:\n{conversation}\n\n要約:"
+        resp = openai.Completion.create(
+            engine=self.engine, prompt=prompt, max_tokens=self.max_tokens, temperature=self.temperature
+        )
+        return f"{self.label} {resp['choices'][0]['text'].strip()}"
+
+
+class HistoryCompactor:
+    """Folds the oldest prompts of a history into its rolling summary.
+
+    When the history is larger than `trigger_tokens`, the oldest prompts are summarized with the
+    previous summary on a background thread, so that the prompts of about `keep_tokens` tokens
+    remain. The result is applied to the history by :meth:`apply` on the caller's thread, so the
+    history is never modified by the background thread.
+    """
+
+    def __init__(
+        self,
+        summarizer: Callable[[str, list[str]], str],
+        token_counter: TokenCounter,
+        trigger_tokens: int = 1024,
+        keep_tokens: int = 384,
+        max_summary_tokens: int = 256,
+        background: bool = True,
+    ) -> None:
+        """
+        Args:
+            summarizer (Callable): Returns new summary from `(summary, prompts)`.
+            token_counter (TokenCounter): Token counter for the summary.
+            trigger_tokens (int): History token size which starts compaction.
+            keep_tokens (int): Max token size of the prompts which are not summarized.
+            max_summary_tokens (int): Max token size of the summary. Longer summary is truncated.
+            background (bool): If False, summarizing runs in :meth:`submit` and is applied immediately.
+        """
+        self.summarizer = summarizer
+        self.token_counter = token_counter
+        self.trigger_tokens = trigger_tokens
+        self.keep_tokens = keep_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.background = background
+
+        self.compacted_count = 0
+        self.error_count = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="HistoryCompactor")
+        self._pending: weakref.WeakKeyDictionary[PromptHistory, tuple[Future, int]] = weakref.WeakKeyDictionary()
+
+    def submit(self, history: PromptHistory) -> Optional[Future]:
+        """Start summarizing the oldest prompts of history if it is larger than `trigger_tokens`.
+
+        Returns:
+            future (Optional[Future]): Future of the new summary. None if nothing is started.
+        """
+        if history.token_size <= self.trigger_tokens or history in self._pending:
+            return None
+
+        n, remaining = 0, history.token_size
+        while n < len(history) and remaining > self.keep_tokens:
+            remaining -= history.token_sizes[n]
+            n += 1
+        if n % 2 == 1 and n < len(history):  # keep pairs of user input and responce.
+            n += 1
+        if n == 0:
+            return None
+
+        prompts = [history[i] for i in range(n)]
+        position = history.offsets[n] if n < len(history) else history.end
+        if self.background:
+            future = self._executor.submit(self.summarizer, history.summary, prompts)
+        else:
+            future = Future()
+            try:
+                future.set_result(self.summarizer(history.summary, prompts))
+            except Exception as e:
+                future.set_exception(e)
+        self._pending[history] = (future, position)
+
+        if not self.background:
+            self.apply(history)
+        return future
+
+    def apply(self, history: PromptHistory, wait: bool = False) -> bool:
+        """Replace summarized prompts of history with the new summary if it is ready.
+
+        Args:
+            history (PromptHistory): History.
+            wait (bool): Wait for the summarizing.
+
+        Returns:
+            applied (bool): Whether the summary is updated.
+        """
+        pending = self._pending.get(history)
+        if pending is None:
+            return False
+        future, position = pending
+        if not (wait or future.done()):
+            return False
+
+        del self._pending[history]
+        try:
+            summary = future.result()
+        except Exception as e:
+            self.error_count += 1
+            print(f"[HistoryCompactor] {type(e).__name__}: {e}")
+            return False
+
+        summary = self.token_counter.truncate(summary, self.max_summary_tokens)
+        history.summary = summary
+        history.summary_token_size = self.token_counter(summary)
+        history.drop_before(position)
+        self.compacted_count += 1
+        return True
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ResponseCache:
+    """Cache of responces keyed on normalized user input and a fingerprint of the recent context.
+
+    Entries expire after `ttl` seconds and the least recently used entries are removed beyond
+    `max_entries`. If `path` is given, entries are appended to the file as json lines and loaded
+    again on construction.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: Optional[float] = 3600.0,
+        context_turns: int = 2,
+        path: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """
+        Args:
+            max_entries (int): Max number of entries.
+            ttl (Optional[float]): Seconds until an entry expires. If None, never.
+            context_turns (int): Number of latest prompts in the history which are a part of key.
+                0 means the same responce for the same input regardless of the conversation.
+            path (Optional[str]): Json lines file for persistence.
+            clock (Callable): Returns current time in seconds. It must be wall time for persistence.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.context_turns = context_turns
+        self.path = path
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """NFKC normalized lower case text without whitespaces, punctuations and symbols."""
+        text = unicodedata.normalize("NFKC", text).lower()
+        return "".join(c for c in text if unicodedata.category(c)[0] not in "PZSC")
+
+    def make_key(self, user_input: str, history: Optional[PromptHistory] = None) -> str:
+        """Key from user input and the latest `context_turns` prompts of history."""
+        key = self.normalize(user_input)
+        if self.context_turns > 0 and history is not None and len(history) > 0:
+            n = len(history)
+            context = "\n".join(history[i] for i in range(max(0, n - self.context_turns), n))
+            key += "#" + hashlib.blake2b(context.encode("utf-8"), digest_size=8).hexdigest()
+        return key
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns cached responce or None."""
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry[1], self.clock()):
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: str, text: str) -> None:
+        """Store responce."""
+        now = self.clock()
+        self._set(key, text, now)
+        if self.path is not None:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "text": text, "time": now}, ensure_ascii=False) + "\n")
+
+    def _set(self, key: str, text: str, created: float) -> None:
+        self._entries[key] = (text, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def load(self, path: str) -> None:
+        """Load entries from json lines file, then rewrite the file with only live entries."""
+        now = self.clock()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:  # torn last line
+                    continue
+                if not self._expired(entry["time"], now):
+                    self._set(entry["key"], entry["text"], entry["time"])
+
+        with open(path, "w", encoding="utf-8") as f:
+            for key, (text, created) in self._entries.items():
+                f.write(json.dumps({"key": key, "text": text, "time": created}, ensure_ascii=False) + "\n")
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
 
 
 class ChatBot:
@@ -18,6 +621,10 @@ class ChatBot:
         behaviour_prompt: Optional[str] = None,
         human_name: str = "人間:",
         ai_name: str = "人工知能:",
+        session_options: Optional[dict] = None,
+        summarizer: Union[None, str, Callable[[str, list[str]], str]] = None,
+        compaction_options: Optional[dict] = None,
+        response_cache: Optional[dict] = None,
         **kwds: dict,
     ) -> None:
         """
@@ -29,6 +636,12 @@ class ChatBot:
             free_tokens_for_user (int): Free space for user text.
             temperature (float): Temperature of output probability.
             behaviour_prompt_path (Optional[str]):  The first prompt for conversation.
+            session_options (Optional[dict]): Key word arguments for :class:`SessionManager`.
+            summarizer (None | str | Callable): Summarizer of old prompts. "openai" or a callable which
+                returns new summary from `(summary, prompts)`. If None, old prompts are just removed.
+            compaction_options (Optional[dict]): Key word arguments for :class:`HistoryCompactor`.
+            response_cache (Optional[dict]): Key word arguments for :class:`ResponseCache`. If None,
+                responces are not cached.
             kwds: Other key word arguments for `Completion.create`.
         """
 
@@ -48,68 +661,218 @@ class ChatBot:
         self.human_name = human_name
         self.ai_name = ai_name
         self.completion_kwds = kwds
+        self.last_usage: Optional[dict] = None
 
+        self.token_counter = TokenCounter(engine)
         if behaviour_prompt is not None:
-            resp = openai.Completion.create(
-                engine=self.engine,
-                prompt=behaviour_prompt,
-                max_tokens=10,
-                temperature=self.temperature,
-                **self.completion_kwds,
-            )
-            self.behaivour_prompt_token_size = resp["usage"]["prompt_tokens"]
+            self.behaivour_prompt_token_size = self.token_counter(behaviour_prompt)
         else:
             self.behaivour_prompt_token_size = 0
 
-        self.reset()
+        self.sessions = SessionManager(**(session_options or {}))
+
+        if summarizer == "openai":
+            summarizer = OpenAISummarizer(engine)
+        elif isinstance(summarizer, str):
+            raise ValueError(f"Unknown summarizer: {summarizer}. Please use 'openai' or a callable.")
+        if summarizer is not None:
+            self.compactor: Optional[HistoryCompactor] = HistoryCompactor(
+                summarizer, self.token_counter, **(compaction_options or {})
+            )
+        else:
+            self.compactor = None
+
+        if response_cache is not None:
+            self.response_cache: Optional[ResponseCache] = ResponseCache(**response_cache)
+        else:
+            self.response_cache = None
 
     def reset(self):
         """Reset internal state."""
-        self.current_token_size = self.behaivour_prompt_token_size
-        self.stored_prompts = deque()
-        self.stored_prompts_token_sizes = deque()
+        self.sessions.clear()
+
+    @property
+    def history(self) -> PromptHistory:
+        """History of the default session. The session is created if it does not exist, so that
+        changes to the history are kept. Use :attr:`stored_prompts` to read it without creating the
+        session."""
+        return self.sessions.get(None)
+
+    @property
+    def stored_prompts(self) -> PromptHistory:
+        """History of the default session for reading. It is a new empty history if the session does
+        not exist, so changes to it may be lost."""
+        history = self.sessions.peek(None)
+        return history if history is not None else PromptHistory()
 
-    def make_tail_space(self) -> None:
-        """Make tail space."""
+    @property
+    def stored_prompts_token_sizes(self) -> deque:
+        return self.stored_prompts.token_sizes
 
-        while self.max_receptive_tokens - self.current_token_size < self.tail_space:
-            self.stored_prompts.popleft()
-            self.current_token_size -= self.stored_prompts_token_sizes.popleft()
+    @property
+    def current_token_size(self) -> int:
+        history = self.stored_prompts
+        return self.behaivour_prompt_token_size + history.summary_token_size + history.token_size
 
-    def responce(self, user_input: str) -> str:
+    def make_tail_space(self, tail_space: Optional[int] = None, session_id: Any = None) -> None:
+        """Make tail space by removing the oldest prompts.
+
+        Args:
+            tail_space (Optional[int]): Required free tokens. If None, :attr:`tail_space` is used.
+            session_id (Any): Session id.
+        """
+        if tail_space is None:
+            tail_space = self.tail_space
+
+        history = self.sessions.get(session_id)
+        history.trim(
+            self.token_counter.budget(self.max_receptive_tokens)
+            - self.behaivour_prompt_token_size
+            - history.summary_token_size
+            - tail_space
+        )
+
+    def count_prompt_tokens(self, prompt: str) -> int:
+        """Number of tokens of a stored prompt including the joining space."""
+        return self.token_counter(" " + prompt)
+
+    def responce(self, user_input: str, session_id: Any = None) -> str:
         """Communicate to OpenAI api.
 
         Args:
             user_input (str): User input text.
+            session_id (Any): Session id, e.g. speaker name. Each session has its own history.
 
         Returns:
             responce (str): Responce text.
         """
 
-        self.make_tail_space()
+        with tracing.span("chatbot.prompt"):
+            cache_key, text = self.lookup_cache(user_input, session_id)
+            user_input, user_input_token_size, sending_prompt = self.make_sending_prompt(user_input, session_id)
 
-        user_input = f"{self.human_name} {user_input}\n{self.ai_name}"
-        if self.behaivour_prompt is None:
-            head = []
-        else:
-            head = [self.behaivour_prompt]
+        if text is None:
+            with tracing.span("chatbot.completion"):
+                resp = openai.Completion.create(
+                    engine=self.engine,
+                    prompt=sending_prompt,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature,
+                    **self.completion_kwds,
+                )
+            text = resp["choices"][0]["text"]
+            self.store_cache(cache_key, text)
+        tracing.mark("first_token")
 
-        sending_prompt = " ".join(head + list(self.stored_prompts) + [user_input])
+        self.store_turn(user_input, user_input_token_size, text, session_id)
 
+        return text
+
+    def responce_stream(self, user_input: str, session_id: Any = None) -> Generator[str, None, str]:
+        """Streaming version of :meth:`responce`. Text deltas are yielded as they arrive.
+
+        The conversation history is recorded when the stream ends. If the generator is closed
+        early, only the received text is recorded.
+
+        Args:
+            user_input (str): User input text.
+            session_id (Any): Session id.
+
+        Yields:
+            delta (str): Piece of the responce text.
+
+        Returns:
+            responce (str): Whole responce text.
+        """
+        with tracing.span("chatbot.prompt"):
+            cache_key, cached = self.lookup_cache(user_input, session_id)
+            user_input, user_input_token_size, sending_prompt = self.make_sending_prompt(user_input, session_id)
+
+        if cached is not None:
+            self.store_turn(user_input, user_input_token_size, cached, session_id)
+            tracing.mark("first_token")
+            yield cached
+            return cached
+
+        start = time.perf_counter()
         resp = openai.Completion.create(
             engine=self.engine,
             prompt=sending_prompt,
             max_tokens=self.max_tokens,
             temperature=self.temperature,
+            stream=True,
             **self.completion_kwds,
         )
 
-        text = resp["choices"][0]["text"]
-        self.stored_prompts_token_sizes.append(resp["usage"]["prompt_tokens"] - self.current_token_size)
-        self.stored_prompts.append(user_input)
-        self.stored_prompts_token_sizes.append(resp["usage"]["completion_tokens"])
-        self.stored_prompts.append(text)
-
-        self.current_token_size = resp["usage"]["total_tokens"]
+        text = ""
+        completed = False
+        try:
+            for chunk in resp:
+                delta = chunk["choices"][0]["text"]
+                if delta == "":
+                    continue
+                if text == "":
+                    tracing.add_span("chatbot.first_token", start, time.perf_counter())
+                    tracing.mark("first_token")
+                text += delta
+                yield delta
+            completed = True
+        finally:
+            tracing.add_span("chatbot.completion", start, time.perf_counter())
+            self.store_turn(user_input, user_input_token_size, text, session_id)
+            if completed:
+                self.store_cache(cache_key, text)
 
         return text
+
+    def lookup_cache(self, user_input: str, session_id: Any = None) -> tuple[Optional[str], Optional[str]]:
+        """Look up :attr:`response_cache` before the turn is recorded.
+
+        Returns:
+            cache_key (Optional[str]): Key for :meth:`store_cache`. None if the cache is disabled.
+            responce (Optional[str]): Cached responce or None.
+        """
+        if self.response_cache is None:
+            return None, None
+        cache_key = self.response_cache.make_key(user_input, self.sessions.get(session_id))
+        return cache_key, self.response_cache.get(cache_key)
+
+    def store_cache(self, cache_key: Optional[str], text: str) -> None:
+        if self.response_cache is not None and cache_key is not None and text.strip() != "":
+            self.response_cache.put(cache_key, text)
+
+    def make_sending_prompt(self, user_input: str, session_id: Any = None) -> tuple[str, int, str]:
+        """Format user input and make tail space for it in the history of the session.
+
+        Returns:
+            user_input (str): Formatted user input.
+            user_input_token_size (int): Number of tokens of formatted user input.
+            sending_prompt (str): Prompt for the completion.
+        """
+        if self.compactor is not None:
+            self.compactor.apply(self.sessions.get(session_id))
+
+        user_input = f"{self.human_name} {user_input}\n{self.ai_name}"
+        user_input_token_size = self.count_prompt_tokens(user_input)
+        self.make_tail_space(user_input_token_size + self.max_tokens, session_id)
+        sending_prompt = self.sessions.get(session_id).build(user_input, self.behaivour_prompt)
+        return user_input, user_input_token_size, sending_prompt
+
+    def store_turn(self, user_input: str, user_input_token_size: int, text: str, session_id: Any = None) -> None:
+        """Record a pair of formatted user input and responce text to the history of the session.
+
+        Token sizes of the turn are kept in :attr:`last_usage`.
+        """
+        text_token_size = self.count_prompt_tokens(text)
+        history = self.sessions.get(session_id)
+        self.last_usage = {
+            "prompt_tokens": self.behaivour_prompt_token_size
+            + history.summary_token_size
+            + history.token_size
+            + user_input_token_size,
+            "completion_tokens": text_token_size,
+        }
+        history.append(user_input, user_input_token_size)
+        history.append(text, text_token_size)
+        if self.compactor is not None:
+            self.compactor.submit(history)
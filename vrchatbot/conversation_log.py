@@ -0,0 +1,172 @@
+"""Structured conversation log written on a background thread.
+
+Records are put into a bounded queue and written as JSON lines in batches by a writer thread, so
+that logging never blocks the conversation. If the queue is full, records are dropped and counted.
+"""
+
+import glob
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+from .tracing import Turn
+
+_CLOSE = object()
+
+
+class ConversationLogger:
+    """Background JSONL log writer with size and time based rotation.
+
+    When records are written to the file which exceeds `max_bytes` or is older than
+    `rotate_interval`, the file is renamed with the rotation time first, e.g.
+    `2023-01-01 12-00-00.20230102-120000.jsonl`, optionally gzip compressed, and a new file is
+    opened. Rotation and compression run on the writer thread.
+    """
+
+    def __init__(
+        self,
+        log_dir: str,
+        file_name: Optional[str] = None,
+        max_bytes: int = 10 * 2**20,
+        rotate_interval: float = 0,
+        backup_count: int = 0,
+        compress: bool = False,
+        queue_size: int = 1024,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+    ) -> None:
+        """
+        Args:
+            log_dir (str): Directory of log files.
+            file_name (Optional[str]): Log file name. If None, the start time is used,
+                e.g. "2023-01-01 12-00-00.jsonl".
+            max_bytes (int): File size for rotation. 0 disables size based rotation.
+            rotate_interval (float): Seconds for rotation. 0 disables time based rotation.
+            backup_count (int): Number of rotated files kept. Older ones are removed. 0 keeps all.
+            compress (bool): Compress rotated files with gzip.
+            queue_size (int): Max number of records waiting for writing.
+            batch_size (int): Max number of records written at once.
+            flush_interval (float): Seconds waited for more records before a batch is written.
+        """
+        if file_name is None:
+            file_name = datetime.now().strftime("%Y-%m-%d %H-%M-%S.jsonl")
+        self.path = os.path.join(log_dir, file_name)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.written = 0
+        self.dropped = 0
+        self.rotated = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._opened_time = 0.0
+        self._open()
+        self._thread = threading.Thread(target=self._write_forever, name="ConversationLogger", daemon=True)
+        self._thread.start()
+
+    def log(self, event: str, **fields: Any) -> bool:
+        """Queue a record `{"time": ..., "event": event, **fields}` without blocking.
+
+        Returns:
+            queued (bool): False if the record is dropped because the queue is full.
+        """
+        record = {"time": datetime.now().isoformat(timespec="milliseconds"), "event": event, **fields}
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def log_turn(self, turn: Optional[Turn], **fields: Any) -> bool:
+        """Queue a `turn` record of a finished turn. If `turn` is traced, its id, start time and
+        latencies (see :meth:`Turn.latencies`) are added to `fields`."""
+        if turn is None:
+            return self.log("turn", **fields)
+        return self.log(
+            "turn",
+            turn=turn.id,
+            start=datetime.fromtimestamp(turn.wall_time).isoformat(timespec="milliseconds"),
+            **fields,
+            latency={name: round(seconds, 6) for name, seconds in turn.latencies().items()},
+        )
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write the queued records and close the file."""
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join(timeout)
+
+    def __enter__(self) -> "ConversationLogger":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._opened_time = time.monotonic()
+
+    def _write_forever(self) -> None:
+        closing = False
+        while not closing:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _CLOSE in batch:
+                closing = True
+                batch = [record for record in batch if record is not _CLOSE]
+
+            if len(batch) > 0:
+                if self._should_rotate():
+                    self._rotate()
+                self._file.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in batch))
+                self._file.flush()
+                self.written += len(batch)
+        self._file.close()
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes > 0 and self._file.tell() >= self.max_bytes:
+            return True
+        elapsed = time.monotonic() - self._opened_time
+        return self.rotate_interval > 0 and elapsed >= self.rotate_interval and self._file.tell() > 0
+
+    def _rotate(self) -> None:
+        self._file.close()
+        root, ext = os.path.splitext(self.path)
+        rotated = f"{root}.{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}"
+        count = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            rotated = f"{root}.{datetime.now().strftime('%Y%m%d-%H%M%S')}-{count}{ext}"
+            count += 1
+        os.replace(self.path, rotated)
+        if self.compress:
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        self.rotated += 1
+        self._open()
+
+        if self.backup_count > 0:
+            backups = sorted(
+                glob.glob(glob.escape(root) + ".*" + ext + "*"), key=lambda path: (os.path.getmtime(path), path)
+            )
+            for path in backups[: -self.backup_count]:
+                os.remove(path)
@@ -0,0 +1,295 @@
+import queue
+import threading
+import time
+import types
+from typing import Any, Callable, Optional
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DROP_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class StageQueue:
+    """Bounded queue between pipeline stages.
+
+    When the queue is full, `drop_policy` decides what happens to a new item:
+        - "block": Wait until a consumer takes an item (back-pressure).
+        - "drop_oldest": Discard the oldest queued item and enqueue the new one.
+        - "drop_newest": Discard the new item.
+    """
+
+    def __init__(self, maxsize: int = 8, drop_policy: str = BLOCK) -> None:
+        """
+        Args:
+            maxsize (int): Max queue size. 0 means unbounded.
+            drop_policy (str): One of "block", "drop_oldest" and "drop_newest".
+
+        Raises:
+            ValueError: if drop_policy is unknown.
+        """
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"`drop_policy` must be one of {DROP_POLICIES}. Input: {drop_policy}")
+
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+
+        self.put_count = 0
+        self.dropped_count = 0
+        self.max_depth = 0
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None) -> None:
+        """Put item according to `drop_policy`. Signature is compatible with `queue.Queue.put`
+        so that this can be passed to :meth:`Recorder.record_forever`."""
+
+        if self.drop_policy == BLOCK:
+            self._queue.put(item, block, timeout)
+        elif self.drop_policy == DROP_NEWEST:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                with self._lock:
+                    self.dropped_count += 1
+                return
+        else:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        with self._lock:
+                            self.dropped_count += 1
+                    except queue.Empty:
+                        pass
+
+        with self._lock:
+            self.put_count += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any:
+        return self._queue.get(block, timeout)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def clear(self, keep: Optional[Callable[[Any], bool]] = None) -> int:
+        """Discard all queued items.
+
+        Args:
+            keep (Optional[Callable[[Any], bool]]): Items for which this returns True are queued
+                again in order, e.g. end markers of turns.
+
+        Returns:
+            count (int): Number of discarded items.
+        """
+        count = 0
+        kept = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if keep is not None and keep(item):
+                kept.append(item)
+            else:
+                count += 1
+        for item in kept:
+            self._queue.put(item)
+        with self._lock:
+            self.dropped_count += count
+        return count
+
+    def empty(self) -> bool:
+        return self._queue.empty()
+
+    def metrics(self) -> dict:
+        """Returns queue depth metrics."""
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_depth": self.max_depth,
+                "put": self.put_count,
+                "dropped": self.dropped_count,
+            }
+
+
+class Stage:
+    """A pipeline stage which processes items of `input_queue` on its own thread.
+
+    `func` receives one item and returns the item for `output_queue`. If `func` returns
+    `None`, nothing is sent to the next stage. If `func` returns a generator, each yielded item
+    is sent as soon as it is produced, so the next stage can start before `func` finishes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        input_queue: StageQueue,
+        output_queue: Optional[StageQueue] = None,
+        poll_interval: float = 0.1,
+    ) -> None:
+        """
+        Args:
+            name (str): Stage name.
+            func (Callable): Processing function.
+            input_queue (StageQueue): Input queue.
+            output_queue (Optional[StageQueue]): Output queue. If `None`, results are discarded.
+            poll_interval (float): Timeout of `input_queue.get` for checking shutdown.
+        """
+        self.name = name
+        self.func = func
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.poll_interval = poll_interval
+
+        self.processed_count = 0
+        self.error_count = 0
+        self.busy_time = 0.0
+        self.busy = False
+
+        self._shutdown = False
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self) -> None:
+        """Process items until shutdown."""
+        while not self._shutdown:
+            try:
+                self.busy = False
+                item = self.input_queue.get(timeout=self.poll_interval)
+                self.busy = True
+            except queue.Empty:
+                continue
+
+            start = time.perf_counter()
+            try:
+                result = self.func(item)
+                if isinstance(result, types.GeneratorType):
+                    for r in result:
+                        self.send(r)
+                    result = None
+            except Exception as e:
+                self.error_count += 1
+                print(f"[{self.name}] {type(e).__name__}: {e}")
+                continue
+            finally:
+                self.busy_time += time.perf_counter() - start
+            self.processed_count += 1
+
+            self.send(result)
+
+    def send(self, result: Any) -> None:
+        """Send result to `output_queue`."""
+        if result is not None and self.output_queue is not None:
+            self.output_queue.put(result)
+
+    def start(self, is_daemon: bool = True) -> None:
+        self._shutdown = False
+        self._thread = threading.Thread(target=self.run, name=self.name, daemon=is_daemon)
+        self._thread.start()
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        self._shutdown = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metrics(self) -> dict:
+        """Returns input queue depth and processing metrics."""
+        m = self.input_queue.metrics()
+        m["processed"] = self.processed_count
+        m["errors"] = self.error_count
+        m["busy_time"] = self.busy_time
+        return m
+
+
+class Pipeline:
+    """Chain of :class:`Stage` connected by bounded :class:`StageQueue`."""
+
+    def __init__(
+        self,
+        queue_size: int = 8,
+        drop_policy: str = BLOCK,
+        stages: Optional[dict[str, dict]] = None,
+        **kwds: Any,
+    ) -> None:
+        """
+        Args:
+            queue_size (int): Default max size of stage input queues.
+            drop_policy (str): Default drop policy of stage input queues.
+            stages (Optional[dict[str, dict]]): Per stage overrides of `queue_size` and `drop_policy`.
+                Keys are stage names.
+            kwds: Other settings (e.g. `metrics_interval`) which are used by the caller.
+        """
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.stage_options = {} if stages is None else stages
+        self.stages: list[Stage] = []
+        self.input_queue = self._make_queue(None)
+
+    def _make_queue(self, name: Optional[str]) -> StageQueue:
+        opts = self.stage_options.get(name, {}) if name is not None else {}
+        return StageQueue(opts.get("queue_size", self.queue_size), opts.get("drop_policy", self.drop_policy))
+
+    def add_stage(self, name: str, func: Callable[[Any], Any]) -> "Pipeline":
+        """Append a stage. The input queue of the first stage is :attr:`input_queue`.
+
+        Args:
+            name (str): Stage name.
+            func (Callable): Processing function.
+
+        Returns:
+            self (Pipeline): For method chaining.
+        """
+        input_queue = self._make_queue(name)
+        if len(self.stages) == 0:
+            self.input_queue = input_queue
+        else:
+            self.stages[-1].output_queue = input_queue
+
+        self.stages.append(Stage(name, func, input_queue))
+        return self
+
+    def start(self, is_daemon: bool = True) -> StageQueue:
+        """Start all stages.
+
+        Returns:
+            input_queue (StageQueue): Input queue of the first stage.
+        """
+        for stage in self.stages:
+            stage.start(is_daemon)
+        return self.input_queue
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        for stage in self.stages:
+            stage.shutdown(timeout)
+
+    def clear(self, names: Optional[list[str]] = None, keep: Optional[Callable[[Any], bool]] = None) -> int:
+        """Discard queued items of stages, e.g. waves waiting for playback on barge-in.
+
+        Args:
+            names (Optional[list[str]]): Stage names. If None, all stages are cleared.
+            keep (Optional[Callable[[Any], bool]]): Items for which this returns True are not discarded.
+
+        Returns:
+            count (int): Number of discarded items.
+        """
+        return sum(stage.input_queue.clear(keep) for stage in self.stages if names is None or stage.name in names)
+
+    def is_idle(self) -> bool:
+        """Whether all queues are empty and no stage is processing an item."""
+        return all(stage.input_queue.empty() and not stage.busy for stage in self.stages)
+
+    def metrics(self) -> dict[str, dict]:
+        """Returns metrics of each stage."""
+        return {stage.name: stage.metrics() for stage in self.stages}
+
+    def format_metrics(self) -> str:
+        """Returns one line summary of queue depths."""
+        return ", ".join(
+            f"{name}: depth={m['depth']} max={m['max_depth']} dropped={m['dropped']} done={m['processed']}"
+            for name, m in self.metrics().items()
+        )
@@ -1,12 +1,17 @@
+import functools
 import math
 import queue
 import threading
-from typing import Any, Optional, Union
+import time
+from typing import Any, Callable, Generator, Optional, Union
 
 import numpy as np
-import soundcard as sc
 
+from . import audio_io, tracing
+from .audio_buffer import to_float32
 from .constants import RECOGNIZE_SAMPLE_RATE
+from .ring_buffer import RingBuffer
+from .vad import SpectralVAD, VoiceActivityDetector
 
 
 def display_audio_devices():
@@ -25,6 +30,7 @@ def display_audio_devices():
     ```
     """
 
+    sc = audio_io.soundcard()
     template = "Index: {0}, Name: {1}"
 
     print("--- Microphones ---")
@@ -49,6 +55,100 @@ def is_silent(wave: np.ndarray, threshold: float) -> bool:
     return float(np.sqrt(np.mean(wave**2))) <= threshold
 
 
+@functools.lru_cache(maxsize=32)
+def _window_indices(length: int, chunk: int, stride: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns start and end indices of windows on the block cumulative sums, and window lengths."""
+    block = math.gcd(chunk, stride)
+    n_blocks = length // block
+    starts = np.arange(0, length, stride)
+    ends = starts + chunk
+    window_lengths = np.minimum(ends, length) - starts
+    return starts // block, np.minimum(ends // block, n_blocks + 1), window_lengths
+
+
+def windowed_mean_square(wave: np.ndarray, chunk: int, stride: Optional[int] = None) -> np.ndarray:
+    """Computing mean square of each window `wave[i : i + chunk]` for `i in range(0, len(wave),
+    stride)` in one pass.
+
+    `wave` is viewed as blocks of `gcd(chunk, stride)` samples without copying, and window sums
+    of squares are taken from cumulative sums of the block sums of squares.
+
+    Args:
+        wave (np.ndarray): 1d array.
+        chunk (int): Window size.
+        stride (Optional[int]): Stride length of windows. If `None`, this equals to `chunk`
+
+    Returns:
+        mean_square (np.ndarray): Mean square of each window. Windows at the end of `wave` may be
+            shorter than `chunk`.
+    """
+    if stride is None:
+        stride = chunk
+
+    length = len(wave)
+    block = math.gcd(chunk, stride)
+    n_blocks = length // block
+    blocks = wave[: n_blocks * block].reshape(n_blocks, block)
+    block_sums = np.einsum("ij,ij->i", blocks, blocks)
+
+    if stride == chunk and n_blocks * block == length:
+        block_sums /= chunk
+        return block_sums
+
+    remainder = wave[n_blocks * block :]
+    cumsum = np.empty(n_blocks + 2, dtype=np.float64)
+    cumsum[0] = 0.0
+    cumsum[1 : n_blocks + 1] = block_sums
+    cumsum[n_blocks + 1] = np.dot(remainder, remainder)
+    np.cumsum(cumsum, out=cumsum)
+
+    starts, ends, window_lengths = _window_indices(length, chunk, stride)
+    mean_square = cumsum[ends]
+    mean_square -= cumsum[starts]
+    mean_square /= window_lengths
+    return mean_square
+
+
+def windowed_rms(wave: np.ndarray, chunk: int, stride: Optional[int] = None) -> np.ndarray:
+    """Computing RMS of each window. See :func:`windowed_mean_square`.
+
+    Args:
+        wave (np.ndarray): 1d array.
+        chunk (int): Window size.
+        stride (Optional[int]): Stride length of windows. If `None`, this equals to `chunk`
+
+    Returns:
+        rms (np.ndarray): RMS of each window.
+    """
+    return np.sqrt(windowed_mean_square(wave, chunk, stride))
+
+
+def check_voiced_range(
+    wave: np.ndarray, threshold: float, chunk: int, stride: Optional[int] = None
+) -> Optional[tuple[int, int]]:
+    """Checking first and last voiced windows. If wave is silent completely, `None` is returned.
+
+    Args:
+        wave (np.ndarray): 1d array.
+        threshold (float): Volume threshold.
+        chunk (int): Check chunk size for `is_silent`
+        stride (Optional[int]): Stride length for checking. If `None`, this equals to `chunk`
+
+    Returns:
+        voiced_range (Optional[tuple[int, int]]): Start index of the first voiced window and end index
+            of the last voiced window. If wave is silent completely, `None` is returned.
+    """
+    if stride is None:
+        stride = chunk
+
+    # Compare in squared domain. Negative threshold means that every window is voiced.
+    voiced = np.flatnonzero(windowed_mean_square(wave, chunk, stride) > threshold * abs(threshold))
+    if len(voiced) == 0:
+        return None
+
+    return int(voiced[0]) * stride, min(int(voiced[-1]) * stride + chunk, len(wave))
+
+
 def check_silence_end_point(
     wave: np.ndarray, threshold: float, chunk: int, stride: Optional[int] = None
 ) -> Optional[int]:
@@ -63,16 +163,36 @@ def check_silence_end_point(
     Returns:
         end_point (Optional[int]): End point of wave silence. If wave is silent completely, `None` is returned.
     """
+    # While voice continues, the first window is voiced. Checking it alone is much cheaper than
+    # computing all windows, which is only needed to find the onset in a block.
+    head = wave[:chunk]
+    if np.dot(head, head) > threshold * abs(threshold) * len(head):
+        return 0
+    voiced_range = check_voiced_range(wave, threshold, chunk, stride)
+    if voiced_range is None:
+        return None
+    return voiced_range[0]
 
-    if stride is None:
-        stride = chunk
 
-    for i in range(0, len(wave), stride):
-        s = is_silent(wave[i : i + chunk], threshold)
-        if not s:
-            return i
+class EnergyVAD(VoiceActivityDetector):
+    """Voice activity detector with fixed RMS volume threshold. See :func:`check_silence_end_point`"""
+
+    def __init__(self, volume_threshold: float, chunk: int, stride: Optional[int] = None) -> None:
+        """
+        Args:
+            volume_threshold (float): Volume threshold.
+            chunk (int): Check chunk size.
+            stride (Optional[int]): Stride length for checking. If `None`, this equals to `chunk`
+        """
+        self.volume_threshold = volume_threshold
+        self.chunk = chunk
+        self.stride = stride
+
+    def detect(self, wave: np.ndarray) -> Optional[int]:
+        return check_silence_end_point(wave, self.volume_threshold, self.chunk, self.stride)
 
-    return None
+
+VAD_ENGINES = ["energy", "spectral"]
 
 
 class Recorder:
@@ -88,6 +208,10 @@ class Recorder:
         silence_check_chunk: int = 1024,
         max_recording_duration: float = 30.0,  # seconds
         silence_check_stride: Optional[int] = None,
+        pre_roll_duration: float = 0.0,  # seconds
+        vad: Union[str, VoiceActivityDetector] = "energy",
+        vad_options: Optional[dict] = None,
+        source: Optional[Union[dict, audio_io.ArraySource]] = None,
     ) -> None:
         """
         Args:
@@ -100,27 +224,24 @@ class Recorder:
             silence_check_chunk (float): Check chunk size for `is_silent`
             max_recording_duration (float): Max recording duration [seconds.]
             silence_check_stride (Optional[int]): Stride size for `check_silence_end_point`
+            pre_roll_duration (float): Seconds. Audio before the detected voice onset which is included in
+                recorded waves.
+            vad (str | VoiceActivityDetector): Voice activity detector or its engine name.
+                "energy" uses `volume_threshold`, and "spectral" uses :class:`SpectralVAD`.
+            vad_options (Optional[dict]): Keyword arguments for the engine of `vad`.
+            source (Optional[dict | ArraySource]): Offline audio source which is used instead of the mic, or
+                keyword arguments of :func:`audio_io.open_source`. e.g. `{"type": "file", "path": "a.wav"}`
 
         Raises:
-            ValueError: if mic_index_or_name is not str or int.
+            ValueError: if mic_index_or_name is not str or int, or vad is unknown.
         """
 
-        if mic_index_or_name is None:
-            self.mic = sc.default_microphone()
+        if source is None:
+            self.mic = audio_io.get_microphone(mic_index_or_name)
+        elif isinstance(source, dict):
+            self.mic = audio_io.open_source(**source)
         else:
-            if isinstance(mic_index_or_name, str):
-                id = mic_index_or_name
-            elif isinstance(mic_index_or_name, int):
-                id = sc.all_microphones(True)[mic_index_or_name].name
-            else:
-                raise ValueError(
-                    "Type of `mic_index_or_name must be str or int. Input: {}".format(type(mic_index_or_name))
-                )
-
-            self.mic = sc.get_microphone(
-                id=id,
-                include_loopback=True,
-            )
+            self.mic = source
 
         self.buffer_size = buffer_size
         self.sample_rate = sample_rate
@@ -129,39 +250,97 @@ class Recorder:
         self.silence_check_chunk = silence_check_chunk
         self.max_recording_duration = max_recording_duration
         self.silence_check_stride = silence_check_stride
+        self.pre_roll_duration = pre_roll_duration
+
+        self.max_recording_length = int(max_recording_duration * sample_rate)
+        self.pre_roll_length = int(pre_roll_duration * sample_rate)
+        self.ring_buffer = RingBuffer(self.max_recording_length + self.pre_roll_length + buffer_size)
+
+        if vad_options is None:
+            vad_options = {}
+        if isinstance(vad, VoiceActivityDetector):
+            self.vad = vad
+        elif vad == "energy":
+            self.vad = EnergyVAD(
+                vad_options.get("volume_threshold", volume_threshold),
+                vad_options.get("chunk", silence_check_chunk),
+                vad_options.get("stride", silence_check_stride),
+            )
+        elif vad == "spectral":
+            self.vad = SpectralVAD(sample_rate, **vad_options)
+        else:
+            raise ValueError(f"`vad` must be one of {VAD_ENGINES} or `VoiceActivityDetector`. Input: {vad}")
 
+        self.onset_callbacks: list[Callable[[], None]] = []
         self._shutdown = False
-
-    def record_audio_until_silence(self, waiting_timeout: float = 5) -> Optional[np.ndarray]:
-        """Recording from mic until silence continues decided duration. And, Record begins when
-        there is no silence.
+        self._shutdown_when_idle = False
+
+    def add_onset_callback(self, callback: Callable[[], None]) -> None:
+        """Add callback which is called on the recording thread as soon as voice onset is detected,
+        e.g. :meth:`TextSpeaker.stop` for barge-in."""
+        self.onset_callbacks.append(callback)
+
+    @property
+    def source_ended(self) -> bool:
+        """Whether the offline audio source has been replayed to the end. Always False for mics."""
+        ended = getattr(self.mic, "ended", None)
+        return ended is not None and ended.is_set()
+
+    def _notify_onset(self) -> None:
+        for callback in self.onset_callbacks:
+            callback()
+
+    def _trace_utterance(self, onset_time: float, voice_time: float) -> None:
+        """Record spans of the recorded utterance on the current turn. `record.endpoint` is the wait
+        from the last voiced block to the end of recording."""
+        end = time.perf_counter()
+        tracing.add_span("record.speech", onset_time, end)
+        tracing.add_span("record.endpoint", voice_time, end)
+        tracing.mark(tracing.SPEECH_END, end)
+
+    def _start_position(self, onset_position: int) -> int:
+        """Returns start position of recorded wave including pre-roll."""
+        return max(onset_position - self.pre_roll_length, self.ring_buffer.oldest_position)
+
+    def stream_audio_until_silence(
+        self, waiting_timeout: float = 5
+    ) -> Generator[np.ndarray, None, Optional[tuple[int, int]]]:
+        """Streaming version of :meth:`record_audio_until_silence`. Recorded blocks are yielded as
+        soon as they are recorded.
 
         Args:
             waiting_timeout: Time to timeout until silence disappears.
 
+        Yields:
+            wave (np.ndarray): Recorded block. The first one includes pre-roll.
+
         Returns:
-            wave (Optinal[np.ndarray]): Recorded wave. If timeouted, `None` is returned.
+            positions (Optional[tuple[int, int]]): Start and end positions of the recorded wave on
+                :attr:`ring_buffer`. If timeouted, `None` is returned.
         """
+        ring = self.ring_buffer
+        ring.reset()
+        self.vad.reset()
+
         with self.mic.recorder(self.sample_rate, 1) as mic:
             waiting_length_for_timeout = 0
-            recorded_waves = []
             silence_length = 0
             record_start = False
-            recorded_length = 0
+            onset_position = start_position = end_position = 0
+            onset_time = voice_time = 0.0
 
             mic.record(self.buffer_size)
             for _ in range(
                 math.ceil((waiting_timeout + self.max_recording_duration) * self.sample_rate / self.buffer_size)
             ):  # Avoid while True
-                wave = mic.record(self.buffer_size).reshape(-1).astype("float32")
-                start_idx = check_silence_end_point(
-                    wave, self.volume_threshold, self.silence_check_chunk, self.silence_check_stride
-                )
+                wave = to_float32(mic.record(self.buffer_size))
+                position = ring.write(wave)
+                start_idx = self.vad.detect(wave)
 
                 if start_idx is None and not record_start:
                     waiting_length_for_timeout += self.buffer_size
                     if waiting_length_for_timeout >= int(waiting_timeout * self.sample_rate):
-                        return
+                        return None
                     else:
                         continue
                 elif start_idx is None and record_start:
@@ -169,22 +348,50 @@ class Recorder:
 
                 elif start_idx is not None and not record_start:
                     record_start = True
-                    wave = wave[start_idx:]
+                    onset_position = position + start_idx
+                    start_position = self._start_position(onset_position)
                     silence_length = 0
+                    onset_time = voice_time = time.perf_counter()
+                    self._notify_onset()
+                    wave = ring.read(start_position, position + len(wave))
 
                 elif start_idx is not None:
                     silence_length = 0
+                    voice_time = time.perf_counter()
 
                 if silence_length >= int(self.silence_duration_for_stop * self.sample_rate):
                     break
 
-                recorded_length += len(wave)
-                recorded_waves.append(wave)
+                end_position = position + self.buffer_size
+                yield wave
 
-                if recorded_length >= int(self.max_recording_duration * self.sample_rate):
+                if end_position - onset_position >= self.max_recording_length:
                     break
 
-            return np.concatenate(recorded_waves)
+            self._trace_utterance(onset_time, voice_time)
+            return start_position, end_position
+
+    def record_audio_until_silence(self, waiting_timeout: float = 5) -> Optional[np.ndarray]:
+        """Recording from mic until silence continues decided duration. And, Record begins when
+        there is no silence.
+
+        Args:
+            waiting_timeout: Time to timeout until silence disappears.
+
+        Returns:
+            wave (Optinal[np.ndarray]): Recorded wave. If timeouted, `None` is returned.
+        """
+        stream = self.stream_audio_until_silence(waiting_timeout)
+        while True:
+            try:
+                next(stream)
+            except StopIteration as e:
+                positions = e.value
+                break
+
+        if positions is None:
+            return None
+        return self.ring_buffer.read(*positions)
 
     def record_forever(self, wave_queue: Union[queue.Queue, Any]) -> None:
         """Record audio forever.
@@ -193,57 +400,58 @@ class Recorder:
             wave_queue (Queue): Queue for storing recorded waves.
                 wave type is 1d `np.ndarray`.
         """
-        self._shutdown = False
+        self._shutdown = self._shutdown_when_idle = False
+        self._record_forever(wave_queue)
 
-        send_and_reset = False
+    def _record_forever(self, wave_queue: Union[queue.Queue, Any]) -> None:
+        ring = self.ring_buffer
+        ring.reset()
+        self.vad.reset()
 
         record_start = False
-        recorded_waves = []
         silence_length = 0
-        recorded_length = 0
+        onset_position = start_position = end_position = 0
+        onset_time = voice_time = 0.0
 
         with self.mic.recorder(self.sample_rate, 1) as mic:
-            while not self._shutdown:
-
-                if send_and_reset:
-                    if len(recorded_waves) > 0:
-                        wave_queue.put(np.concatenate(recorded_waves))
-
-                    record_start = False
-                    recorded_waves.clear()
-                    recorded_length = 0
-                    silence_length = 0
-
-                    send_and_reset = False
-
-                wave = mic.record(self.buffer_size).reshape(-1).astype("float32")
-                start_idx = check_silence_end_point(
-                    wave, self.volume_threshold, self.silence_check_chunk, self.silence_check_stride
-                )
+            while not self._shutdown and not self.source_ended:
+                if self._shutdown_when_idle and not record_start:
+                    break
+                wave = to_float32(mic.record(self.buffer_size))
+                position = ring.write(wave)
+                start_idx = self.vad.detect(wave)
 
                 if start_idx is None and not record_start:
                     continue
 
                 elif start_idx is not None and not record_start:
-                    wave = wave[:start_idx]
                     record_start = True
+                    onset_position = position + start_idx
+                    start_position = self._start_position(onset_position)
+                    onset_time = voice_time = time.perf_counter()
+                    self._notify_onset()
 
                 elif start_idx is None and record_start:
                     silence_length += len(wave)
 
-                recorded_length += len(wave)
-                recorded_waves.append(wave)
+                else:
+                    silence_length = 0
+                    voice_time = time.perf_counter()
 
-                if silence_length >= int(self.silence_duration_for_stop * self.sample_rate):
-                    send_and_reset = True
-                    continue
+                end_position = position + len(wave)
 
-                if recorded_length >= int(self.max_recording_duration * self.sample_rate):
-                    send_and_reset = True
-                    continue
+                if (
+                    silence_length >= int(self.silence_duration_for_stop * self.sample_rate)
+                    or end_position - onset_position >= self.max_recording_length
+                ):
+                    self._trace_utterance(onset_time, voice_time)
+                    wave_queue.put(ring.read(start_position, end_position))
+                    record_start = False
+                    silence_length = 0
 
-            if len(recorded_waves) > 0:
-                wave_queue.put(np.concatenate(recorded_waves))  # For test code.
+            if record_start:
+                self._trace_utterance(onset_time, voice_time)
+                wave_queue.put(ring.read(start_position, end_position))  # For test code.
 
     _record_forever_thread: Optional[threading.Thread] = None
 
@@ -264,17 +472,24 @@ class Recorder:
         else:
             q = wave_queue
 
-        self._record_forever_thread = threading.Thread(target=self.record_forever, args=(q,), daemon=is_daemon)
+        # Reset before starting, so that shutdown right after this is not missed.
+        self._shutdown = self._shutdown_when_idle = False
+        self._record_forever_thread = threading.Thread(target=self._record_forever, args=(q,), daemon=is_daemon)
         self._record_forever_thread.start()
         return q
 
-    def shutdown_record_forever(self, timeout: Optional[float] = None) -> None:
+    def shutdown_record_forever(self, timeout: Optional[float] = None, finish_utterance: bool = False) -> None:
         """Shutdown (stop) `record_forever` thread.
 
         Args:
             timeout (Optional[float]): Waiting for shutdown until timeout.
+            finish_utterance (bool): If True, the utterance being recorded is recorded until its end
+                before stopping, instead of being cut at this time.
         """
-        self._shutdown = True
+        if finish_utterance:
+            self._shutdown_when_idle = True
+        else:
+            self._shutdown = True
 
         if self._record_forever_thread is not None:
             self._record_forever_thread.join(timeout)
@@ -0,0 +1,109 @@
+from typing import Any
+
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed capacity ring buffer for 1d audio samples.
+
+    Samples are addressed by absolute position, which is the number of samples written before
+    them since :meth:`reset`. Only the last `capacity` samples can be read.
+    """
+
+    def __init__(self, capacity: int, dtype: Any = "float32") -> None:
+        """
+        Args:
+            capacity (int): Max number of stored samples.
+            dtype (Any): Sample dtype.
+
+        Raises:
+            ValueError: if capacity is not positive.
+        """
+        if capacity <= 0:
+            raise ValueError(f"`capacity` must be positive. Input: {capacity}")
+
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=dtype)
+        self.write_position = 0
+
+    def reset(self) -> None:
+        """Forget all samples. Absolute positions restart from 0."""
+        self.write_position = 0
+
+    @property
+    def oldest_position(self) -> int:
+        """Absolute position of the oldest readable sample."""
+        return max(0, self.write_position - self.capacity)
+
+    def write(self, wave: np.ndarray) -> int:
+        """Write samples in place. The oldest samples are overwritten.
+
+        Args:
+            wave (np.ndarray): 1d array. Converted to the buffer dtype while copying.
+
+        Returns:
+            position (int): Absolute position of the first written sample.
+
+        Raises:
+            ValueError: if wave is longer than capacity.
+        """
+        length = len(wave)
+        if length > self.capacity:
+            raise ValueError(f"Wave length {length} exceeds capacity {self.capacity}.")
+
+        position = self.write_position
+        start = position % self.capacity
+        first = min(length, self.capacity - start)
+        np.copyto(self.buffer[start : start + first], wave[:first], casting="same_kind")
+        np.copyto(self.buffer[: length - first], wave[first:], casting="same_kind")
+
+        self.write_position += length
+        return position
+
+    def _check_range(self, start: int, stop: int) -> None:
+        if not (self.oldest_position <= start <= stop <= self.write_position):
+            raise IndexError(
+                f"Range [{start}, {stop}) is out of readable range [{self.oldest_position}, {self.write_position})."
+            )
+
+    def view(self, start: int, stop: int) -> np.ndarray:
+        """Zero-copy view of samples `[start, stop)`. The view is overwritten by later writes.
+
+        Args:
+            start (int): Absolute start position.
+            stop (int): Absolute stop position.
+
+        Returns:
+            view (np.ndarray): View of the buffer.
+
+        Raises:
+            IndexError: if range is not readable.
+            ValueError: if range wraps around the end of buffer. Use :meth:`read` instead.
+        """
+        self._check_range(start, stop)
+        begin = start % self.capacity
+        end = begin + stop - start
+        if end > self.capacity:
+            raise ValueError(f"Range [{start}, {stop}) wraps around the buffer.")
+        return self.buffer[begin:end]
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """Copy samples `[start, stop)` to a new array. Copying is done only once.
+
+        Args:
+            start (int): Absolute start position.
+            stop (int): Absolute stop position.
+
+        Returns:
+            wave (np.ndarray): New 1d array.
+
+        Raises:
+            IndexError: if range is not readable.
+        """
+        self._check_range(start, stop)
+        out = np.empty(stop - start, dtype=self.buffer.dtype)
+        begin = start % self.capacity
+        first = min(stop - start, self.capacity - begin)
+        out[:first] = self.buffer[begin : begin + first]
+        out[first:] = self.buffer[: stop - start - first]
+        return out
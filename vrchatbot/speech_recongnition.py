@@ -1,6 +1,208 @@
-from typing import Any, Optional
+import dataclasses
+import queue
+import threading
+import time
+from typing import Any, Optional, Union
 
+import numpy as np
+import torch
 import whisper
+from whisper.audio import HOP_LENGTH, N_FFT, N_FRAMES, N_SAMPLES, mel_filters
+
+from . import tracing
+from .constants import RECOGNIZE_SAMPLE_RATE
+from .ring_buffer import RingBuffer
+
+
+class LanguageCache:
+    """Per session cache of detected language.
+
+    Once the same language is detected `stable_count` times in a row for a session, the cached
+    language probabilities are used instead of detecting. Detection runs again after every
+    `recheck_interval` cache hits, in order to follow the language change.
+    """
+
+    def __init__(self, stable_count: int = 3, recheck_interval: int = 20) -> None:
+        """
+        Args:
+            stable_count (int): Number of consecutive same detections for using cache.
+            recheck_interval (int): Number of cache hits before detecting again.
+        """
+        self.stable_count = stable_count
+        self.recheck_interval = recheck_interval
+        self._entries: dict[Any, dict] = {}
+
+    def get(self, session_id: Any = None) -> Optional[dict]:
+        """Returns cached language probabilities if the language is stable, otherwise `None`."""
+        entry = self._entries.get(session_id)
+        if entry is None or entry["count"] < self.stable_count or entry["hits"] >= self.recheck_interval:
+            return None
+        entry["hits"] += 1
+        return entry["probs"]
+
+    def update(self, probs: dict, session_id: Any = None) -> None:
+        """Store detected language probabilities."""
+        language = max(probs, key=probs.get)
+        entry = self._entries.get(session_id)
+        if entry is not None and entry["language"] == language:
+            entry["count"] += 1
+        else:
+            entry = {"language": language, "count": 1}
+            self._entries[session_id] = entry
+        entry["probs"] = probs
+        entry["hits"] = 0
+
+    def clear(self, session_id: Any = None) -> None:
+        self._entries.pop(session_id, None)
+
+
+def _replace_linear(module: torch.nn.Module) -> None:
+    """Replace linear layers of whisper by `torch.nn.Linear` sharing parameters, so that
+    dynamic quantization can find them."""
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            linear.weight = child.weight
+            linear.bias = child.bias
+            setattr(module, name, linear)
+        else:
+            _replace_linear(child)
+
+
+def optimize_for_cpu(
+    model: whisper.Whisper,
+    quantize: bool = True,
+    num_threads: Optional[int] = None,
+    num_interop_threads: Optional[int] = None,
+    compile_encoder: bool = False,
+) -> whisper.Whisper:
+    """Optimize whisper model for CPU inference.
+
+    Args:
+        model (whisper.Whisper): Model on cpu.
+        quantize (bool): Apply dynamic int8 quantization to linear layers. If `compile_encoder` is True,
+            only the decoder is quantized.
+        num_threads (Optional[int]): Number of intra-op threads of torch.
+        num_interop_threads (Optional[int]): Number of inter-op threads of torch. This can be set only
+            before any parallel work starts.
+        compile_encoder (bool): Compile audio encoder with `torch.compile`.
+
+    Returns:
+        model (whisper.Whisper): Optimized model.
+
+    Raises:
+        ValueError: if model is not on cpu.
+    """
+    if model.device.type != "cpu":
+        raise ValueError(f"Model must be on cpu. Device: {model.device}")
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            print(f"Can not set num_interop_threads: {e}")
+
+    model.eval()
+    if quantize:
+        # Compiled graphs do not support dynamically quantized linear, so the encoder is kept float
+        # when compiling it.
+        target = model.decoder if compile_encoder else model
+        _replace_linear(target)
+        torch.ao.quantization.quantize_dynamic(target, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if compile_encoder:
+        model.encoder = torch.compile(model.encoder)
+    return model
+
+
+class LogMelSpectrogram:
+    """Whisper's log mel spectrogram of 30 seconds, computed only over the real audio.
+
+    `whisper.pad_or_trim` + `whisper.log_mel_spectrogram` runs STFT over 30 seconds even for
+    short utterances. STFT frames lying entirely in the zero padding have zero magnitude, so this
+    computes STFT over the audio plus `N_FFT` samples and fills the remaining frames directly.
+    The result is the same as whisper's. The STFT window, mel filters and buffers are reused
+    across calls, so the returned tensor is overwritten by the next call.
+    """
+
+    def __init__(self, n_mels: int = 80, pin_memory: bool = False) -> None:
+        """
+        Args:
+            n_mels (int): Number of mel filters of the model.
+            pin_memory (bool): Allocate buffers in pinned memory for fast copy to cuda devices.
+        """
+        self.n_mels = n_mels
+        self.window = torch.hann_window(N_FFT)
+        self.filters = mel_filters("cpu", n_mels)
+        self.audio_buffer = torch.zeros(N_SAMPLES, pin_memory=pin_memory)
+        self.mel_buffer = torch.zeros(n_mels, N_FRAMES, pin_memory=pin_memory)
+
+    def __call__(self, audio: Any) -> torch.Tensor:
+        """
+        Args:
+            audio (np.ndarray | torch.Tensor): 1d audio of 16kHz. Audio longer than 30 seconds is trimmed.
+
+        Returns:
+            log_spec (torch.Tensor): Log mel spectrogram. Shape is (n_mels, 3000).
+        """
+        audio = torch.as_tensor(audio, dtype=torch.float32)[:N_SAMPLES]
+        length = len(audio)
+        padded_length = min(length + N_FFT, N_SAMPLES)
+
+        x = self.audio_buffer[:padded_length]
+        x[:length] = audio
+        x[length:] = 0.0
+
+        stft = torch.stft(x, N_FFT, HOP_LENGTH, window=self.window, return_complex=True)
+        if padded_length == N_SAMPLES:
+            n_frames = N_FRAMES
+        else:  # Frames reaching reflect padding at the end of x are not exact.
+            n_frames = min((padded_length - N_FFT // 2) // HOP_LENGTH + 1, N_FRAMES)
+        magnitudes = stft[:, :n_frames].abs() ** 2
+
+        log_spec = self.mel_buffer
+        torch.matmul(self.filters, magnitudes, out=log_spec[:, :n_frames])
+        log_spec[:, n_frames:] = 0.0
+
+        log_spec.clamp_(min=1e-10).log10_()
+        log_spec.clamp_(min=log_spec.max().item() - 8.0)
+        log_spec.add_(4.0).div_(4.0)
+        return log_spec
+
+
+TIME_PRECISION = 2 * HOP_LENGTH / RECOGNIZE_SAMPLE_RATE  # seconds per timestamp token
+Segment = tuple[float, Optional[float], str]
+
+
+def split_segments(tokens: list[int], tokenizer: Any) -> list[Segment]:
+    """Split decoded tokens into segments by timestamp tokens.
+
+    Args:
+        tokens (list[int]): Decoded tokens with timestamps, e.g. `DecodingResult.tokens`.
+        tokenizer (whisper.tokenizer.Tokenizer): Tokenizer of the decoding.
+
+    Returns:
+        segments (list[Segment]): `(start, end, text)` of each segment. Times are seconds from the
+            start of the audio. `end` is None if the last segment is not closed by a timestamp.
+    """
+    segments: list[Segment] = []
+    text_tokens: list[int] = []
+    start, opened = 0.0, False
+    for token in tokens:
+        if token < tokenizer.timestamp_begin:
+            text_tokens.append(token)
+            continue
+        time = (token - tokenizer.timestamp_begin) * TIME_PRECISION
+        if not opened:
+            start, opened = time, True
+        else:
+            segments.append((start, time, tokenizer.decode(text_tokens)))
+            text_tokens = []
+            start, opened = time, False
+    if len(text_tokens) > 0:
+        segments.append((start, None, tokenizer.decode(text_tokens)))
+    return segments
 
 
 class SpeechRecongition:
@@ -9,34 +211,446 @@ class SpeechRecongition:
         model_name: str = "base",
         device: Any = "cuda",
         options: Optional[whisper.DecodingOptions] = None,
+        language_stable_count: Optional[int] = None,
+        language_recheck_interval: int = 20,
+        cpu_optimization: Optional[dict] = None,
     ) -> None:
         """
         Args:
             model_name (str): Whisper model name.
             device (str): torch devices.
             options (Optional[whisper.DecodingOptions]): If None, default options are provided.
+            language_stable_count (Optional[int]): If specified, language detection is skipped for a
+                session once the same language is detected this number of times in a row.
+                See :class:`LanguageCache`.
+            language_recheck_interval (int): Number of skipped detections before detecting again.
+            cpu_optimization (Optional[dict]): If specified, the model is optimized for cpu inference with
+                these keyword arguments of :func:`optimize_for_cpu`. `device` must be "cpu".
         """
         self.model = whisper.load_model(model_name, device)
+        if cpu_optimization is not None:
+            self.model = optimize_for_cpu(self.model, **cpu_optimization)
 
         if options is None:
             self.options = whisper.DecodingOptions()
         else:
             self.options = options
 
-    def recongnize(self, audio: Any) -> tuple[list[dict], str]:
-        """Recongnize text.
+        self.log_mel_spectrogram = LogMelSpectrogram(
+            self.model.dims.n_mels, pin_memory=self.model.device.type == "cuda"
+        )
+
+        if language_stable_count is None:
+            self.language_cache = None
+        else:
+            self.language_cache = LanguageCache(language_stable_count, language_recheck_interval)
+
+    def encode(self, mel: torch.Tensor, options: Optional[whisper.DecodingOptions] = None) -> torch.Tensor:
+        """Run audio encoder. The output can be passed to `detect_language` and `whisper.decode`
+        in place of mel, which skips encoding there.
+
+        Args:
+            mel (torch.Tensor): Log mel spectrogram. Shape is (80, 3000) or (batch, 80, 3000).
+            options (Optional[whisper.DecodingOptions]): `fp16` decides the dtype. If None, :attr:`options` is used.
+
+        Returns:
+            audio_features (torch.Tensor): Encoded audio features.
+        """
+        if options is None:
+            options = self.options
+
+        dtype = torch.float16 if options.fp16 else torch.float32
+        single = mel.ndim == 2
+        if single:
+            mel = mel.unsqueeze(0)
+
+        with torch.inference_mode():
+            audio_features = self.model.encoder(mel.to(self.model.device, dtype))
+
+        if single:
+            audio_features = audio_features[0]
+        return audio_features
+
+    def detect_language(self, audio_features: torch.Tensor, session_id: Any = None) -> dict:
+        """Detect language from encoded audio features. Cached result is returned if the
+        language of the session is stable.
+
+        Args:
+            audio_features (torch.Tensor): Output of :meth:`encode` for one utterance.
+            session_id (Any): Key of :attr:`language_cache`.
+
+        Returns:
+            language_probs (dict): Language probabilities.
+        """
+        if self.language_cache is not None:
+            probs = self.language_cache.get(session_id)
+            if probs is not None:
+                return probs
+
+        _, probs = self.model.detect_language(audio_features)
+
+        if self.language_cache is not None:
+            self.language_cache.update(probs, session_id)
+        return probs
+
+    @torch.inference_mode()
+    def warm_up(self) -> None:
+        """Run recognition of one second of silence, so that the first utterance does not pay the
+        costs of the first inference such as memory allocation and kernel selection.
+        :attr:`language_cache` is not changed."""
+        mel = self.log_mel_spectrogram(np.zeros(RECOGNIZE_SAMPLE_RATE, dtype=np.float32))
+        audio_features = self.encode(mel)
+        _, probs = self.model.detect_language(audio_features)
+        options = dataclasses.replace(self.options, sample_len=4)
+        if options.language is None:
+            options = dataclasses.replace(options, language=max(probs, key=probs.get))
+        whisper.decode(self.model, audio_features, options)
+
+    @torch.inference_mode()
+    def recongnize(
+        self, audio: Any, options: Optional[whisper.DecodingOptions] = None, session_id: Any = None
+    ) -> tuple[list[dict], str]:
+        """Recongnize text. The audio encoder runs once, and its output is shared by language
+        detection and decoding.
 
         Args:
             audio (np.ndarray | torch.Tensor): 16kHz, max duration is 30 seconds.
+            options (Optional[whisper.DecodingOptions]): If None, :attr:`options` is used.
+            session_id (Any): Speaker or session key for caching language.
 
         Returns:
             language_probs (list[dict]): Language probabilities.
             text (str): Recongnized text.
         """
-        audio = whisper.pad_or_trim(audio)
-        mel = whisper.log_mel_spectrogram(audio).to(self.model.device)
+        probs, result, _ = self._decode(audio, options, session_id)
+        return probs, result.text
 
-        _, probs = self.model.detect_language(mel)
-        result = whisper.decode(self.model, mel, self.options)
+    @torch.inference_mode()
+    def recongnize_segments(
+        self, audio: Any, options: Optional[whisper.DecodingOptions] = None, session_id: Any = None
+    ) -> tuple[dict, list[Segment]]:
+        """Recongnize text split into segments with timestamps. `without_timestamps` of options is
+        ignored.
 
-        return probs, result.text
+        Args:
+            audio (np.ndarray | torch.Tensor): 16kHz, max duration is 30 seconds.
+            options (Optional[whisper.DecodingOptions]): If None, :attr:`options` is used.
+            session_id (Any): Speaker or session key for caching language.
+
+        Returns:
+            language_probs (dict): Language probabilities.
+            segments (list[Segment]): See :func:`split_segments`.
+        """
+        if options is None:
+            options = self.options
+        options = dataclasses.replace(options, without_timestamps=False)
+        probs, result, options = self._decode(audio, options, session_id)
+        tokenizer = whisper.tokenizer.get_tokenizer(
+            self.model.is_multilingual,
+            num_languages=self.model.num_languages,
+            language=options.language,
+            task=options.task,
+        )
+        return probs, split_segments(result.tokens, tokenizer)
+
+    def _decode(
+        self, audio: Any, options: Optional[whisper.DecodingOptions], session_id: Any
+    ) -> tuple[dict, whisper.DecodingResult, whisper.DecodingOptions]:
+        if options is None:
+            options = self.options
+
+        # On CUDA, kernels run asynchronously. Their time is counted in the span which waits for the result.
+        with tracing.span("recognize.mel"):
+            mel = self.log_mel_spectrogram(audio)
+        with tracing.span("recognize.encode"):
+            audio_features = self.encode(mel, options)
+
+        with tracing.span("recognize.language"):
+            probs = self.detect_language(audio_features, session_id)
+        if options.language is None:
+            options = dataclasses.replace(options, language=max(probs, key=probs.get))
+        with tracing.span("recognize.decode"):
+            result = whisper.decode(self.model, audio_features, options)
+        tracing.mark("recognized")
+
+        return probs, result, options
+
+    @torch.inference_mode()
+    def recognize_batch(
+        self, audios: list[Any], options: Optional[whisper.DecodingOptions] = None
+    ) -> list[tuple[dict, str]]:
+        """Recongnize texts of multiple utterances at once. Mel spectrograms are stacked and
+        decoded in one batch.
+
+        Args:
+            audios (list[np.ndarray | torch.Tensor]): 16kHz, max duration is 30 seconds.
+            options (Optional[whisper.DecodingOptions]): If None, :attr:`options` is used.
+
+        Returns:
+            results (list[tuple[dict, str]]): Language probabilities and recongnized text of each audio
+                in the same order.
+        """
+        if len(audios) == 0:
+            return []
+        if options is None:
+            options = self.options
+
+        mel = torch.empty(len(audios), self.model.dims.n_mels, N_FRAMES)
+        for i, audio in enumerate(audios):
+            mel[i] = self.log_mel_spectrogram(audio)
+        audio_features = self.encode(mel, options)
+
+        _, probs = self.model.detect_language(audio_features)
+        languages = {max(p, key=p.get) for p in probs}
+        if options.language is None and len(languages) == 1:
+            options = dataclasses.replace(options, language=languages.pop())
+        results = whisper.decode(self.model, audio_features, options)
+
+        return [(p, r.text) for p, r in zip(probs, results)]
+
+    _shutdown = False
+    _recognize_forever_thread: Optional[threading.Thread] = None
+
+    def recognize_forever(
+        self,
+        wave_queue: Union[queue.Queue, Any],
+        result_queue: Union[queue.Queue, Any],
+        max_batch_size: int = 8,
+        max_wait: float = 0.1,
+    ) -> None:
+        """Recognize waves of `wave_queue` forever in batches. See :func:`collect_batch`.
+
+        Args:
+            wave_queue (Queue): Queue of recorded waves.
+            result_queue (Queue): Queue for storing `(language_probs, text)` in the order of waves.
+            max_batch_size (int): Max number of waves in a batch.
+            max_wait (float): Seconds to wait for following waves after the first one.
+        """
+        self._shutdown = False
+        while not self._shutdown:
+            try:
+                batch = collect_batch(wave_queue, max_batch_size, max_wait, timeout=0.1)
+            except queue.Empty:
+                continue
+
+            for result in self.recognize_batch(batch):
+                result_queue.put(result)
+
+    def recognize_forever_background(
+        self,
+        wave_queue: Union[queue.Queue, Any],
+        result_queue: Optional[Union[queue.Queue, Any]] = None,
+        max_batch_size: int = 8,
+        max_wait: float = 0.1,
+        is_daemon: bool = False,
+    ) -> Union[queue.Queue, Any]:
+        """Throw :meth:`recognize_forever` to background thread.
+
+        Args:
+            wave_queue (Queue): Queue of recorded waves.
+            result_queue (Optional[Queue]): Queue for storing results. If `None`, new queue is created.
+            max_batch_size (int): Max number of waves in a batch.
+            max_wait (float): Seconds to wait for following waves after the first one.
+            is_daemon (bool): Whether `recognize_forever` thread is daemon thread or not.
+
+        Returns:
+            result_queue (Queue): Queue for storing `(language_probs, text)`.
+        """
+        if result_queue is None:
+            result_queue = queue.Queue()
+
+        self._recognize_forever_thread = threading.Thread(
+            target=self.recognize_forever, args=(wave_queue, result_queue, max_batch_size, max_wait), daemon=is_daemon
+        )
+        self._recognize_forever_thread.start()
+        return result_queue
+
+    def shutdown_recognize_forever(self, timeout: Optional[float] = None) -> None:
+        """Shutdown (stop) `recognize_forever` thread.
+
+        Args:
+            timeout (Optional[float]): Waiting for shutdown until timeout.
+        """
+        self._shutdown = True
+
+        if self._recognize_forever_thread is not None:
+            self._recognize_forever_thread.join(timeout)
+
+
+def collect_batch(
+    wave_queue: Union[queue.Queue, Any], max_batch_size: int, max_wait: float, timeout: Optional[float] = None
+) -> list[Any]:
+    """Collect items of queue for a batch. After the first item arrives, this waits for following
+    items until `max_batch_size` items are collected or `max_wait` seconds pass.
+
+    Args:
+        wave_queue (Queue): Queue of items.
+        max_batch_size (int): Max batch size.
+        max_wait (float): Max seconds to wait after the first item.
+        timeout (Optional[float]): Timeout for the first item.
+
+    Returns:
+        batch (list): Collected items. At least one item is contained.
+
+    Raises:
+        queue.Empty: if no item arrives until timeout.
+    """
+    batch = [wave_queue.get(timeout=timeout)]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_batch_size:
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining > 0:
+                batch.append(wave_queue.get(timeout=remaining))
+            else:
+                batch.append(wave_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def common_prefix(texts: list[str]) -> str:
+    """Longest common prefix of texts. If texts contain spaces, the prefix is cut at the last
+    space so that words are not split."""
+    if len(texts) == 0:
+        return ""
+
+    prefix = texts[0]
+    for text in texts[1:]:
+        n = 0
+        for a, b in zip(prefix, text):
+            if a != b:
+                break
+            n += 1
+        prefix = prefix[:n]
+
+    if any(len(text) > len(prefix) and text[len(prefix)] != " " for text in texts) and " " in prefix:
+        prefix = prefix[: prefix.rindex(" ") + 1]
+    return prefix
+
+
+class StreamingRecognizer:
+    """Incremental speech recognition for audio blocks such as those yielded by
+    :meth:`Recorder.stream_audio_until_silence`.
+
+    The uncommitted audio is decoded every `decode_interval` seconds. Text which all of the last
+    `agreement` hypotheses share (local agreement) is regarded as stable. Complete segments of the
+    stable text are committed: their audio is skipped by their end timestamps and their text is
+    given as the prompt of following decodings. So each decoding costs the length of the
+    uncommitted audio, not of the whole utterance.
+    """
+
+    def __init__(
+        self,
+        recognizer: SpeechRecongition,
+        decode_interval: float = 1.0,  # seconds
+        agreement: int = 2,
+        window_duration: float = 30.0,  # seconds
+        sample_rate: int = RECOGNIZE_SAMPLE_RATE,
+    ) -> None:
+        """
+        Args:
+            recognizer (SpeechRecongition): Recognizer for decoding.
+            decode_interval (float): Seconds of new audio between partial decodings.
+            agreement (int): Number of consecutive hypotheses which must agree on stable text.
+            window_duration (float): Max seconds of uncommitted audio which is decoded. If more audio
+                is not committed, only the latest window is decoded. Clamped to 30 seconds.
+            sample_rate (int): Sample rate of input audio.
+        """
+        self.recognizer = recognizer
+        self.decode_interval = decode_interval
+        self.agreement = agreement
+        self.window_duration = min(window_duration, N_SAMPLES / RECOGNIZE_SAMPLE_RATE)
+        self.sample_rate = sample_rate
+
+        self.decode_interval_length = int(decode_interval * sample_rate)
+        self.ring_buffer = RingBuffer(int(self.window_duration * sample_rate))
+        self.reset()
+
+    def reset(self) -> None:
+        """Reset for the next utterance."""
+        self.ring_buffer.reset()
+        self.hypotheses: list[str] = []  # uncommitted texts of the last decodings
+        self.segments: list[Segment] = []  # segments of the last decoding
+        self.committed_text = ""
+        self.stable_text = ""
+        self.language_probs: Optional[dict] = None
+        self.committed_position = 0  # ring position where the uncommitted audio starts
+        self.decoded_start = 0
+        self.decoded_position = 0
+
+    def _decode(self) -> str:
+        ring = self.ring_buffer
+        self.decoded_start = max(self.committed_position, ring.oldest_position)
+        audio = ring.read(self.decoded_start, ring.write_position)
+        options = self.recognizer.options
+        if self.committed_text != "":
+            options = dataclasses.replace(options, prompt=self.committed_text)
+
+        self.language_probs, self.segments = self.recognizer.recongnize_segments(audio, options)
+        self.decoded_position = ring.write_position
+        text = "".join(segment_text for _, _, segment_text in self.segments)
+        self.hypotheses = (self.hypotheses + [text])[-self.agreement :]
+        return self.committed_text + text
+
+    def _commit(self, agreed_text: str) -> None:
+        """Commit complete segments of the last decoding within `agreed_text`."""
+        text, end = "", None
+        for _, segment_end, segment_text in self.segments:
+            if segment_end is None or not agreed_text.startswith(text + segment_text):
+                break
+            text, end = text + segment_text, segment_end
+        if end is None:
+            return
+
+        self.committed_text += text
+        self.committed_position = self.decoded_start + int(end * self.sample_rate)
+        self.hypotheses = [hypothesis[len(text) :] for hypothesis in self.hypotheses]
+        self.segments = []
+
+    def push(self, wave: np.ndarray) -> Optional[str]:
+        """Append audio block, and decode when enough new audio is received.
+
+        Args:
+            wave (np.ndarray): 1d audio block. Long blocks are cut to the latest window.
+
+        Returns:
+            stable_text (Optional[str]): Stable partial transcript if it grew, otherwise `None`.
+        """
+        self.ring_buffer.write(wave[-self.ring_buffer.capacity :])
+        if self.ring_buffer.write_position - self.decoded_position < self.decode_interval_length:
+            return None
+
+        self._decode()
+        if len(self.hypotheses) < self.agreement:
+            return None
+
+        self._commit(common_prefix(self.hypotheses))
+        stable_text = self.committed_text + common_prefix(self.hypotheses)
+        if len(stable_text) > len(self.stable_text):
+            self.stable_text = stable_text
+            return stable_text
+        return None
+
+    def finalize(self) -> str:
+        """Finalize the utterance at endpoint, and reset.
+
+        Decoding is skipped if no audio is received after the last decoding and the last hypotheses
+        agree entirely.
+
+        Returns:
+            text (str): Final transcript.
+        """
+        if self.ring_buffer.write_position == 0:
+            text = ""
+        elif (
+            self.decoded_position == self.ring_buffer.write_position
+            and len(self.hypotheses) >= self.agreement
+            and len(set(self.hypotheses)) == 1
+        ):
+            text = self.committed_text + self.hypotheses[-1]
+        else:
+            text = self._decode()
+
+        self.reset()
+        return text
@@ -1,39 +1,365 @@
-from typing import Optional, Union
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from typing import Any, Callable, Iterable, Optional, Union
 
+import numpy as np
 import pyopenjtalk
-import soundcard as sc
+
+from . import audio_io, tracing
+from .audio_buffer import INT16_SCALE, convert
+from .text_utils import split_sentences
+from .wave_cache import WaveCache
+
+STREAM_CLOSE_TIMEOUT = 0.5  # Max seconds to wait for the iterator of stopped texts to be closed.
 
 
 class TextSpeaker:
-    """Text speaker."""
+    """Text speaker.
 
-    def __init__(self, speaker_index_or_name: Optional[Union[str, int]] = None) -> None:
+    Playback is written to the device block by block, so that :meth:`stop` can interrupt it
+    from another thread, e.g. when the user starts talking (barge-in).
+    """
+
+    def __init__(
+        self,
+        speaker_index_or_name: Optional[Union[str, int]] = None,
+        voice_options: Optional[dict] = None,
+        cache: Optional[dict] = None,
+        prewarm_phrases: Optional[list[str]] = None,
+        block_duration: float = 0.05,
+        sample_rate: Optional[int] = None,
+        sink: Optional[Union[dict, audio_io.NullSink]] = None,
+    ) -> None:
         """
         Args:
             speaker_index_or_name (str | int): Speaker index or name. You can check with `display_audio_devices`
+            voice_options (Optional[dict]): Key word arguments for `pyopenjtalk.tts`, e.g. speed and half_tone.
+            cache (Optional[dict]): Key word arguments for :class:`WaveCache`. If None, waves are not cached.
+            prewarm_phrases (Optional[list[str]]): Phrases synthesized into the cache in background at startup.
+            block_duration (float): Seconds of wave written to the device at once. Playback is stopped
+                within about this time after :meth:`stop` is called.
+            sample_rate (Optional[int]): Sample rate of the output device. If given, synthesized waves
+                are resampled to it. If None, waves are played at the synthesized rate.
+            sink (Optional[dict | NullSink]): Offline audio sink which is used instead of the speaker, or
+                keyword arguments of :func:`audio_io.open_sink`. e.g. `{"type": "null", "realtime": True}`
         """
 
-        if speaker_index_or_name is None:
-            self.speaker = sc.default_speaker()
+        if sink is None:
+            self.speaker = audio_io.get_speaker(speaker_index_or_name)
+        elif isinstance(sink, dict):
+            self.speaker = audio_io.open_sink(**sink)
         else:
-            if isinstance(speaker_index_or_name, str):
-                id = speaker_index_or_name
-            elif isinstance(speaker_index_or_name, int):
-                id = sc.all_speakers()[speaker_index_or_name].name
-            else:
-                raise ValueError(
-                    "Type of `speaker_index_or_name must be str or int. Input: {}".format(type(speaker_index_or_name))
-                )
+            self.speaker = sink
+
+        self.voice_options = voice_options or {}
+        self.block_duration = block_duration
+        self.sample_rate = sample_rate
+        self.progress_callbacks: list[Callable[[str, float, float], None]] = []
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: set[Future] = set()
+        self._held_player: Optional[tuple[ExitStack, Any, tuple[int, int]]] = None  # (stack, player, key)
+        self.cache = WaveCache(**cache) if cache is not None else None
+        if prewarm_phrases and self.cache is not None:
+            threading.Thread(target=self.prewarm, args=(prewarm_phrases,), daemon=True).start()
+
+    def synthesize(self, text: str) -> tuple[np.ndarray, int]:
+        """Synthesize speech wave from text.
+
+        Args:
+            text (str): Japanese text.
+
+        Returns:
+            wave (np.ndarray): float32 speech wave. Range is -1.0 ~ 1.0
+            sample_rate (int): Sample rate of wave.
+        """
+        with tracing.span("speaker.synthesize"):
+            if self.cache is None:
+                wave, sr = pyopenjtalk.tts(text, **self.voice_options)
+                return convert(wave, sr, self.sample_rate, INT16_SCALE)
+
+            key = self.cache.make_key(text, **self.voice_options)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return convert(*cached, self.sample_rate)
+            wave, sr = convert(*pyopenjtalk.tts(text, **self.voice_options), self.sample_rate, INT16_SCALE)
+            return self.cache.put(key, wave, sr), sr
+
+    def warm_up(self) -> None:
+        """Synthesize a short text without caching, so that `pyopenjtalk` loads its dictionary and
+        voice before the first responce."""
+        pyopenjtalk.tts("あ", **self.voice_options)
+
+    def prewarm(self, phrases: Iterable[str]) -> int:
+        """Synthesize phrases into the cache, so that they are spoken without synthesis delay.
+
+        Phrases are split into sentences in the same way as streamed responces are spoken.
+
+        Args:
+            phrases (Iterable[str]): Japanese texts.
+
+        Returns:
+            count (int): Number of newly synthesized sentences.
+        """
+        if self.cache is None:
+            raise RuntimeError("Cache is disabled. Please specify `cache` option.")
+
+        count = 0
+        for phrase in phrases:
+            for text in split_sentences([phrase]):
+                if self.cache.make_key(text, **self.voice_options) in self.cache:
+                    continue
+                self.synthesize(text)
+                count += 1
+        return count
+
+    @property
+    def generation(self) -> int:
+        """Number of :meth:`stop` calls. Playback started before a stop is interrupted."""
+        return self._generation
+
+    @property
+    def is_speaking(self) -> bool:
+        """Whether texts queued by :meth:`speak_async` are not finished yet."""
+        with self._lock:
+            return any(not future.done() for future in self._pending)
+
+    def add_progress_callback(self, callback: Callable[[str, float, float], None]) -> None:
+        """Add callback which is called with `(text, played_seconds, duration_seconds)` each time a
+        block of the wave of `text` is written to the device."""
+        self.progress_callbacks.append(callback)
+
+    def _write(self, player, wave: np.ndarray, sample_rate: int, text: str, generation: int) -> float:
+        """Write wave to player block by block until :attr:`generation` changes.
+
+        Returns:
+            played (float): Seconds of written wave.
+        """
+        block_size = max(int(self.block_duration * sample_rate), 1)
+        duration = len(wave) / sample_rate
+        tracing.mark("first_audio")
+        with tracing.span("speaker.play"):
+            for start in range(0, len(wave), block_size):
+                if self._generation != generation:
+                    return start / sample_rate
+                player.play(wave[start : start + block_size])
+                played = min(start + block_size, len(wave)) / sample_rate
+                for callback in self.progress_callbacks:
+                    callback(text, played, duration)
+        return duration
+
+    def play(self, wave: np.ndarray, sample_rate: int, text: str = "", keep_open: bool = False) -> float:
+        """Play wave. This blocks until playback is finished or stopped by :meth:`stop`.
+
+        Args:
+            wave (np.ndarray): Speech wave.
+            sample_rate (int): Sample rate of wave.
+            text (str): Text of wave which is passed to progress callbacks.
+            keep_open (bool): Keep the player stream open after playback, so that following waves
+                of the same sample rate are played on it without gaps, e.g. sentences of a turn. It
+                is closed by :meth:`release_player`, and reopened after :meth:`stop`. Waves played
+                with `keep_open` must be played from one thread.
 
-            self.speaker = sc.get_speaker(id)
+        Returns:
+            played (float): Seconds of played wave.
+        """
+        generation = self._generation
+        if keep_open:
+            return self._write(self._hold_player(sample_rate, generation), wave, sample_rate, text, generation)
+        self.release_player()
+        with self.speaker.player(samplerate=sample_rate) as player:
+            return self._write(player, wave, sample_rate, text, generation)
+
+    def _hold_player(self, sample_rate: int, generation: int):
+        if self._held_player is not None:
+            stack, player, held_key = self._held_player
+            if held_key == (sample_rate, generation):
+                return player
+            stack.close()
+        stack = ExitStack()
+        player = stack.enter_context(self.speaker.player(samplerate=sample_rate))
+        self._held_player = (stack, player, (sample_rate, generation))
+        return player
+
+    def release_player(self) -> None:
+        """Close the player stream kept open by :meth:`play`."""
+        held, self._held_player = self._held_player, None
+        if held is not None:
+            held[0].close()
+
+    def speak_stream(self, texts: Iterable[str], lookahead: int = 2) -> dict:
+        """Synthesize and play texts one after another. This blocks until playback is finished or
+        stopped by :meth:`stop`.
+
+        Texts are synthesized on a worker thread up to `lookahead` chunks ahead while the previous
+        chunk is playing, and all chunks are written to one open player stream so that there are no
+        gaps between them. `texts` can be a stream, e.g. sentences of a streamed responce.
+
+        Args:
+            texts (Iterable[str]): Japanese texts such as sentences.
+            lookahead (int): Max number of synthesized chunks waiting for playback.
+
+        Returns:
+            stats (dict): `time_to_first_audio` (seconds until the first chunk is played, None if
+                nothing is played), `chunks`, `audio_duration` (played seconds), `synthesis_time` in
+                seconds, `interrupted` and `text` (joined texts taken from `texts`, "" if stopped
+                before starting).
+        """
+        return self._speak_stream(texts, lookahead, self._generation)
+
+    def _speak_stream(self, texts: Iterable[str], lookahead: int, generation: int) -> dict:
+        start = time.perf_counter()
+        stats = {
+            "time_to_first_audio": None,
+            "chunks": 0,
+            "audio_duration": 0.0,
+            "synthesis_time": 0.0,
+            "interrupted": False,
+            "text": "",
+        }
+        if self._generation != generation:  # stopped while queued.
+            if hasattr(texts, "close"):
+                texts.close()
+            stats["interrupted"] = True
+            return stats
+
+        waves: queue.Queue = queue.Queue(maxsize=lookahead)
+        stop = threading.Event()
+        worker = threading.Thread(
+            target=tracing.bind(self._synthesize_all), args=(texts, waves, stop, stats), daemon=True
+        )
+        worker.start()
+        try:
+            self._play_all(waves, generation, start, stats)
+        finally:
+            stop.set()
+        # After `stop`, the worker may be blocked on `texts`, e.g. a stalled responce stream. A running generator
+        # can not be closed from this thread, so the worker is left to close it when the next text arrives.
+        worker.join(STREAM_CLOSE_TIMEOUT if stats["interrupted"] else None)
+        return stats
+
+    @staticmethod
+    def _put_until_stopped(waves: queue.Queue, item, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                waves.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _synthesize_all(self, texts: Iterable[str], waves: queue.Queue, stop: threading.Event, stats: dict) -> None:
+        """Worker of :meth:`speak_stream`. Puts `(text, wave, sample_rate)`, an exception, and None at the end."""
+        try:
+            for text in texts:
+                if stop.is_set():
+                    break
+                stats["text"] += text
+                if text.strip() == "":
+                    continue
+                synthesis_start = time.perf_counter()
+                wave, sr = self.synthesize(text)
+                stats["synthesis_time"] += time.perf_counter() - synthesis_start
+                self._put_until_stopped(waves, (text, wave, sr), stop)
+        except Exception as e:
+            self._put_until_stopped(waves, e, stop)
+        finally:
+            if hasattr(texts, "close"):
+                texts.close()
+            self._put_until_stopped(waves, None, stop)
+
+    def _play_all(self, waves: queue.Queue, generation: int, start: float, stats: dict) -> None:
+        """Play waves of :meth:`_synthesize_all` on one player stream until the end or :meth:`stop`."""
+        with ExitStack() as stack:
+            player, player_sr = None, None
+            while True:
+                if self._generation != generation:
+                    stats["interrupted"] = True
+                    return
+                try:
+                    item = waves.get(timeout=self.block_duration)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
 
-    def speak_text(self, text: str) -> None:
-        """Speech to text.
+                text, wave, sr = item
+                if player is None or sr != player_sr:
+                    stack.close()
+                    player, player_sr = stack.enter_context(self.speaker.player(samplerate=sr)), sr
+                if stats["time_to_first_audio"] is None:
+                    stats["time_to_first_audio"] = time.perf_counter() - start
+                stats["audio_duration"] += self._write(player, wave, sr, text, generation)
+                stats["chunks"] += 1
+
+    def speak_text(self, text: str) -> dict:
+        """Speech to text. Sentences are synthesized while the previous one is playing.
 
         Args:
             text (str): Japanese text.
+
+        Returns:
+            stats (dict): Stats of :meth:`speak_stream`.
+        """
+        return self.speak_stream(split_sentences([text]))
+
+    def speak_async(self, texts: Iterable[str], lookahead: int = 2) -> Future:
+        """Queue texts and return immediately. Queued texts are spoken one after another on a
+        background thread by :meth:`speak_stream`.
+
+        Args:
+            texts (Iterable[str]): Japanese texts such as sentences.
+            lookahead (int): Max number of synthesized chunks waiting for playback.
+
+        Returns:
+            future (Future): Future of the stats of :meth:`speak_stream`.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="TextSpeaker")
+            future = self._executor.submit(tracing.bind(self._speak_stream), texts, lookahead, self._generation)
+            self._pending.add(future)
+        future.add_done_callback(self._discard_pending)
+        return future
+
+    def _discard_pending(self, future: Future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+
+    def stop(self) -> None:
+        """Stop the current playback immediately and discard queued texts. Synthesis of the
+        discarded texts is also stopped. Their iterators are closed when they yield the next text,
+        which is waited for at most :data:`STREAM_CLOSE_TIMEOUT` seconds, so that a stalled stream
+        does not block the following texts."""
+        with self._lock:
+            self._generation += 1
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until all queued texts are spoken.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait. If None, waits forever.
+
+        Returns:
+            finished (bool): Whether all queued texts are finished.
         """
-        wave, sr = pyopenjtalk.tts(text)
-        wave = wave / (2**15)
+        with self._lock:
+            pending = list(self._pending)
+        _, not_done = wait(pending, timeout)
+        return len(not_done) == 0
 
-        self.speaker.play(wave, sr)
+    def close(self) -> None:
+        """Stop playback, shutdown the background thread and close the offline audio sink."""
+        self.stop()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        self.release_player()
+        if isinstance(self.speaker, audio_io.NullSink):
+            self.speaker.close()
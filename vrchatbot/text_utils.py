@@ -0,0 +1,29 @@
+from typing import Generator, Iterable
+
+SENTENCE_DELIMITERS = "。！？、"
+
+
+def split_sentences(deltas: Iterable[str], delimiters: str = SENTENCE_DELIMITERS) -> Generator[str, None, None]:
+    """Split streamed text into sentences as soon as each one is complete.
+
+    Args:
+        deltas (Iterable[str]): Text pieces, e.g. :meth:`vrchatbot.chatbot.ChatBot.responce_stream`.
+        delimiters (str): Characters which end a sentence. They are kept in the sentence.
+
+    Yields:
+        sentence (str): Sentence. Whitespace only sentences are skipped.
+    """
+    buffer = ""
+    for delta in deltas:
+        buffer += delta
+        start = 0
+        for i, c in enumerate(buffer):
+            if c in delimiters:
+                sentence = buffer[start : i + 1]
+                start = i + 1
+                if sentence.strip() not in ("", c):
+                    yield sentence
+        buffer = buffer[start:]
+
+    if buffer.strip() != "":
+        yield buffer
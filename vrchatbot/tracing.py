@@ -0,0 +1,298 @@
+"""Per-turn latency tracing.
+
+A :class:`Turn` is the unit of one conversation turn, from the user's speech to the bot's
+playback. The current turn is held in a context variable, so that components record spans with
+:func:`span` without passing the turn around. When there is no current turn, :func:`span` does
+nothing but one context variable lookup.
+
+Threads do not inherit context variables. Work handed over to another thread is run with
+:func:`bind`, and items passed between pipeline stages carry their turn explicitly.
+"""
+
+import contextvars
+import http.server
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+SPEECH_END = "speech_end"
+
+_current_turn: contextvars.ContextVar[Optional["Turn"]] = contextvars.ContextVar("vrchatbot_turn", default=None)
+
+
+class Turn:
+    """Monotonic span timings and marks of one conversation turn."""
+
+    __slots__ = ("id", "start", "wall_time", "spans", "marks")
+
+    def __init__(self, id: int) -> None:
+        self.id = id
+        self.start = time.perf_counter()
+        self.wall_time = time.time()
+        self.spans: list[tuple[str, float, float]] = []
+        self.marks: dict[str, float] = {}
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        """Add span of `time.perf_counter` values."""
+        self.spans.append((name, start, end))
+
+    def mark(self, name: str, t: Optional[float] = None) -> None:
+        """Mark the first time of an event, e.g. "first_audio"."""
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() if t is None else t
+
+    def latencies(self) -> dict[str, float]:
+        """Returns total seconds of each span name, and seconds from :data:`SPEECH_END` to each mark
+        as `turn.<mark>`."""
+        result: dict[str, float] = {}
+        for name, start, end in self.spans:
+            result[name] = result.get(name, 0.0) + end - start
+        speech_end = self.marks.get(SPEECH_END)
+        if speech_end is not None:
+            result.update({f"turn.{name}": t - speech_end for name, t in self.marks.items() if name != SPEECH_END})
+        return result
+
+    def to_dict(self) -> dict:
+        """Times are seconds from the start of the turn."""
+        return {
+            "turn": self.id,
+            "time": self.wall_time,
+            "spans": [[name, round(start - self.start, 6), round(end - start, 6)] for name, start, end in self.spans],
+            "marks": {name: round(t - self.start, 6) for name, t in self.marks.items()},
+        }
+
+
+class _Span:
+    __slots__ = ("name", "turn", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.turn = _current_turn.get()
+
+    def __enter__(self) -> "_Span":
+        if self.turn is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        if self.turn is not None:
+            self.turn.add_span(self.name, self.start, time.perf_counter())
+
+
+def span(name: str) -> _Span:
+    """Context manager which records a span of the block on the current turn."""
+    return _Span(name)
+
+
+def add_span(name: str, start: float, end: float) -> None:
+    """Record a span of `time.perf_counter` values on the current turn."""
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.add_span(name, start, end)
+
+
+def mark(name: str, t: Optional[float] = None) -> None:
+    """Mark an event on the current turn. See :meth:`Turn.mark`."""
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.mark(name, t)
+
+
+def current_turn() -> Optional[Turn]:
+    return _current_turn.get()
+
+
+def set_current_turn(turn: Optional[Turn]) -> None:
+    """Set the current turn of this thread, e.g. in the recording thread at voice onset."""
+    _current_turn.set(turn)
+
+
+class activate:
+    """Context manager which makes `turn` the current turn in the block."""
+
+    def __init__(self, turn: Optional[Turn]) -> None:
+        self.turn = turn
+
+    def __enter__(self) -> Optional[Turn]:
+        self._token = _current_turn.set(self.turn)
+        return self.turn
+
+    def __exit__(self, *args: Any) -> None:
+        _current_turn.reset(self._token)
+
+
+def bind(func: Callable) -> Callable:
+    """Returns `func` which runs in a copy of the current context, for passing it to other threads."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwds: context.run(func, *args, **kwds)
+
+
+class TracedQueue:
+    """Queue adapter which puts `(current turn, item)` into `queue`. Pass this to
+    :meth:`Recorder.record_forever` so that recorded waves carry their turn."""
+
+    def __init__(self, queue: Any) -> None:
+        self.queue = queue
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None) -> None:
+        self.queue.put((_current_turn.get(), item), block, timeout)
+
+
+class Tracer:
+    """Collects finished turns into rolling windows of span durations and exports them.
+
+    Span durations are aggregated by span name. Besides, for each mark, the time from the end of
+    the user's speech (:data:`SPEECH_END`) is aggregated as `turn.<mark>`, e.g.
+    `turn.first_audio` is the response latency which the user feels.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        window: int = 1024,
+        jsonl_path: Optional[str] = None,
+        prometheus_port: Optional[int] = None,
+        prometheus_host: str = "127.0.0.1",
+    ) -> None:
+        """
+        Args:
+            enabled (bool): If False, :meth:`start_turn` returns None and nothing is recorded.
+            window (int): Number of recent samples of each span for percentiles.
+            jsonl_path (Optional[str]): File where each finished turn is appended as a JSON line.
+            prometheus_port (Optional[int]): If given, metrics are served at
+                `http://<prometheus_host>:<prometheus_port>/metrics` in Prometheus text format.
+            prometheus_host (str): Host address of the metrics endpoint.
+        """
+        self.enabled = enabled
+        self.window = window
+        self.jsonl_path = jsonl_path
+
+        self.turn_count = 0
+        self._ids = itertools.count(1)
+        self._samples: dict[str, deque] = {}
+        self._counts: dict[str, int] = {}
+        self._sums: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        self._file = open(jsonl_path, "a", encoding="utf-8") if enabled and jsonl_path is not None else None
+        self._server: Optional[http.server.ThreadingHTTPServer] = None
+        if enabled and prometheus_port is not None:
+            self.serve(prometheus_port, prometheus_host)
+
+    def start_turn(self) -> Optional[Turn]:
+        """Returns new turn, or None if disabled."""
+        if not self.enabled:
+            return None
+        return Turn(next(self._ids))
+
+    def end_turn(self, turn: Optional[Turn]) -> None:
+        """Aggregate spans of the finished turn and write it to :attr:`jsonl_path`."""
+        if turn is None:
+            return
+
+        samples = [(name, end - start) for name, start, end in turn.spans]
+        speech_end = turn.marks.get(SPEECH_END)
+        if speech_end is not None:
+            samples += [(f"turn.{name}", t - speech_end) for name, t in turn.marks.items() if name != SPEECH_END]
+        line = json.dumps(turn.to_dict(), ensure_ascii=False) + "\n" if self._file is not None else None
+
+        with self._lock:
+            for name, seconds in samples:
+                self._observe(name, seconds)
+            self.turn_count += 1
+            if line is not None:
+                self._file.write(line)
+                self._file.flush()
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Aggregate a duration which does not belong to a turn."""
+        with self._lock:
+            self._observe(name, seconds)
+
+    def _observe(self, name: str, seconds: float) -> None:
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples[name] = deque(maxlen=self.window)
+            self._counts[name] = 0
+            self._sums[name] = 0.0
+        samples.append(seconds)
+        self._counts[name] += 1
+        self._sums[name] += seconds
+
+    def summary(self) -> dict[str, dict]:
+        """Returns `count`, `sum` and percentiles `p50`, `p95` and `p99` of the recent window of each span."""
+        with self._lock:
+            snapshot = {name: (list(s), self._counts[name], self._sums[name]) for name, s in self._samples.items()}
+
+        result = {}
+        for name, (samples, count, total) in sorted(snapshot.items()):
+            percentiles = np.percentile(samples, [q * 100 for q in QUANTILES])
+            result[name] = {"count": count, "sum": total}
+            result[name].update({f"p{int(q * 100)}": float(p) for q, p in zip(QUANTILES, percentiles)})
+        return result
+
+    def format_summary(self) -> str:
+        """Returns one line per span for console output."""
+        return "\n".join(
+            f"{name}: p50={s['p50'] * 1000:.0f}ms p95={s['p95'] * 1000:.0f}ms p99={s['p99'] * 1000:.0f}ms n={s['count']}"
+            for name, s in self.summary().items()
+        )
+
+    def format_prometheus(self) -> str:
+        """Returns metrics in Prometheus text exposition format."""
+        lines = [
+            "# HELP vrchatbot_turns_total Number of finished turns.",
+            "# TYPE vrchatbot_turns_total counter",
+            f"vrchatbot_turns_total {self.turn_count}",
+            "# HELP vrchatbot_span_seconds Duration of spans of turns.",
+            "# TYPE vrchatbot_span_seconds summary",
+        ]
+        for name, s in self.summary().items():
+            for q in QUANTILES:
+                lines.append(f'vrchatbot_span_seconds{{span="{name}",quantile="{q}"}} {s[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'vrchatbot_span_seconds_sum{{span="{name}"}} {s["sum"]:.6f}')
+            lines.append(f'vrchatbot_span_seconds_count{{span="{name}"}} {s["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> http.server.ThreadingHTTPServer:
+        """Serve :meth:`format_prometheus` at `/metrics` on a daemon thread."""
+        tracer = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.format_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        return self._server
+
+    @property
+    def server_port(self) -> Optional[int]:
+        return self._server.server_address[1] if self._server is not None else None
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
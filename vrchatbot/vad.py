@@ -0,0 +1,161 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from .constants import RECOGNIZE_SAMPLE_RATE
+
+
+class VoiceActivityDetector:
+    """Interface of voice activity detectors used by :class:`Recorder`.
+
+    Detectors receive consecutive recorded blocks and may keep state between them.
+    """
+
+    def reset(self) -> None:
+        """Reset internal state. Called when a recording starts."""
+
+    def detect(self, wave: np.ndarray) -> Optional[int]:
+        """Detect voice in a recorded block.
+
+        Args:
+            wave (np.ndarray): 1d array.
+
+        Returns:
+            start_idx (Optional[int]): Index of the first voiced sample. If the block is not voiced,
+                `None` is returned.
+        """
+        raise NotImplementedError
+
+
+class SpectralVAD(VoiceActivityDetector):
+    """Frame level voice activity detector with energy and spectral features.
+
+    A frame is a speech candidate when all of the followings are satisfied.
+        - Its energy exceeds the adaptive noise floor by `snr_threshold_db`, and its RMS exceeds
+          `volume_threshold`.
+        - The ratio of energy in the speech band (`band`) to the total energy is `band_ratio_threshold`
+          or more.
+        - Its zero crossing rate is `max_zero_crossing_rate` or less.
+
+    The noise floor follows the frame energy quickly downward and slowly upward, so stationary
+    sounds such as background music or fans are absorbed into the floor. Voice begins after
+    `min_speech_duration` of consecutive candidates and continues for `hangover_duration`
+    after them.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = RECOGNIZE_SAMPLE_RATE,
+        frame_length: int = 512,
+        volume_threshold: float = 0.005,
+        snr_threshold_db: float = 9.0,
+        band: tuple[float, float] = (300.0, 3400.0),
+        band_ratio_threshold: float = 0.5,
+        max_zero_crossing_rate: float = 0.25,
+        noise_floor_rise_time: float = 4.0,  # seconds
+        noise_floor_fall_time: float = 0.1,  # seconds
+        min_speech_duration: float = 0.06,  # seconds
+        hangover_duration: float = 0.3,  # seconds
+    ) -> None:
+        """
+        Args:
+            sample_rate (int): Sample rate of input waves.
+            frame_length (int): Frame size for computing features.
+            volume_threshold (float): Min RMS of speech frames.
+            snr_threshold_db (float): Min ratio of frame energy to noise floor in dB.
+            band (tuple[float, float]): Speech frequency band [Hz].
+            band_ratio_threshold (float): Min ratio of speech band energy to total energy.
+            max_zero_crossing_rate (float): Max zero crossing rate per sample of speech frames.
+            noise_floor_rise_time (float): Time constant of the noise floor rising.
+            noise_floor_fall_time (float): Time constant of the noise floor falling.
+            min_speech_duration (float): Consecutive candidate duration for starting voice.
+            hangover_duration (float): Duration of keeping voice after the last candidate frame.
+        """
+        self.sample_rate = sample_rate
+        self.frame_length = frame_length
+        self.volume_threshold = volume_threshold
+        self.snr_threshold_db = snr_threshold_db
+        self.band = band
+        self.band_ratio_threshold = band_ratio_threshold
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+
+        frame_duration = frame_length / sample_rate
+        self.rise_rate = 1.0 - math.exp(-frame_duration / noise_floor_rise_time)
+        self.fall_rate = 1.0 - math.exp(-frame_duration / noise_floor_fall_time)
+        self.min_speech_frames = max(1, round(min_speech_duration / frame_duration))
+        self.hangover_frames = round(hangover_duration / frame_duration)
+
+        self.window = np.hanning(frame_length).astype(np.float32)
+        freqs = np.fft.rfftfreq(frame_length, 1.0 / sample_rate)
+        self.band_mask = (freqs >= band[0]) & (freqs <= band[1])
+
+        self.reset()
+
+    def reset(self) -> None:
+        self.noise_floor_db: Optional[float] = None
+        self.candidate_run = 0
+        self.hangover_left = 0
+
+    def frame_features(self, wave: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Computing features of each frame.
+
+        Args:
+            wave (np.ndarray): 1d array. The last frame is zero padded.
+
+        Returns:
+            energy_db (np.ndarray): Mean square energy of each frame in dB.
+            band_ratio (np.ndarray): Ratio of speech band energy.
+            zero_crossing_rate (np.ndarray): Zero crossing rate per sample.
+        """
+        n_frames = -(-len(wave) // self.frame_length)
+        if n_frames * self.frame_length != len(wave):
+            wave = np.pad(wave, (0, n_frames * self.frame_length - len(wave)))
+        frames = wave.reshape(n_frames, self.frame_length)
+
+        mean_square = np.einsum("ij,ij->i", frames, frames) / self.frame_length
+        energy_db = 10.0 * np.log10(mean_square + 1e-12)
+
+        power = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2
+        band_ratio = power[:, self.band_mask].sum(axis=1) / (power.sum(axis=1) + 1e-12)
+
+        signs = np.signbit(frames)
+        zero_crossing_rate = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / self.frame_length
+
+        return energy_db, band_ratio, zero_crossing_rate
+
+    def detect(self, wave: np.ndarray) -> Optional[int]:
+        energy_db, band_ratio, zero_crossing_rate = self.frame_features(wave)
+        if self.noise_floor_db is None:
+            self.noise_floor_db = float(energy_db[0])
+
+        min_energy_db = 20.0 * math.log10(self.volume_threshold) if self.volume_threshold > 0 else -np.inf
+        candidates = (
+            (energy_db >= min_energy_db)
+            & (band_ratio >= self.band_ratio_threshold)
+            & (zero_crossing_rate <= self.max_zero_crossing_rate)
+        )
+
+        start_idx = None
+        for i, e in enumerate(energy_db.tolist()):
+            if candidates[i] and e >= self.noise_floor_db + self.snr_threshold_db:
+                self.candidate_run += 1
+            else:
+                self.candidate_run = 0
+
+            if self.candidate_run >= self.min_speech_frames:
+                self.hangover_left = self.hangover_frames
+                voiced = True
+            elif self.hangover_left > 0:
+                self.hangover_left -= 1
+                voiced = True
+            else:
+                voiced = False
+
+            if voiced and start_idx is None:
+                start_idx = i * self.frame_length
+
+            rate = self.fall_rate if e < self.noise_floor_db else self.rise_rate
+            self.noise_floor_db += rate * (e - self.noise_floor_db)
+
+        return start_idx
@@ -0,0 +1,152 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+
+from .audio_buffer import INT16_SCALE, to_float32
+
+DISK_DTYPES = {"float32": "f32", "int16": "i16"}
+
+
+class WaveCache:
+    """Content addressed cache of synthesized waves.
+
+    Waves are kept in memory in least recently used order within `max_bytes`. If `cache_dir` is
+    given, waves are also stored as raw `dtype` files named `<key>_<sample rate>.<ext>` and
+    memory-mapped on read, so that they survive restarts.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20, cache_dir: Optional[str] = None, dtype: str = "float32") -> None:
+        """
+        Args:
+            max_bytes (int): Max total bytes of waves in memory.
+            cache_dir (Optional[str]): Directory of disk tier. If None, only memory is used.
+            dtype (str): Sample type of disk files. "float32" or "int16". float32 files are used
+                without copy. int16 files are half size, but converted to float on read.
+        """
+        if dtype not in DISK_DTYPES:
+            raise ValueError(f"Unknown dtype: {dtype}. Please use one of {list(DISK_DTYPES)}.")
+
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.dtype = dtype
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_bytes = 0
+        self._entries: OrderedDict[str, tuple[np.ndarray, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(text: str, **params: Any) -> str:
+        """Key from text and voice parameters."""
+        source = json.dumps({"text": text, **params}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries or self._find_file(key) is not None
+
+    def get(self, key: str) -> Optional[tuple[np.ndarray, int]]:
+        """Returns `(wave, sample_rate)` or None. Wave is read-only float32 array."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+
+        path = self._find_file(key)
+        wave = self._map_file(path) if path is not None else None
+        if wave is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        sample_rate = int(os.path.basename(path).split(".")[0].rsplit("_", 1)[1])
+        if self.dtype == "int16":
+            wave = to_float32(wave, INT16_SCALE)
+            wave.flags.writeable = False
+
+        with self._lock:
+            self.disk_hits += 1
+            self._set(key, wave, sample_rate)
+        return wave, sample_rate
+
+    def put(self, key: str, wave: np.ndarray, sample_rate: int) -> np.ndarray:
+        """Store wave. Range of wave must be -1.0 ~ 1.0. float32 wave is stored without copy and
+        made read-only.
+
+        Returns:
+            wave (np.ndarray): Stored read-only float32 wave.
+        """
+        wave = to_float32(wave)
+        wave.flags.writeable = False
+        with self._lock:
+            self._set(key, wave, sample_rate)
+
+        if self.cache_dir is not None:
+            path = self._file_path(key, sample_rate)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.dtype == "int16":
+                scaled = wave * np.float32(2**15)
+                np.round(scaled, out=scaled)
+                np.clip(scaled, -(2**15), 2**15 - 1, out=scaled)
+                data = scaled.astype(np.int16)
+            else:
+                data = wave
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            data.tofile(tmp_path)
+            os.replace(tmp_path, path)
+        return wave
+
+    def _set(self, key: str, wave: np.ndarray, sample_rate: int) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= old[0].nbytes
+        if wave.nbytes > self.max_bytes:
+            return
+        self._entries[key] = (wave, sample_rate)
+        self.memory_bytes += wave.nbytes
+        while self.memory_bytes > self.max_bytes:
+            _, (w, _) = self._entries.popitem(last=False)
+            self.memory_bytes -= w.nbytes
+
+    def _file_path(self, key: str, sample_rate: int) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}_{sample_rate}.{DISK_DTYPES[self.dtype]}")
+
+    def _find_file(self, key: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        paths = glob.glob(os.path.join(self.cache_dir, key[:2], f"{key}_*.{DISK_DTYPES[self.dtype]}"))
+        return paths[0] if len(paths) > 0 else None
+
+    def _map_file(self, path: str) -> Optional[np.ndarray]:
+        """Returns memory-mapped wave of the file, or None if it is empty or unreadable, e.g. left
+        truncated by a crash. Such a file is removed, so that the wave is stored again."""
+        try:
+            if os.path.getsize(path) > 0:
+                return np.memmap(path, dtype=self.dtype, mode="r")
+        except (ValueError, OSError):
+            pass
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.memory_bytes = 0